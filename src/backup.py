@@ -4,9 +4,21 @@ import time
 import tempfile
 import re
 from datetime import datetime
-from coveo_api import create_snapshot, export_snapshot_content, delete_snapshot
-from git_utils import commit_snapshot
-from compare import compare_jsons_in_zips
+import requests
+from config import get_organization_ids
+from coveo_api import CoveoClient, IncompleteDownloadError, POOL_SIZE
+from circuit_breaker import CircuitOpenError
+from git_utils import commit_manifest, commit_snapshot
+from compare import diff_manifests, file_sha256, same_json_bytes
+from manifest import build_manifest, manifest_leaves, read_manifest, write_manifest
+from shards import SNAPSHOT_SHARDS, parse_shards, export_sharded_snapshot
+from delete_queue import DeleteQueue, DeleteWorker, DELETE_LEASE
+from change_probe import CHANGE_PROBE_ENABLED, probe_for_changes, record_snapshot_fingerprints
+from http_metrics import METRICS
+from hedging import HEDGER
+from state import state_path
+from pipeline import (Pipeline, Stage, PIPELINE_CREATE_WORKERS, PIPELINE_BUILD_WORKERS,
+                      PIPELINE_DOWNLOAD_WORKERS)
 from logger import log_info, log_error
 from dotenv import load_dotenv
 
@@ -16,10 +28,18 @@ load_dotenv()
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 SNAPSHOT_DIR = os.path.join(PROJECT_ROOT, 'snapshots')
 REPO_PATH = PROJECT_ROOT  # Root of the repo
+# Errors of a download that the next run can resume where it stopped
+INTERRUPTED_DOWNLOAD_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                               IncompleteDownloadError)
+# State subdirectory receiving snapshot downloads, named after the snapshot so that a run can
+# resume the .part file of a download an earlier run left unfinished
+DOWNLOADS_DIR = "downloads"
 
 
 def get_latest_snapshot_zip(directory=SNAPSHOT_DIR, pattern=r"snapshot_(\d{8}_\d{6})\.zip$"):
     """Return the path to the most recent snapshot zip file in the given directory, or None if none exist."""
+    if not os.path.isdir(directory):
+        return None
     regex = re.compile(pattern)
     candidates = [(match.group(1), fname) for fname in os.listdir(directory) if (match := regex.match(fname))]
     if not candidates:
@@ -27,72 +47,290 @@ def get_latest_snapshot_zip(directory=SNAPSHOT_DIR, pattern=r"snapshot_(\d{8}_\d
     latest_fname = sorted(candidates, key=lambda x: x[0], reverse=True)[0][1]
     return os.path.join(directory, latest_fname)
 
-def ensure_snapshot_dir_exists():
-    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+def get_snapshot_dir(organization_id):
+    """Snapshots of each organization go to snapshots/<organization_id>/."""
+    return os.path.join(SNAPSHOT_DIR, organization_id)
+
+def get_legacy_snapshot_dir(organization_id, organization_ids):
+    """
+    Return snapshots/ if it holds the history of organization_id, else None.
+
+    Older versions saved the snapshots of a single organization straight into snapshots/.
+    That history is taken to belong to COVEO_ORGANIZATION_ID, or else to the only
+    organization configured.
+    """
+    legacy_organization_id = os.getenv("COVEO_ORGANIZATION_ID", "").strip() \
+        or (organization_ids[0] if len(organization_ids) == 1 else None)
+    return SNAPSHOT_DIR if organization_id == legacy_organization_id else None
+
+def ensure_snapshot_dir_exists(directory=SNAPSHOT_DIR):
+    os.makedirs(directory, exist_ok=True)
+
+def wait_for_snapshot_ready(client, organization_id, snapshot_id):
+    log_info(f"Waiting for snapshot {snapshot_id} to be ready...")
+    start = time.monotonic()
+    client.wait_for_snapshot(organization_id, snapshot_id)
+    log_info(f"Snapshot {snapshot_id} ready after {time.monotonic() - start:.1f} seconds")
+
+def _downloads_dir():
+    directory = state_path(DOWNLOADS_DIR)
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def download_path(organization_id, snapshot_id):
+    """Return the path a snapshot is downloaded to, the same in every run."""
+    return os.path.join(_downloads_dir(), f"{organization_id}_{snapshot_id}.zip")
+
+def find_interrupted_download(delete_worker, organization_id):
+    """
+    Return the ID of a snapshot whose download an earlier run left unfinished, or None.
+
+    Only snapshots still leased in the delete queue can be resumed; the downloads of the
+    others are removed, as their snapshots are gone from the platform.
+    """
+    prefix, suffix = f"{organization_id}_", ".zip.part.json"
+    leased = delete_worker.queue.pending(organization_id)
+    found = None
+    for name in sorted(os.listdir(_downloads_dir())):
+        if not (name.startswith(prefix) and name.endswith(suffix)):
+            continue
+        snapshot_id = name[len(prefix):-len(suffix)]
+        if snapshot_id not in leased:
+            remove_download(download_path(organization_id, snapshot_id))
+        elif found is None:
+            found = snapshot_id
+    return found
 
-def wait_for_snapshot_ready(wait_seconds=60):
-    log_info(f"Waiting {wait_seconds} seconds for snapshot to be ready...")
-    time.sleep(wait_seconds)
+def remove_download(zip_path):
+    """Remove a downloaded snapshot and whatever an unfinished download of it left."""
+    for path in (zip_path, f"{zip_path}.part", f"{zip_path}.part.json"):
+        if os.path.exists(path):
+            os.remove(path)
 
-def export_snapshot_to_temp_zip(organization_id, snapshot_id):
-    """Export snapshot content to a temporary zip file and return its path."""
-    ensure_snapshot_dir_exists()
+def export_snapshot_to_temp_zip(client, organization_id, snapshot_id):
+    """Export snapshot content to its download path (see download_path) and return that path and its SHA-256."""
+    temp_zip_path = download_path(organization_id, snapshot_id)
+    _, sha256 = client.export_snapshot_content(organization_id, snapshot_id, temp_zip_path)
+    log_info(f"Exported new snapshot to {temp_zip_path} (sha256 {sha256})")
+    return temp_zip_path, sha256
+
+def export_sharded_snapshot_to_temp_zip(client, delete_worker, organization_id, snapshot_name):
+    """Export one snapshot per configured shard, merged into a temporary zip file; return its path, SHA-256 and snapshot IDs."""
     with tempfile.NamedTemporaryFile(suffix=".zip", delete=False) as tmpfile:
         temp_zip_path = tmpfile.name
-    export_snapshot_content(organization_id, snapshot_id, temp_zip_path)
-    log_info(f"Exported new snapshot to temporary file {temp_zip_path}")
-    return temp_zip_path
+    shards = parse_shards(SNAPSHOT_SHARDS)
+    log_info(f"Exporting snapshot as {len(shards)} shards")
+    start = time.monotonic()
+    _, sha256, snapshot_ids = export_sharded_snapshot(
+        client, organization_id, snapshot_name, shards, temp_zip_path,
+        on_created=lambda snapshot_id: lease_snapshot(delete_worker, organization_id, snapshot_id))
+    log_info(f"Exported merged snapshot to temporary file {temp_zip_path} in {time.monotonic() - start:.1f} seconds (sha256 {sha256})")
+    return temp_zip_path, sha256, snapshot_ids
+
+def lease_snapshot(delete_worker, organization_id, snapshot_id):
+    """Register a snapshot that was just created, so a later run deletes it if this one dies (see DELETE_LEASE)."""
+    delete_worker.queue.enqueue(organization_id, snapshot_id, delay=DELETE_LEASE)
+
+def delete_snapshots(delete_worker, organization_id, snapshot_ids):
+    """Queue server-side snapshots for deletion by the background worker, off the critical path."""
+    for snapshot_id in snapshot_ids:
+        delete_worker.queue.enqueue(organization_id, snapshot_id)
+    delete_worker.notify()
+    log_info(f"Queued deletion of snapshot(s) {', '.join(snapshot_ids)} from Coveo.")
 
-def handle_redundant_snapshot(temp_zip_path, organization_id, snapshot_id):
+def handle_redundant_snapshot(delete_worker, temp_zip_path, organization_id, snapshot_ids):
     os.remove(temp_zip_path)
     log_info("New snapshot is identical to the latest snapshot (JSON content). Deleted redundant snapshot.")
-    try:
-        delete_snapshot(organization_id, snapshot_id)
-        log_info(f"Deleted snapshot {snapshot_id} from Coveo.")
-    except Exception as e:
-        log_error(f"Failed to delete snapshot {snapshot_id} from Coveo: {e}")
+    delete_snapshots(delete_worker, organization_id, snapshot_ids)
 
-def handle_new_snapshot(temp_zip_path, snapshot_name, organization_id, snapshot_id):
-    final_zip_path = os.path.join(SNAPSHOT_DIR, f"{snapshot_name}.zip")
+def log_changes(organization_id, changes):
+    """Log how many resources of each type were added, removed or changed since the latest snapshot."""
+    if not changes:
+        log_info(f"Resources of {organization_id} are unchanged since the latest snapshot; only other content differs.")
+        return
+    log_info(f"Changes in {organization_id} since the latest snapshot: " + "; ".join(
+        f"{resource_type} " + ", ".join(f"{len(names)} {kind}" for kind, names in type_changes.items() if names)
+        for resource_type, type_changes in changes.items()))
+
+def handle_new_snapshot(delete_worker, temp_zip_path, snapshot_name, organization_id, snapshot_ids, snapshot_dir=SNAPSHOT_DIR,
+                        manifest=None, extra_paths=()):
+    ensure_snapshot_dir_exists(snapshot_dir)
+    final_zip_path = os.path.join(snapshot_dir, f"{snapshot_name}.zip")
     shutil.move(temp_zip_path, final_zip_path)
-    commit_snapshot(final_zip_path, REPO_PATH)
+    # The manifest is committed with the snapshot so the next run compares against it without parsing the ZIP
+    if manifest:
+        extra_paths = [write_manifest(final_zip_path, manifest), *extra_paths]
+    commit_snapshot(final_zip_path, REPO_PATH, extra_paths)
     log_info(f"Committed new snapshot: {final_zip_path}")
-    try:
-        delete_snapshot(organization_id, snapshot_id)
-        log_info(f"Deleted snapshot {snapshot_id} from Coveo.")
-    except Exception as e:
-        log_error(f"Failed to delete snapshot {snapshot_id} from Coveo: {e}")
+    delete_snapshots(delete_worker, organization_id, snapshot_ids)
 
-def backup_coveo_configuration():
-    organization_id = os.getenv("COVEO_ORGANIZATION_ID")
-    if not organization_id:
-        log_error("COVEO_ORGANIZATION_ID is not set in environment or .env file.")
-        return
 
-    snapshot_name = f"snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-    try:
-        # Step 1: Create the snapshot
-        snapshot_id = create_snapshot(organization_id, snapshot_name)
-        log_info(f"Created snapshot with ID {snapshot_id}")
+def load_latest_manifest(latest_snapshot_path):
+    """
+    Return the manifest of the latest snapshot, from its sidecar when it is current.
+
+    A snapshot without a current sidecar, e.g. one saved by an older version, is parsed and
+    its rebuilt sidecar committed on its own, whether or not a new snapshot follows, so that
+    later runs read the sidecar instead of parsing the ZIP again.
+    """
+    latest_sha256 = file_sha256(latest_snapshot_path)
+    manifest = read_manifest(latest_snapshot_path, latest_sha256)
+    if manifest is None:
+        log_info(f"Building manifest of {os.path.basename(latest_snapshot_path)}")
+        manifest = build_manifest(latest_snapshot_path, latest_sha256)
+        commit_manifest(write_manifest(latest_snapshot_path, manifest), REPO_PATH)
+    return manifest
+
+
+class OrgBackup:
+    """State of one organization's backup as it moves through the pipeline stages."""
+
+    def __init__(self, organization_id, snapshot_name, snapshot_dir, legacy_snapshot_dir=None):
+        self.organization_id = organization_id
+        self.snapshot_name = snapshot_name
+        self.snapshot_dir = snapshot_dir
+        self.legacy_snapshot_dir = legacy_snapshot_dir
+        self.snapshot_ids = []
+        self.temp_zip_path = None
+        self.temp_zip_sha256 = None
+        self.fingerprints = None
+        self.probe_time = None
+
+
+def create_stage(client, delete_worker, backup):
+    # Step 0: Skip the snapshot entirely when the change probe sees no change
+    if CHANGE_PROBE_ENABLED:
+        backup.probe_time = time.time()
+        changed, backup.fingerprints = probe_for_changes(client, backup.organization_id)
+        if not changed:
+            log_info(f"Change probe found no configuration change in {backup.organization_id} since the last snapshot. Skipped snapshot.")
+            return None
+    if SNAPSHOT_SHARDS:
+        # Shard snapshots are created (and leased), built and exported together in the download stage
+        return backup
+    # Step 1: Create the snapshot, unless an earlier run was cut off while downloading one
+    snapshot_id = find_interrupted_download(delete_worker, backup.organization_id)
+    if snapshot_id:
+        log_info(f"Resuming the download of snapshot {snapshot_id} of {backup.organization_id} left by an earlier run")
+    else:
+        snapshot_id = client.create_snapshot(backup.organization_id, backup.snapshot_name)
+        log_info(f"Created snapshot with ID {snapshot_id} for {backup.organization_id}")
+    backup.snapshot_ids = [snapshot_id]
+    lease_snapshot(delete_worker, backup.organization_id, snapshot_id)
+    return backup
+
+def build_stage(client, backup):
+    # Step 2: Wait for snapshot to be ready
+    if not SNAPSHOT_SHARDS:
+        wait_for_snapshot_ready(client, backup.organization_id, backup.snapshot_ids[0])
+    return backup
 
-        # Step 2: Wait for snapshot to be ready
-        wait_for_snapshot_ready()
+def download_stage(client, delete_worker, backup):
+    if SNAPSHOT_SHARDS:
+        # Steps 1-3: Create, wait for and export one snapshot per shard in parallel, merged into one ZIP
+        backup.temp_zip_path, backup.temp_zip_sha256, backup.snapshot_ids = export_sharded_snapshot_to_temp_zip(
+            client, delete_worker, backup.organization_id, backup.snapshot_name)
+    else:
+        # Step 3: Export the snapshot content as ZIP to its download path
+        backup.temp_zip_path, backup.temp_zip_sha256 = export_snapshot_to_temp_zip(
+            client, backup.organization_id, backup.snapshot_ids[0])
+    return backup
 
-        # Step 3: Export the snapshot content as ZIP to a temp file
-        temp_zip_path = export_snapshot_to_temp_zip(organization_id, snapshot_id)
+def commit_stage(delete_worker, backup):
+    # Step 4: Compare with the latest snapshot, from the ZIP central directories, then from their manifests
+    latest_snapshot_path = get_latest_snapshot_zip(backup.snapshot_dir)
+    if latest_snapshot_path is None and backup.legacy_snapshot_dir:
+        # Until the organization has a snapshot of its own, its history continues from snapshots/
+        latest_snapshot_path = get_latest_snapshot_zip(backup.legacy_snapshot_dir)
+    if latest_snapshot_path and same_json_bytes(backup.temp_zip_path, latest_snapshot_path):
+        identical, manifest = True, None
+    else:
+        manifest = build_manifest(backup.temp_zip_path, backup.temp_zip_sha256)
+        latest_manifest = None
+        if latest_snapshot_path:
+            try:
+                # The previous ZIP is hashed to check its sidecar, and only parsed when the sidecar is missing
+                # or stale, e.g. for snapshots saved by older versions
+                latest_manifest = load_latest_manifest(latest_snapshot_path)
+            except Exception as e:
+                log_error(f"Could not read the latest snapshot {latest_snapshot_path}: {e}")
+        identical = latest_manifest is not None and latest_manifest["contentDigest"] == manifest["contentDigest"]
+    if identical:
+        handle_redundant_snapshot(delete_worker, backup.temp_zip_path, backup.organization_id, backup.snapshot_ids)
+    else:
+        if latest_manifest is not None:
+            try:
+                latest_manifest = manifest_leaves(latest_snapshot_path, latest_manifest)
+                log_changes(backup.organization_id, diff_manifests(latest_manifest, manifest))
+            except Exception as e:
+                log_error(f"Could not diff {backup.organization_id} against the latest snapshot: {e}")
+        # Step 5: Commit the new snapshot and its manifest to Git and delete from Coveo
+        handle_new_snapshot(delete_worker, backup.temp_zip_path, backup.snapshot_name, backup.organization_id,
+                            backup.snapshot_ids, backup.snapshot_dir, manifest)
 
-        # Step 4: Compare with the latest snapshot
-        latest_snapshot_path = get_latest_snapshot_zip()
-        if latest_snapshot_path and compare_jsons_in_zips(temp_zip_path, latest_snapshot_path):
-            handle_redundant_snapshot(temp_zip_path, organization_id, snapshot_id)
+    # Step 6: Remember what the change probe saw right before this snapshot
+    if backup.fingerprints:
+        record_snapshot_fingerprints(backup.organization_id, backup.fingerprints, backup.probe_time)
+    return None
+
+def backup_failed(delete_worker, backup, error):
+    if isinstance(error, CircuitOpenError):
+        log_error(f"Skipped backup of {backup.organization_id}: {error}")
+    else:
+        log_error(f"An error occurred backing up {backup.organization_id}: {str(error)}")
+    if backup.temp_zip_path and os.path.exists(backup.temp_zip_path):
+        os.remove(backup.temp_zip_path)
+    if backup.snapshot_ids and not SNAPSHOT_SHARDS:
+        zip_path = download_path(backup.organization_id, backup.snapshot_ids[0])
+        if isinstance(error, INTERRUPTED_DOWNLOAD_ERRORS) and os.path.exists(f"{zip_path}.part"):
+            # The connection dropped mid-download: the snapshot stays leased for the next run to resume it
+            log_info(f"Keeping snapshot {backup.snapshot_ids[0]} leased for the next run to resume its download")
             return
+        remove_download(zip_path)
+    # Nothing will use the snapshot any more: delete it now rather than when its lease expires
+    if backup.snapshot_ids:
+        delete_snapshots(delete_worker, backup.organization_id, backup.snapshot_ids)
 
-        # Step 5: Commit the new snapshot to Git and delete from Coveo
-        handle_new_snapshot(temp_zip_path, snapshot_name, organization_id, snapshot_id)
+def backup_coveo_configuration():
+    """
+    Back up every configured organization through a staged pipeline.
 
-    except Exception as e:
-        log_error(f"An error occurred: {str(e)}")
+    Snapshot creation, server-side builds, downloads and the compare-and-commit step run
+    as separate stages with their own workers, so one organization's snapshot builds while
+    another downloads and a third is committed. Commits run one at a time.
+    """
+    organization_ids = get_organization_ids()
+    if not organization_ids:
+        log_error("COVEO_ORGANIZATION_ID (or COVEO_ORGANIZATION_IDS) is not set in environment or .env file.")
+        return
+
+    snapshot_name = f"snapshot_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    client = CoveoClient(pool_size=max(POOL_SIZE, PIPELINE_CREATE_WORKERS + PIPELINE_BUILD_WORKERS + PIPELINE_DOWNLOAD_WORKERS))
+    # Deletes left pending by earlier (possibly crashed) runs are picked up right away
+    delete_worker = DeleteWorker(client, DeleteQueue())
+    delete_worker.start()
+    try:
+        backups = [OrgBackup(organization_id, snapshot_name, get_snapshot_dir(organization_id),
+                             get_legacy_snapshot_dir(organization_id, organization_ids))
+                   for organization_id in organization_ids]
+
+        def workers(count):
+            return min(count, len(backups))
+
+        Pipeline([
+            Stage("create", lambda backup: create_stage(client, delete_worker, backup), workers(PIPELINE_CREATE_WORKERS)),
+            Stage("build", lambda backup: build_stage(client, backup), workers(PIPELINE_BUILD_WORKERS)),
+            Stage("download", lambda backup: download_stage(client, delete_worker, backup), workers(PIPELINE_DOWNLOAD_WORKERS)),
+            # Git commits must not overlap
+            Stage("commit", lambda backup: commit_stage(delete_worker, backup), 1),
+        ], on_error=lambda backup, error: backup_failed(delete_worker, backup, error)).run(backups)
+    finally:
+        # Deletes in flight are waited for, so they never run on a closed client
+        delete_worker.stop()
+        client.close()
+        delete_worker.queue.close()
+        METRICS.log_summary()
+        HEDGER.log_summary()
 
 if __name__ == "__main__":
     backup_coveo_configuration()
-
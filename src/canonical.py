@@ -0,0 +1,140 @@
+import hashlib
+import json
+import zipfile
+
+# Compact, key-sorted JSON, written by the C encoder
+_encoder = json.JSONEncoder(sort_keys=True, separators=(",", ":"), check_circular=False)
+
+# Key of the single-member object standing in for an object that has already been hashed
+_DIGEST_KEY = "#"
+# Hex digits kept of each leaf digest in a Merkle index; 128 bits tell resources apart and halve its size
+LEAF_DIGEST_LENGTH = 32
+
+
+def _sha256(value):
+    return hashlib.sha256(_encoder.encode(value).encode("utf-8"))
+
+
+class _Hasher:
+    """
+    object_pairs_hook replacing each JSON object by {"#": <hex SHA-256 of its canonical form>}.
+
+    Objects are hashed innermost first, so the canonical form of an object holds the
+    stand-ins of its child objects instead of their content. Every object in the parsed
+    tree is a stand-in, so a stand-in can never be confused with a document's own object.
+
+    Objects whose values are all arrays (such as a snapshot's "resources") and the
+    resourceName of each object are remembered, so the Merkle index of the resources
+    comes out of the same parse.
+    """
+
+    def __init__(self):
+        self.arrays = {}
+        self.names = {}
+        self.root = None
+
+    def __call__(self, pairs):
+        # As json.loads does, the last of duplicate keys wins
+        members = dict(pairs)
+        digest = _sha256(members).hexdigest()
+        if members and all(type(value) is list for value in members.values()):
+            self.arrays[digest] = members
+        if type(members.get("resourceName")) is str:
+            self.names[digest] = members["resourceName"]
+        # The document's own object is the last one parsed
+        self.root = members
+        return {_DIGEST_KEY: digest}
+
+    def leaves(self, resources):
+        """Return {resource key: leaf digest} of a list of parsed resources, in list order."""
+        digests = [resource[_DIGEST_KEY] if type(resource) is dict else _sha256(resource).hexdigest()
+                   for resource in resources]
+        names = [self.names.get(digest) for digest in digests]
+        return {key: digest[:LEAF_DIGEST_LENGTH] for key, digest in zip(resource_keys(names), digests)}
+
+
+def resource_keys(names):
+    """
+    Return a unique key for each resource of a type, given their resourceNames in list order.
+
+    The key is the resourceName. A resource without one (None) is keyed "#<index>", and
+    repeats of a name get "#2", "#3"... appended in order, so the keys of the same list are
+    the same whether they come from a manifest or from the parsed document.
+    """
+    keys = []
+    seen = set()
+    for index, name in enumerate(names):
+        name = name if isinstance(name, str) else f"#{index}"
+        key, duplicate = name, 1
+        while key in seen:
+            duplicate += 1
+            key = f"{name}#{duplicate}"
+        seen.add(key)
+        keys.append(key)
+    return keys
+
+
+def merkle_root(types):
+    """Return the hex root digest of a Merkle index over the digests of each resource type."""
+    return _sha256({resource_type: entry["digest"] for resource_type, entry in types.items()}).hexdigest()
+
+
+def canonical_digests(data):
+    """
+    Return the canonical digest of a snapshot document and the Merkle index of its resources.
+
+    The digest is the 32-byte SHA-256 of the document in a key-order-independent canonical
+    form: two documents get the same digest exactly when json.dumps(..., sort_keys=True)
+    of both are equal. Each object is hashed as soon as it is parsed and replaced by its
+    digest, so neither the decoded document nor its whole canonical serialization is ever
+    held in memory.
+
+    The Merkle index has three levels: the digest of each resource (its leaf), the digest
+    of each resource type (over its leaves, in document order) and merkle_root over the
+    types. Two snapshots only differ inside the types whose digests differ, and there only
+    in the resources whose leaves differ.
+
+    Args:
+        data (bytes | str): The JSON document.
+
+    Returns:
+        tuple: (digest, types) where types maps each resource type of the document's
+        "resources" object to {"digest": hex, "count": n, "leaves": {resourceName: hex}},
+        leaf digests being shortened to LEAF_DIGEST_LENGTH;
+        empty for documents without one.
+    """
+    hasher = _Hasher()
+    document = json.loads(data, object_pairs_hook=hasher)
+    types = {}
+    if isinstance(document, dict) and isinstance(hasher.root.get("resources"), dict):
+        resources = hasher.arrays.get(hasher.root["resources"][_DIGEST_KEY], {})
+        types = {
+            resource_type: {"digest": _sha256(items).hexdigest(), "count": len(items), "leaves": hasher.leaves(items)}
+            for resource_type, items in resources.items()
+        }
+    return _sha256(document).digest(), types
+
+
+def canonical_digest(data):
+    """Return the 32-byte canonical digest of a JSON document; see canonical_digests."""
+    return canonical_digests(data)[0]
+
+
+def zip_json_member(z, zip_path):
+    """Return the ZipInfo of the single JSON member of an open ZIP archive."""
+    json_files = [info for info in z.infolist() if not info.is_dir() and info.filename.lower().endswith('.json')]
+    if len(json_files) != 1:
+        raise ValueError(f"Expected exactly one JSON file in {zip_path}, found {len(json_files)}")
+    return json_files[0]
+
+
+def zip_json_digests(zip_path):
+    """Return canonical_digests of the single JSON file inside a ZIP archive."""
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        with z.open(zip_json_member(z, zip_path)) as f:
+            return canonical_digests(f.read())
+
+
+def zip_json_digest(zip_path):
+    """Return the canonical_digest of the single JSON file inside a ZIP archive."""
+    return zip_json_digests(zip_path)[0]
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import time
+from state import load_state, save_state
+from logger import log_info
+
+# Skip snapshot creation when the probe sees no change (opt-in)
+CHANGE_PROBE_ENABLED = os.getenv("COVEO_CHANGE_PROBE", "").lower() in ("1", "true", "yes")
+# A full snapshot is taken at least this often, whatever the probe says, to catch changes
+# the listings do not reveal (e.g. mappings or pipeline statements edited in place)
+CHANGE_PROBE_MAX_AGE = float(os.getenv("COVEO_CHANGE_PROBE_MAX_AGE", str(6 * 3600)))
+# Optional JSON file mapping a probe name to a platform API path, replacing DEFAULT_PROBES
+CHANGE_PROBE_FILE = os.getenv("COVEO_CHANGE_PROBE_FILE")
+
+STATE_FILE = "change_probe.json"
+
+# Cheap listing endpoints, one per exported resource type
+DEFAULT_PROBES = {
+    "FIELD": "/rest/organizations/{organizationId}/indexes/page/fields?perPage=1000",
+    "SOURCE": "/rest/organizations/{organizationId}/sources",
+    "EXTENSION": "/rest/organizations/{organizationId}/extensions",
+    "QUERY_PIPELINE": "/rest/search/v2/admin/pipelines?organizationId={organizationId}&perPage=1000",
+    "ML_MODEL": "/rest/organizations/{organizationId}/machinelearning/models",
+    "SECURITY_PROVIDER": "/rest/organizations/{organizationId}/securityproviders",
+    "SEARCH_PAGE": "/rest/organizations/{organizationId}/searchpage/v1/interfaces",
+    "CATALOG": "/rest/organizations/{organizationId}/catalogs",
+    "SUBSCRIPTION": "/rest/organizations/{organizationId}/subscriptions",
+}
+
+# Keys holding run-time statistics rather than configuration; ignored at any depth
+VOLATILE_KEYS = {
+    "information", "statistics", "dailyStatistics", "resourceStats", "status", "lastOperation",
+    "lastRefresh", "nextRefresh", "modelStatus", "lastModelUpdate", "nextModelUpdate", "modelSizeStatistic",
+    "numberOfDocuments", "documentsTotalSize", "usedBy", "onlineStatus",
+}
+
+
+def load_probes():
+    if CHANGE_PROBE_FILE:
+        with open(CHANGE_PROBE_FILE) as f:
+            return json.load(f)
+    return DEFAULT_PROBES
+
+
+def _strip_volatile(value):
+    if isinstance(value, dict):
+        return {k: _strip_volatile(v) for k, v in value.items() if k not in VOLATILE_KEYS}
+    if isinstance(value, list):
+        return [_strip_volatile(v) for v in value]
+    return value
+
+
+def _fetch_all_pages(client, organization_id, path):
+    """Fetch a listing, following page numbers when the response announces several pages."""
+    first = client.get_json(organization_id, path)
+    pages = [first]
+    total_pages = first.get("totalPages", 1) if isinstance(first, dict) else 1
+    separator = "&" if "?" in path else "?"
+    for page in range(1, total_pages):
+        pages.append(client.get_json(organization_id, f"{path}{separator}page={page}"))
+    return pages
+
+
+def take_fingerprints(client, organization_id, probes=None):
+    """
+    Fingerprint the configuration listings of an organization.
+
+    Returns:
+        dict: Probe name to SHA-256 of the listing with volatile statistics removed.
+    """
+    fingerprints = {}
+    for name, path in (probes or load_probes()).items():
+        pages = _fetch_all_pages(client, organization_id, path.format(organizationId=organization_id))
+        canonical = json.dumps(_strip_volatile(pages), sort_keys=True, separators=(",", ":"))
+        fingerprints[name] = hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+    return fingerprints
+
+
+def probe_for_changes(client, organization_id):
+    """
+    Decide whether a new snapshot is needed for an organization.
+
+    Returns:
+        tuple: (changed, fingerprints). changed is False only when every probe matches the
+        fingerprints recorded at the last full snapshot and that snapshot is recent enough.
+        fingerprints must be passed to record_snapshot_fingerprints once the snapshot is
+        stored, or is None when the probe could not run.
+    """
+    try:
+        fingerprints = take_fingerprints(client, organization_id)
+    except Exception as e:
+        log_info(f"Change probe failed, taking a full snapshot: {e}")
+        return True, None
+
+    previous = load_state(STATE_FILE).get(organization_id)
+    if not previous:
+        return True, fingerprints
+    age = time.time() - previous.get("snapshot_time", 0)
+    if age > CHANGE_PROBE_MAX_AGE:
+        log_info(f"Last full snapshot is {age / 3600:.1f} hours old, taking a full snapshot")
+        return True, fingerprints
+    changed = [name for name, digest in fingerprints.items() if previous["fingerprints"].get(name) != digest]
+    if changed:
+        log_info(f"Change probe detected changes in {', '.join(changed)}")
+    return bool(changed), fingerprints
+
+
+def record_snapshot_fingerprints(organization_id, fingerprints, snapshot_time):
+    """Remember the fingerprints taken right before a full snapshot that was successfully stored."""
+    state = load_state(STATE_FILE)
+    state[organization_id] = {"fingerprints": fingerprints, "snapshot_time": snapshot_time}
+    save_state(STATE_FILE, state)
@@ -0,0 +1,116 @@
+import os
+import threading
+import time
+from state import load_state, save_state
+from logger import log_info
+
+# Consecutive failed calls after which a circuit opens
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("COVEO_CIRCUIT_FAILURE_THRESHOLD", "5"))
+# Seconds an open circuit rejects calls before letting a single probe through
+CIRCUIT_COOLDOWN = float(os.getenv("COVEO_CIRCUIT_COOLDOWN", "300"))
+
+STATE_FILE = "circuits.json"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the API while the circuit of its host or organization is open."""
+
+    def __init__(self, scope, retry_at):
+        self.scope = scope
+        self.retry_at = retry_at
+        super().__init__(f"Circuit for {scope} is open after repeated failures; "
+                         f"next attempt in {max(0.0, retry_at - time.time()):.0f}s")
+
+
+class CircuitBreaker:
+    """
+    Circuit breakers per platform host and per organization, persisted between runs.
+
+    A scope (e.g. "host:platform-eu.cloud.coveo.com" or "org:myorg") opens after
+    failure_threshold consecutive failed calls. While open, calls in that scope fail
+    immediately with CircuitOpenError. Once the cooldown has passed, one call is let
+    through as a probe: its success closes the circuit, its failure re-opens it for
+    another cooldown. State lives in the state directory, so a run started during an
+    outage skips its work right away instead of rediscovering the outage.
+    """
+
+    def __init__(self, failure_threshold=CIRCUIT_FAILURE_THRESHOLD, cooldown=CIRCUIT_COOLDOWN):
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.lock = threading.Lock()
+        self.circuits = None
+        self.probing = set()
+
+    def _load(self):
+        if self.circuits is None:
+            self.circuits = load_state(STATE_FILE)
+        return self.circuits
+
+    def before_call(self, scopes):
+        """
+        Check that a call in every scope may proceed.
+
+        Raises:
+            CircuitOpenError: If a scope is open, or half-open with its probe already in flight.
+        """
+        with self.lock:
+            circuits = self._load()
+            now = time.time()
+            for scope in scopes:
+                opened_at = circuits.get(scope, {}).get("opened_at")
+                if opened_at is None:
+                    continue
+                retry_at = opened_at + self.cooldown
+                if now < retry_at or scope in self.probing:
+                    raise CircuitOpenError(scope, max(retry_at, now))
+            for scope in scopes:
+                if circuits.get(scope, {}).get("opened_at") is not None:
+                    self.probing.add(scope)
+                    log_info(f"Circuit for {scope} is half-open; sending a probe call")
+
+    def succeeded(self, scopes):
+        with self.lock:
+            circuits = self._load()
+            changed = False
+            for scope in scopes:
+                self.probing.discard(scope)
+                if scope in circuits:
+                    if circuits[scope].get("opened_at") is not None:
+                        log_info(f"Circuit for {scope} closed")
+                    del circuits[scope]
+                    changed = True
+            if changed:
+                save_state(STATE_FILE, circuits)
+
+    def failed(self, scopes):
+        with self.lock:
+            circuits = self._load()
+            now = time.time()
+            for scope in scopes:
+                circuit = circuits.setdefault(scope, {"failures": 0, "opened_at": None})
+                circuit["failures"] += 1
+                if scope in self.probing or (circuit["opened_at"] is None
+                                             and circuit["failures"] >= self.failure_threshold):
+                    circuit["opened_at"] = now
+                    log_info(f"Circuit for {scope} opened after {circuit['failures']} consecutive failures; "
+                             f"calls are skipped for {self.cooldown:.0f}s")
+                self.probing.discard(scope)
+            save_state(STATE_FILE, circuits)
+
+    def released(self, scopes):
+        """Forget a probe that ended without telling anything about the scope's health."""
+        with self.lock:
+            for scope in scopes:
+                self.probing.discard(scope)
+
+
+def circuit_scopes(url, organization_id):
+    """Return the circuit scopes of a call: its host and, if known, its organization."""
+    host = url.split("://", 1)[-1].split("/", 1)[0]
+    scopes = [f"host:{host}"]
+    if organization_id is not None:
+        scopes.append(f"org:{organization_id}")
+    return scopes
+
+
+BREAKER = CircuitBreaker()
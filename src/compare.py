@@ -1,19 +1,212 @@
-import zipfile
+import argparse
+import hashlib
 import json
+import zipfile
+from canonical import resource_keys, zip_json_digest, zip_json_member
+from manifest import manifest_leaves, read_manifest
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Return the hex SHA-256 of a file, read in chunks."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def zip_json_checksum(zip_path):
+    """
+    Return (CRC32, uncompressed size) of the single JSON member of a ZIP.
+
+    Both come from the central directory at the end of the archive: nothing is
+    decompressed, and the member's name (the snapshot ID) plays no part.
+    """
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        member = zip_json_member(z, zip_path)
+        return member.CRC, member.file_size
 
-def compare_jsons_in_zips(zip1_path, zip2_path):
-    """Extract the single JSON file from each ZIP, load as dict, and compare content."""
-    def extract_single_json(zip_path):
-        with zipfile.ZipFile(zip_path, 'r') as z:
-            json_files = [info for info in z.infolist() if not info.is_dir() and info.filename.lower().endswith('.json')]
-            if len(json_files) != 1:
-                raise ValueError(f"Expected exactly one JSON file in {zip_path}, found {len(json_files)}")
-            data = z.read(json_files[0].filename).decode('utf-8')
-            return json.loads(data)
+def same_json_bytes(zip1_path, zip2_path):
+    """Whether the JSON members of two ZIPs have the same CRC32 and size, i.e. the same bytes; False if unreadable."""
     try:
-        dict1 = extract_single_json(zip1_path)
-        dict2 = extract_single_json(zip2_path)
-        return json.dumps(dict1, sort_keys=True) == json.dumps(dict2, sort_keys=True)
+        return zip_json_checksum(zip1_path) == zip_json_checksum(zip2_path)
+    except (OSError, ValueError, zipfile.BadZipFile):
+        return False
+
+def compare_jsons_in_zips(zip1_path, zip2_path, zip1_sha256=None, zip2_sha256=None):
+    """
+    Compare the single JSON file of each ZIP, ignoring key order and formatting.
+
+    The cheapest conclusive check wins:
+    1. equal CRC32 and size of the JSON members in the central directories, whatever
+       the members are named;
+    2. equal canonical digests (see canonical.py), taken from the sidecar manifest of an
+       archive whose SHA-256 is given and matches it, or else computed by parsing.
+
+    Equal archive SHA-256s are not checked: the member name carries the snapshot ID, so
+    two downloaded snapshots never have the same archive bytes.
+    """
+    if same_json_bytes(zip1_path, zip2_path):
+        return True
+
+    def digest(zip_path, zip_sha256):
+        manifest = read_manifest(zip_path, zip_sha256) if zip_sha256 else None
+        return bytes.fromhex(manifest["contentDigest"]) if manifest else zip_json_digest(zip_path)
+    try:
+        return digest(zip1_path, zip1_sha256) == digest(zip2_path, zip2_sha256)
     except Exception as e:
         # Optionally log or print the error
-        return False
\ No newline at end of file
+        return False
+
+
+def diff_manifests(old_manifest, new_manifest):
+    """
+    Return the resources that differ between two snapshot manifests, using their Merkle indexes.
+
+    Only resource types whose digests differ are descended into, so the cost follows the
+    number of changed types and resources rather than the size of the organization. Both
+    manifests need their leaf digests, which sidecars leave out; see manifest_leaves.
+
+    Returns:
+        dict: Resource type to {"added", "removed", "changed"} lists of resourceNames, for
+        every type with at least one of them. A type whose resources only moved is left out.
+    """
+    old_types = old_manifest.get("resourceTypes", {})
+    new_types = new_manifest.get("resourceTypes", {})
+    if old_manifest.get("rootDigest") == new_manifest.get("rootDigest"):
+        return {}
+    changes = {}
+    for resource_type in sorted(old_types.keys() | new_types.keys()):
+        old_type = old_types.get(resource_type, {})
+        new_type = new_types.get(resource_type, {})
+        if old_type.get("digest") == new_type.get("digest"):
+            continue
+        old_leaves = old_type.get("leaves", {})
+        new_leaves = new_type.get("leaves", {})
+        type_changes = {
+            "added": [name for name in new_leaves if name not in old_leaves],
+            "removed": [name for name in old_leaves if name not in new_leaves],
+            "changed": [name for name, leaf in new_leaves.items() if name in old_leaves and old_leaves[name] != leaf],
+        }
+        if any(type_changes.values()):
+            changes[resource_type] = type_changes
+    return changes
+
+
+def read_snapshot_document(zip_path):
+    """Return the parsed JSON document of a snapshot ZIP."""
+    with zipfile.ZipFile(zip_path, 'r') as z:
+        with z.open(zip_json_member(z, zip_path)) as f:
+            return json.loads(f.read())
+
+
+def _keyed_resources(document, resource_type):
+    """Return {resource key: resource} of one type of a parsed snapshot document, keyed as in manifests."""
+    resources = document.get("resources", {}).get(resource_type, [])
+    names = [resource.get("resourceName") if isinstance(resource, dict) else None for resource in resources]
+    return dict(zip(resource_keys(names), resources))
+
+
+def field_paths(old, new, path=""):
+    """
+    Return the paths of the fields that differ between two JSON values.
+
+    Objects are descended into by key ("model.name") and arrays by index ("parents[0]").
+    A value that changes type, or a field that only exists on one side, is reported at
+    its own path without descending further.
+    """
+    if type(old) is not type(new):
+        return [path]
+    if isinstance(old, dict):
+        paths = []
+        for key in sorted(old.keys() | new.keys()):
+            child = f"{path}.{key}" if path else key
+            if key not in old or key not in new:
+                paths.append(child)
+            elif old[key] != new[key] or type(old[key]) is not type(new[key]):
+                paths.extend(field_paths(old[key], new[key], child))
+        return paths
+    if isinstance(old, list):
+        paths = []
+        for index in range(max(len(old), len(new))):
+            child = f"{path}[{index}]"
+            if index >= len(old) or index >= len(new):
+                paths.append(child)
+            elif old[index] != new[index] or type(old[index]) is not type(new[index]):
+                paths.extend(field_paths(old[index], new[index], child))
+        return paths
+    return [] if old == new else [path]
+
+
+def diff_documents(old_document, new_document, candidates=None):
+    """
+    Diff the resources of two parsed snapshot documents by resource type and resourceName.
+
+    Resources of a type are matched through a hash join on their keys (see resource_keys),
+    so the cost grows linearly with the number of resources. With candidates (the output
+    of diff_manifests), only the types and resources listed there are looked at.
+
+    Returns:
+        list: One {"type", "resourceName", "change", "paths"} dict per differing resource,
+        sorted by type and name; change is "added", "removed" or "modified", and paths
+        lists the differing fields of a modified resource.
+    """
+    if candidates is None:
+        types = sorted(new_document.get("resources", {}).keys() | old_document.get("resources", {}).keys())
+    else:
+        types = sorted(candidates)
+    changes = []
+    for resource_type in types:
+        old_resources = _keyed_resources(old_document, resource_type)
+        new_resources = _keyed_resources(new_document, resource_type)
+        if candidates is None:
+            added = [key for key in new_resources if key not in old_resources]
+            removed = [key for key in old_resources if key not in new_resources]
+            modified = [key for key, resource in new_resources.items()
+                        if key in old_resources and old_resources[key] != resource]
+        else:
+            added, removed, modified = (candidates[resource_type][kind] for kind in ("added", "removed", "changed"))
+        changes.extend({"type": resource_type, "resourceName": key, "change": "added", "paths": []} for key in added)
+        changes.extend({"type": resource_type, "resourceName": key, "change": "removed", "paths": []} for key in removed)
+        changes.extend({"type": resource_type, "resourceName": key, "change": "modified",
+                        "paths": field_paths(old_resources[key], new_resources[key])} for key in modified)
+    return sorted(changes, key=lambda change: (change["type"], change["resourceName"]))
+
+
+def diff_snapshots(old_zip_path, new_zip_path, old_manifest=None, new_manifest=None):
+    """
+    Return the resource-level diff (see diff_documents) between two snapshot ZIPs.
+
+    When both manifests are given, their Merkle indexes pick the changed resources and
+    nothing is parsed if there are none; otherwise all resources are compared.
+    """
+    candidates = None
+    if old_manifest is not None and new_manifest is not None:
+        candidates = diff_manifests(manifest_leaves(old_zip_path, old_manifest),
+                                    manifest_leaves(new_zip_path, new_manifest))
+        if not candidates:
+            return []
+    return diff_documents(read_snapshot_document(old_zip_path), read_snapshot_document(new_zip_path), candidates)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show the resources that differ between two snapshot ZIPs.")
+    parser.add_argument("old", help="Older snapshot ZIP")
+    parser.add_argument("new", help="Newer snapshot ZIP")
+    parser.add_argument("--json", action="store_true", help="Print the diff as JSON")
+    args = parser.parse_args()
+
+    old_sha256, new_sha256 = file_sha256(args.old), file_sha256(args.new)
+    changes = diff_snapshots(args.old, args.new, read_manifest(args.old, old_sha256), read_manifest(args.new, new_sha256))
+    if args.json:
+        print(json.dumps(changes, indent=2))
+    else:
+        symbols = {"added": "+", "removed": "-", "modified": "~"}
+        for change in changes:
+            print(f"{symbols[change['change']]} {change['type']} {change['resourceName']}")
+            for path in change["paths"]:
+                print(f"    {path}")
+        print(f"{len(changes)} resource(s) differ")
+    return 1 if changes else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,12 @@
+import os
+from dotenv import load_dotenv
+
+# Always load .env from the project root, regardless of where the script is run from
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+load_dotenv(dotenv_path=os.path.join(PROJECT_ROOT, '.env'))
+
+
+def get_organization_ids():
+    """Return the organizations to work on: COVEO_ORGANIZATION_IDS (comma-separated) or COVEO_ORGANIZATION_ID."""
+    organization_ids = os.getenv("COVEO_ORGANIZATION_IDS") or os.getenv("COVEO_ORGANIZATION_ID") or ""
+    return [organization_id.strip() for organization_id in organization_ids.split(",") if organization_id.strip()]
@@ -1,121 +1,825 @@
 import requests
 import os
-import json
+import re
 import time
-from logger import log_error
+import random
+import asyncio
+import threading
+import hashlib
+import json
+import zipfile
+from datetime import datetime
+from urllib3.util.request import ACCEPT_ENCODING
+from regions import RegionResolver, probe_answer
+from credentials import get_credential_provider
+from circuit_breaker import BREAKER, CircuitOpenError, circuit_scopes
+from hedging import HEDGER, HEDGING_ENABLED
+from state import load_state, save_state
+from http_metrics import METRICS, TimedHTTPAdapter, reset_connect_time, take_connect_time
+from logger import log_info, log_error
 from dotenv import load_dotenv
 
 # Always load .env from the project root, regardless of where the script is run from
 PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 load_dotenv(dotenv_path=os.path.join(PROJECT_ROOT, '.env'))
 
-API_KEY = os.getenv("COVEO_API_KEY")
-BASE_URL = "https://platform-eu.cloud.coveo.com/rest/organizations/{organizationId}/snapshots/self"
+# Platform host for every organization; when unset, each organization's regional host is resolved
+PLATFORM_URL = os.getenv("COVEO_PLATFORM_URL")
+SNAPSHOTS_PATH = "/rest/organizations/{organizationId}/snapshots"
+
+# developerNotes of every snapshot created by this tool start with this prefix
+SNAPSHOT_NOTES_PREFIX = "Snapshot - "
+
+# Top-level resource types exported in every snapshot; children are included automatically
+RESOURCE_TYPES = [
+    "FIELD",
+    "EXTENSION",
+    "QUERY_PIPELINE",
+    "ML_MODEL",
+    "SUBSCRIPTION",
+    "SOURCE",
+    "SECURITY_PROVIDER",
+    "CATALOG",
+    "SEARCH_PAGE"
+]
+
+# HTTP client tuning, overridable from the environment
+POOL_SIZE = int(os.getenv("COVEO_POOL_SIZE", "10"))
+CONNECT_TIMEOUT = float(os.getenv("COVEO_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("COVEO_READ_TIMEOUT", "60"))
+MAX_RETRIES = int(os.getenv("COVEO_MAX_RETRIES", "4"))
+BACKOFF_FACTOR = float(os.getenv("COVEO_BACKOFF_FACTOR", "0.5"))
+BACKOFF_MAX = float(os.getenv("COVEO_BACKOFF_MAX", "30"))
+# Starting (and maximum) request rates in requests per second, per API key and per organization
+RATE_LIMIT_PER_KEY = float(os.getenv("COVEO_RATE_LIMIT_PER_KEY", "20"))
+RATE_LIMIT_PER_ORG = float(os.getenv("COVEO_RATE_LIMIT_PER_ORG", "10"))
+DOWNLOAD_CHUNK_SIZE = int(os.getenv("COVEO_DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+
+# Snapshots requested per page when listing an organization's snapshots
+LIST_PAGE_SIZE = int(os.getenv("COVEO_LIST_PAGE_SIZE", "100"))
+# Seconds a snapshot listing is served from the on-disk cache without asking the platform
+LIST_CACHE_MAX_AGE = float(os.getenv("COVEO_LIST_CACHE_MAX_AGE", "0"))
+LIST_CACHE_FILE = "snapshot_lists.json"
+_list_cache_lock = threading.Lock()
+
+# Snapshot readiness polling
+SNAPSHOT_TIMEOUT = float(os.getenv("COVEO_SNAPSHOT_TIMEOUT", "900"))
+POLL_INTERVAL = float(os.getenv("COVEO_POLL_INTERVAL", "1"))
+POLL_MAX_INTERVAL = float(os.getenv("COVEO_POLL_MAX_INTERVAL", "15"))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Statuses a non-idempotent request can safely be retried on: the server did not act on it
+SAFE_RETRY_STATUSES = {429, 503}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+# Small idempotent calls a Hedger may duplicate when they are slow; content downloads never are
+HEDGED_OPERATIONS = {"status", "list", "probe", "delete"}
+
 
-def create_snapshot(organization_id, snapshot_name):
+def _read_progress(progress_path):
+    """Return the recorded progress of a partial download, or an empty dict."""
+    try:
+        with open(progress_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_progress(progress_path, url, validator, total, received):
+    with open(progress_path, "w") as f:
+        json.dump({"url": url, "validator": validator, "total": total, "bytes": received}, f)
+
+def _hash_file(path, sha256, length):
+    """Feed the first length bytes of path into sha256 and return how many were read."""
+    read = 0
+    with open(path, "rb") as f:
+        while read < length:
+            chunk = f.read(min(DOWNLOAD_CHUNK_SIZE, length - read))
+            if not chunk:
+                break
+            sha256.update(chunk)
+            read += len(chunk)
+    return read
+
+def _range_start(status_code, headers):
+    """Return the first byte offset of a 206 response, or None for a full response."""
+    if status_code != 206:
+        return None
+    match = re.match(r"bytes (\d+)-", headers.get("Content-Range", ""))
+    return int(match.group(1)) if match else None
+
+def _content_length(headers):
+    """Return the size of the decoded body, or None when it cannot be known upfront."""
+    if headers.get("Content-Encoding", "identity") != "identity":
+        return None
+    length = headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+def _validator(headers):
     """
-    Create a new snapshot with a detailed resourcesToExport body and dynamic developerNotes.
+    Return the validator to resume a download with, or None.
 
-    Args:
-        organization_id (str): Coveo organization ID.
-        snapshot_name (str): Name for the snapshot.
+    The ETag of an encoded response names the encoded bytes, while resumes ask for the
+    identity encoding, so only Last-Modified can be used to resume those.
+    """
+    if headers.get("Content-Encoding", "identity") != "identity":
+        return headers.get("Last-Modified")
+    return headers.get("ETag") or headers.get("Last-Modified")
 
-    Returns:
-        str: The ID of the created snapshot.
+def _epoch_ms(value):
+    """Return a createdDate given as epoch milliseconds or an ISO 8601 string as epoch milliseconds."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    try:
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() * 1000)
+    except ValueError:
+        return None
+
+def normalize_snapshot(model):
     """
-    url = BASE_URL.format(organizationId=organization_id)
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-    body = {
-        "resourcesToExport": {
-            "FIELD": ["*"],
-            "EXTENSION": ["*"],
-            "QUERY_PIPELINE": ["*"],
-            "ML_MODEL": ["*"],
-            "SUBSCRIPTION": ["*"],
-            "SOURCE": ["*"],
-            "SECURITY_PROVIDER": ["*"],
-            "CATALOG": ["*"],
-            "SEARCH_PAGE": ["*"]
-        },
-        "developerNotes": f"Snapshot - {snapshot_name}",
-        "includeChildrenResources": True
+    Return a snapshot model with status, createdDate (epoch ms) and size (bytes) always present.
+
+    Missing values are None; the other fields of the model are kept as they are.
+    """
+    size = next((model[key] for key in ("size", "sizeInBytes", "contentSize") if model.get(key) is not None), None)
+    return {
+        **model,
+        "status": model.get("status"),
+        "createdDate": _epoch_ms(model.get("createdDate")),
+        "size": size,
     }
 
+def _is_valid_zip(path):
+    """Check that path is a ZIP archive whose members all match their CRC32."""
     try:
-        response = requests.post(url, headers=headers, json=body)
-        response.raise_for_status()
-        return response.json()["id"]
-    except Exception as e:
-        log_error(f"Failed to create snapshot: {e}")
-        raise
-
-    url = f"{BASE_URL.format(organizationId=organization_id)}/{snapshot_id}"
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
+        with zipfile.ZipFile(path) as z:
+            return z.testzip() is None
+    except zipfile.BadZipFile:
+        return False
+
+def _backoff_delay(attempt, backoff_factor, backoff_max):
+    """Full-jitter exponential backoff delay for the given (0-based) attempt."""
+    return random.uniform(0, min(backoff_max, backoff_factor * (2 ** attempt)))
+
+def _retry_after(headers):
+    """Return the Retry-After delay in seconds, or None if absent or not numeric."""
+    value = headers.get("Retry-After")
     try:
-        # Wait for snapshot to be ready (simple polling)
-        for _ in range(10):
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            data = response.json()
-            if data.get("status") == "COMPLETED":
-                break
-            time.sleep(2)
+        return max(0.0, float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+def _retry_delay(headers, attempt, backoff_factor, backoff_max):
+    """Delay before retrying a response with these headers: its Retry-After if present, else jittered backoff."""
+    retry_after = _retry_after(headers)
+    if retry_after is not None:
+        return min(backoff_max, retry_after)
+    return _backoff_delay(attempt, backoff_factor, backoff_max)
+
+def _retry_statuses(method):
+    """Statuses a request is retried on: any transient one if the method is idempotent, else only refusals."""
+    return RETRY_STATUSES if method.upper() in IDEMPOTENT_METHODS else SAFE_RETRY_STATUSES
+
+
+def create_snapshot_body(snapshot_name, resource_types=RESOURCE_TYPES):
+    """Build the request body that exports resource_types (with children) and a dynamic developerNotes."""
+    return {
+        "resourcesToExport": {resource_type: ["*"] for resource_type in resource_types},
+        "developerNotes": f"{SNAPSHOT_NOTES_PREFIX}{snapshot_name}",
+        "includeChildrenResources": True
+    }
+
+
+class TokenBucket:
+    """
+    Token bucket whose rate adapts to throttling (additive increase, multiplicative decrease).
+
+    The configured rate is the ceiling: each 429 halves the rate and pauses the bucket,
+    each success recovers the rate by a small step until the ceiling is reached again.
+    """
+
+    MIN_RATE = 0.1
+
+    def __init__(self, rate, burst=None):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self._refill(now)
+        if self.paused_until > now:
+            return self.paused_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def throttled(self, now, pause):
+        self.rate = max(self.MIN_RATE, self.rate / 2)
+        self.tokens = min(self.tokens, 0.0)
+        self.paused_until = max(self.paused_until, now + pause)
+
+    def succeeded(self):
+        self.rate = min(self.max_rate, self.rate + 0.1 * self.max_rate / max(self.rate, 1.0))
+
+
+class RateLimitGovernor:
+    """
+    Process-wide request budget shared by every client, with one adaptive token bucket per
+    API key and one per organization. A request is sent only when both buckets have a token.
+    """
+
+    def __init__(self, rate_per_key=RATE_LIMIT_PER_KEY, rate_per_org=RATE_LIMIT_PER_ORG):
+        self.rate_per_key = rate_per_key
+        self.rate_per_org = rate_per_org
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def _buckets(self, key_id, organization_id):
+        buckets = []
+        for scope, rate in ((("key", key_id), self.rate_per_key), (("org", organization_id), self.rate_per_org)):
+            if scope[1] is None:
+                continue
+            if scope not in self.buckets:
+                self.buckets[scope] = TokenBucket(rate)
+            buckets.append(self.buckets[scope])
+        return buckets
+
+    def reserve(self, key_id, organization_id):
+        """Take a token from both buckets if possible; otherwise return the seconds to wait first."""
+        with self.lock:
+            now = time.monotonic()
+            buckets = self._buckets(key_id, organization_id)
+            wait = max((bucket.wait_time(now) for bucket in buckets), default=0.0)
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.take()
+            return wait
+
+    def acquire(self, key_id, organization_id):
+        """Block until the request is within the key and organization budgets."""
+        while (wait := self.reserve(key_id, organization_id)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, key_id, organization_id):
+        """Coroutine version of acquire for the asyncio client."""
+        while (wait := self.reserve(key_id, organization_id)) > 0:
+            await asyncio.sleep(wait)
+
+    def throttled(self, key_id, organization_id, pause):
+        """Record a 429: slow both budgets down and hold them for pause seconds."""
+        with self.lock:
+            now = time.monotonic()
+            for bucket in self._buckets(key_id, organization_id):
+                bucket.throttled(now, pause)
+
+    def succeeded(self, key_id, organization_id):
+        with self.lock:
+            for bucket in self._buckets(key_id, organization_id):
+                bucket.succeeded()
+
+
+GOVERNOR = RateLimitGovernor()
+
+
+class SnapshotError(Exception):
+    """Raised when Coveo reports that a snapshot could not be built."""
+
+
+class IncompleteDownloadError(Exception):
+    """Raised when a download stops short or cannot continue where it stopped; retried like a dropped connection."""
+
+
+class ResumableDownload:
+    """
+    Bookkeeping of a download to output_path through a resumable .part file, shared by both clients.
+
+    Progress (validator, expected size and bytes received) is recorded next to the .part
+    file. When the transfer drops, even in an earlier run, the download resumes with a
+    Range request guarded by If-Range; if the server ignores the range, it restarts from
+    scratch. The final size is checked against the announced length and, for resumed
+    downloads, the archive CRCs are verified before the file is moved into place.
+
+    Every method except request_headers does blocking file I/O; AsyncCoveoClient runs
+    them in worker threads.
+    """
+
+    def __init__(self, url, output_path):
+        self.url = url
+        self.output_path = output_path
+        self.part_path = f"{output_path}.part"
+        self.progress_path = f"{self.part_path}.json"
+        self.validator = self.total = None
+        self.restart()
+
+    def restart(self):
+        """Start over from the first byte."""
+        self.sha256, self.received, self.resumed = hashlib.sha256(), 0, False
+
+    def load(self):
+        """Pick up the .part file left by an earlier attempt at the same URL, hashing the bytes it holds."""
+        progress = _read_progress(self.progress_path)
+        if progress.get("url") == self.url and os.path.exists(self.part_path):
+            self.received = _hash_file(self.part_path, self.sha256, progress.get("bytes", 0))
+            self.validator, self.total = progress.get("validator"), progress.get("total")
+
+    def request_headers(self):
+        """Return the headers of the next request: a guarded Range request once bytes have been received."""
+        headers = {}
+        if self.received:
+            # Ranges address the encoded representation, so resume without content coding
+            headers["Range"] = f"bytes={self.received}-"
+            headers["Accept-Encoding"] = "identity"
+            if self.validator:
+                headers["If-Range"] = self.validator
+        return headers
+
+    def start(self, status, headers):
+        """
+        Take in the status and headers of a successful response and open the .part file for its body.
+
+        Returns:
+            file: The .part file, positioned where the body goes; the caller closes it.
+
+        Raises:
+            IncompleteDownloadError: If a partial response does not start where the download stopped.
+        """
+        range_start = _range_start(status, headers)
+        if self.received and range_start == self.received:
+            self.resumed = True
+            log_info(f"Resuming download of {self.url} at byte {self.received}")
+        elif range_start is not None:
+            self.restart()
+            raise IncompleteDownloadError(f"Unexpected partial response starting at byte {range_start}")
         else:
-            raise Exception("Snapshot not ready after waiting.")
-
-        os.makedirs("snapshots", exist_ok=True)
-        snapshot_file_path = os.path.join("snapshots", f"{snapshot_name}.json")
-        with open(snapshot_file_path, 'w') as snapshot_file:
-            json.dump(data, snapshot_file, indent=2)
-        return snapshot_file_path
-    except Exception as e:
-        log_error(f"Failed to export snapshot: {e}")
-        raise
-
-def export_snapshot_content(organization_id, snapshot_id, output_path):
+            if self.received:
+                log_info(f"Server ignored range request for {self.url}; restarting download")
+            self.restart()
+            self.validator = _validator(headers)
+            self.total = _content_length(headers)
+        self.save_progress()
+        f = open(self.part_path, "r+b" if self.received else "wb")
+        f.seek(self.received)
+        f.truncate()
+        return f
+
+    def write(self, f, chunk):
+        """Append a chunk of the body to the .part file and to the hash."""
+        f.write(chunk)
+        self.sha256.update(chunk)
+        self.received += len(chunk)
+
+    def save_progress(self):
+        _write_progress(self.progress_path, self.url, self.validator, self.total, self.received)
+
+    def verify(self):
+        """
+        Check the .part file once the whole body has been read.
+
+        Raises:
+            IncompleteDownloadError: If fewer bytes than announced arrived, or a resumed
+                download does not verify (it then restarts from scratch).
+        """
+        if self.total is not None and self.received != self.total:
+            raise IncompleteDownloadError(f"Connection closed after {self.received} of {self.total} bytes")
+        if self.resumed and not _is_valid_zip(self.part_path):
+            log_info(f"Resumed download of {self.url} failed verification; restarting download")
+            self.restart()
+            raise IncompleteDownloadError("Resumed download failed verification")
+
+    def finish(self):
+        """Move the downloaded file into place and return the hex SHA-256 of its bytes."""
+        os.replace(self.part_path, self.output_path)
+        os.remove(self.progress_path)
+        return self.sha256.hexdigest()
+
+
+class CoveoClient:
     """
-    Download the content of a snapshot and save it to output_path.
+    HTTP client for the Coveo snapshot API.
 
-    Args:
-        organization_id (str): Coveo organization ID.
-        snapshot_id (str): ID of the snapshot.
-        output_path (str): Path where the snapshot content will be saved.
+    Holds a pooled keep-alive session so consecutive calls reuse TLS connections,
+    applies connect/read timeouts to every call and retries throttled (429) and
+    server-side (5xx) failures with jittered exponential backoff. The timing of every
+    request attempt is recorded in an HttpMetrics collector.
 
-    Returns:
-        str: The path to the saved snapshot content file.
+    Calls go to platform_url when given (or COVEO_PLATFORM_URL); otherwise each
+    organization's calls go to its own regional host, found by a RegionResolver.
+
+    Calls are guarded by circuit breakers per host and per organization: while either
+    is open after repeated failures, calls fail fast with CircuitOpenError.
+
+    Every attempt is authenticated with the current token of a credential provider
+    (static API key, OAuth client credentials or per-organization keys; see credentials.py).
+
+    With a hedger (HEDGER when COVEO_HEDGING=1), status, list, probe and delete calls
+    slower than their usual latency are sent a second time and the first answer wins.
     """
-    url = f"https://platform-eu.cloud.coveo.com/rest/organizations/{organization_id}/snapshots/{snapshot_id}/content"
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
 
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        with open(output_path, "wb") as f:
-            f.write(response.content)
-        return output_path
-    except Exception as e:
-        log_error(f"Failed to export snapshot content: {e}")
-        raise
-
-def delete_snapshot(organization_id, snapshot_id):
-    """Delete a snapshot from Coveo by snapshotId."""
-    url = f"https://platform-eu.cloud.coveo.com/rest/organizations/{organization_id}/snapshots/{snapshot_id}"
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json"
-    }
-    try:
-        response = requests.delete(url, headers=headers)
-        response.raise_for_status()
-    except Exception as e:
-        log_error(f"Failed to delete snapshot: {e}")
-        raise
\ No newline at end of file
+    def __init__(self, api_key=None, platform_url=None, pool_size=POOL_SIZE,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR, backoff_max=BACKOFF_MAX,
+                 governor=None, metrics=None, breaker=None, credentials=None, hedger=None):
+        self.credentials = credentials or get_credential_provider(api_key)
+        self.hedger = hedger or (HEDGER if HEDGING_ENABLED else None)
+        self.platform_url = (platform_url or PLATFORM_URL or "").rstrip("/") or None
+        self.governor = governor or GOVERNOR
+        self.breaker = breaker or BREAKER
+        self.metrics = metrics or METRICS
+        self.timeout = (connect_timeout, read_timeout)
+        self.resolver = RegionResolver()
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        # Content-Type is set per request by json=; responses may come back in any coding urllib3 decodes.
+        # Authorization is set per attempt, so a refreshed token is picked up by retries and resumes.
+        self.session.headers.update({
+            "Accept-Encoding": ACCEPT_ENCODING
+        })
+        # Retries are handled in _request so that they are jittered and honour Retry-After
+        adapter = TimedHTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close all pooled connections."""
+        self.session.close()
+
+    def base_url(self, organization_id):
+        """Return the platform URL to send the calls of organization_id to."""
+        if self.platform_url:
+            return self.platform_url
+        return self.resolver.platform_url(organization_id, lambda url: self._probe_region(url, organization_id))
+
+    def _probe_region(self, url, organization_id):
+        """Ask regional host url about the organization; return probe_answer for its response, or None."""
+        try:
+            response = self._request("GET", url + SNAPSHOTS_PATH.format(organizationId=organization_id),
+                                     organization_id, "region", allow_redirects=False, stream=True)
+        except (requests.RequestException, CircuitOpenError):
+            return None
+        with response:
+            # Only the status matters: the body is never read
+            response.timing.finish()
+            return probe_answer(url, response.status_code, response.headers.get("Location"))
+
+    def snapshots_url(self, organization_id):
+        return self.base_url(organization_id) + SNAPSHOTS_PATH.format(organizationId=organization_id)
+
+    def _request(self, method, url, organization_id, operation="request", **kwargs):
+        """
+        Send a request unless its host or organization circuit is open; see _send.
+
+        A call that still fails with a connection error, a timeout or a RETRY_STATUSES
+        status after its retries counts as a failure of both circuits; any other
+        response shows the platform is up and closes them.
+
+        Raises:
+            CircuitOpenError: If the host or organization circuit is open.
+        """
+        scopes = circuit_scopes(url, organization_id)
+        self.breaker.before_call(scopes)
+        try:
+            if self.hedger and operation in HEDGED_OPERATIONS and method.upper() in ("GET", "DELETE") \
+                    and not kwargs.get("stream"):
+                response = self.hedger.call(
+                    operation, lambda: self._send(method, url, organization_id, operation, **kwargs))
+            else:
+                response = self._send(method, url, organization_id, operation, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            self.breaker.failed(scopes)
+            raise
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status in RETRY_STATUSES:
+                self.breaker.failed(scopes)
+            else:
+                self.breaker.succeeded(scopes)
+            if status == 403 and operation != "region" and not self.platform_url:
+                # The organization may have moved to another region: resolve it again on the next call
+                self.resolver.forget(organization_id)
+            raise
+        except BaseException:
+            self.breaker.released(scopes)
+            raise
+        self.breaker.succeeded(scopes)
+        return response
+
+    def _send(self, method, url, organization_id, operation, **kwargs):
+        """
+        Send a request through the pooled session, retrying transient failures.
+
+        Each attempt is timed and recorded under operation and organization_id. For a
+        streamed response the timing is left open as response.timing, to be finished by
+        the caller once the body has been read.
+
+        Every attempt first waits for the rate-limit governor. A 429 slows down the
+        budgets of the API key and organization for all clients in the process and
+        holds them for the Retry-After delay instead of sleeping only this call.
+
+        Each attempt sends the provider's current token. A 401 invalidates that token and
+        is resent once with a new one, without counting as a retry.
+
+        Idempotent methods are retried on connection errors, timeouts and any status in
+        RETRY_STATUSES. Other methods are only retried when the request provably did not
+        reach the server (connect timeout) or the server refused it (429/503).
+
+        Returns:
+            requests.Response: The successful response.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        retry_statuses = _retry_statuses(method)
+        retry_errors = (requests.ConnectionError, requests.Timeout) if method.upper() in IDEMPOTENT_METHODS \
+            else (requests.ConnectTimeout,)
+
+        headers = kwargs.pop("headers", None) or {}
+        key_id = self.credentials.key_id(organization_id)
+        reauthenticated = False
+
+        attempt = 0
+        while True:
+            self.governor.acquire(key_id, organization_id)
+            throttled = False
+            token = self.credentials.token(organization_id)
+            timing = self.metrics.start(operation, organization_id, method, url, attempt)
+            reset_connect_time()
+            try:
+                response = self.session.request(method, url, headers={**headers, "Authorization": f"Bearer {token}"},
+                                                **kwargs)
+            except Exception as e:
+                timing.finish(error=e)
+                if not isinstance(e, retry_errors) or attempt >= self.max_retries:
+                    raise
+                delay = _backoff_delay(attempt, self.backoff_factor, self.backoff_max)
+                reason = str(e)
+            else:
+                if kwargs.get("stream"):
+                    timing.headers_received(response.status_code, take_connect_time())
+                else:
+                    timing.headers_received(response.status_code, take_connect_time(), response.elapsed.total_seconds())
+                    timing.finish(len(response.content), wire=response.raw.tell())
+                if response.status_code == 401 and not reauthenticated:
+                    # The token was revoked or expired early: fetch a new one and resend once right away
+                    reauthenticated = True
+                    timing.finish()
+                    response.close()
+                    self.credentials.invalidate(organization_id, token)
+                    log_info(f"{method} {url} was rejected with HTTP 401; retrying with a new token")
+                    continue
+                delay = _retry_delay(response.headers, attempt, self.backoff_factor, self.backoff_max)
+                throttled = response.status_code == 429
+                if throttled:
+                    # The governor holds every request for this key and organization, this one included
+                    self.governor.throttled(key_id, organization_id, delay)
+                else:
+                    self.governor.succeeded(key_id, organization_id)
+                if response.status_code not in retry_statuses or attempt >= self.max_retries:
+                    if not response.ok:
+                        timing.finish()
+                    response.raise_for_status()
+                    response.timing = timing
+                    return response
+                reason = f"HTTP {response.status_code}"
+                timing.finish()
+                response.close()
+            attempt += 1
+            log_info(f"{method} {url} failed ({reason}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            if not throttled:
+                time.sleep(delay)
+
+    def get_json(self, organization_id, path, params=None):
+        """GET a platform API path (relative to the platform URL) and return the decoded JSON."""
+        return self._request("GET", self.base_url(organization_id) + path, organization_id, "probe", params=params).json()
+
+    def create_snapshot(self, organization_id, snapshot_name, resource_types=RESOURCE_TYPES):
+        """
+        Create a new snapshot with a detailed resourcesToExport body and dynamic developerNotes.
+
+        Args:
+            organization_id (str): Coveo organization ID.
+            snapshot_name (str): Name for the snapshot.
+            resource_types (list): Resource types to export, all of them by default.
+
+        Returns:
+            str: The ID of the created snapshot.
+        """
+        url = f"{self.snapshots_url(organization_id)}/self"
+        body = create_snapshot_body(snapshot_name, resource_types)
+        try:
+            response = self._request("POST", url, organization_id, "create", json=body)
+            return response.json()["id"]
+        except Exception as e:
+            log_error(f"Failed to create snapshot: {e}")
+            raise
+
+    def get_snapshot(self, organization_id, snapshot_id):
+        """
+        Fetch the metadata of a snapshot, including its status.
+
+        Args:
+            organization_id (str): Coveo organization ID.
+            snapshot_id (str): ID of the snapshot.
+
+        Returns:
+            dict: The snapshot model returned by Coveo.
+        """
+        url = f"{self.snapshots_url(organization_id)}/{snapshot_id}"
+        return self._request("GET", url, organization_id, "status").json()
+
+    def list_snapshots(self, organization_id, max_age=LIST_CACHE_MAX_AGE):
+        """
+        List the snapshots of an organization, page by page, through an on-disk cache.
+
+        Each page is kept in the state directory with its ETag and revalidated with
+        If-None-Match, so an unchanged page costs a 304 without a body. A listing fetched
+        less than max_age seconds ago is returned without any request at all.
+
+        Args:
+            organization_id (str): Coveo organization ID.
+            max_age (float): Seconds a cached listing is used as is.
+
+        Returns:
+            list: The snapshot models, normalized by normalize_snapshot.
+        """
+        with _list_cache_lock:
+            cached = load_state(LIST_CACHE_FILE).get(organization_id) or {}
+        pages = cached.get("pages", [])
+        if pages and time.time() - cached.get("listed", 0) < max_age:
+            return [normalize_snapshot(model) for page in pages for model in page["items"]]
+
+        url = self.snapshots_url(organization_id)
+        listed = []
+        page = 0
+        while True:
+            headers = {}
+            if page < len(pages) and pages[page].get("etag"):
+                headers["If-None-Match"] = pages[page]["etag"]
+            response = self._request("GET", url, organization_id, "list", headers=headers,
+                                     params={"page": page, "perPage": LIST_PAGE_SIZE})
+            etag = response.headers.get("ETag")
+            total_pages = None
+            if response.status_code == 304:
+                # Only this page is known to be unchanged: pages may have been added after it since
+                items = pages[page]["items"]
+                etag = etag or pages[page]["etag"]
+            else:
+                payload = response.json()
+                # Paged endpoints answer {"items": [...], "totalPages": n}; others a plain list
+                items = payload.get("items", []) if isinstance(payload, dict) else payload
+                total_pages = payload.get("totalPages") if isinstance(payload, dict) else None
+            if listed and items == listed[-1]["items"]:
+                # The platform ignored page and sent the previous page again
+                break
+            listed.append({"etag": etag, "items": items})
+            page += 1
+            if total_pages is not None:
+                if page >= total_pages:
+                    break
+            elif len(items) != LIST_PAGE_SIZE:
+                # A shorter page is the last one; a longer one means perPage was ignored and everything sent
+                break
+
+        with _list_cache_lock:
+            state = load_state(LIST_CACHE_FILE)
+            state[organization_id] = {"pages": listed, "listed": time.time()}
+            save_state(LIST_CACHE_FILE, state)
+        return [normalize_snapshot(model) for page in listed for model in page["items"]]
+
+    def wait_for_snapshot(self, organization_id, snapshot_id, timeout=SNAPSHOT_TIMEOUT,
+                          poll_interval=POLL_INTERVAL, max_poll_interval=POLL_MAX_INTERVAL):
+        """
+        Poll a snapshot until it is COMPLETED, backing off exponentially between polls.
+
+        Args:
+            organization_id (str): Coveo organization ID.
+            snapshot_id (str): ID of the snapshot.
+            timeout (float): Overall deadline in seconds.
+            poll_interval (float): Delay before the second poll, doubled after each poll.
+            max_poll_interval (float): Cap on the delay between polls.
+
+        Returns:
+            dict: The completed snapshot model.
+
+        Raises:
+            SnapshotError: If the snapshot ends in the ERROR status.
+            TimeoutError: If the snapshot is not completed before the deadline.
+        """
+        deadline = time.monotonic() + timeout
+        interval = poll_interval
+        while True:
+            snapshot = self.get_snapshot(organization_id, snapshot_id)
+            status = snapshot.get("status")
+            if status == "COMPLETED":
+                return snapshot
+            if status == "ERROR":
+                raise SnapshotError(f"Snapshot {snapshot_id} failed with status ERROR")
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"Snapshot {snapshot_id} not ready after {timeout:.0f} seconds (status {status})")
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_poll_interval)
+
+    def export_snapshot_content(self, organization_id, snapshot_id, output_path):
+        """
+        Stream the content of a snapshot to output_path, hashing it as it is written.
+
+        Args:
+            organization_id (str): Coveo organization ID.
+            snapshot_id (str): ID of the snapshot.
+            output_path (str): Path where the snapshot content will be saved.
+
+        Returns:
+            tuple: The path to the saved snapshot content file and the hex SHA-256 of its bytes.
+        """
+        url = f"{self.snapshots_url(organization_id)}/{snapshot_id}/content"
+
+        try:
+            return output_path, self._download(url, output_path, organization_id)
+        except Exception as e:
+            log_error(f"Failed to export snapshot content: {e}")
+            raise
+
+    def _download(self, url, output_path, organization_id):
+        """
+        Download url to output_path through a resumable .part file; see ResumableDownload.
+
+        The body is requested in any content coding urllib3 can decode and decoded while
+        it is streamed to disk; the bytes received on the wire are logged next to the
+        decoded size.
+
+        Returns:
+            str: The hex SHA-256 of the downloaded bytes.
+        """
+        download = ResumableDownload(url, output_path)
+        download.load()
+
+        wire_bytes = 0
+        encoding = "identity"
+        attempt = 0
+        while True:
+            try:
+                response = self._request("GET", url, organization_id, "content", stream=True,
+                                         headers=download.request_headers())
+                body_bytes = 0
+                try:
+                    with response, download.start(response.status_code, response.headers) as f:
+                        for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            download.write(f, chunk)
+                            body_bytes += len(chunk)
+                except Exception as e:
+                    wire_bytes += response.raw.tell()
+                    response.timing.finish(body_bytes, error=e, wire=response.raw.tell())
+                    raise
+                wire_bytes += response.raw.tell()
+                encoding = response.headers.get("Content-Encoding", "identity")
+                response.timing.finish(body_bytes, wire=response.raw.tell())
+                download.verify()
+                break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError,
+                    IncompleteDownloadError) as e:
+                download.save_progress()
+                if attempt >= self.max_retries:
+                    raise
+                delay = _backoff_delay(attempt, self.backoff_factor, self.backoff_max)
+                attempt += 1
+                log_info(f"Download of {url} interrupted at byte {download.received} ({e}); "
+                         f"retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+            except requests.HTTPError as e:
+                # 416: the recorded offset is no longer valid for this resource
+                if e.response is None or e.response.status_code != 416 or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                download.restart()
+
+        sha256 = download.finish()
+        log_info(f"Downloaded {download.received} bytes from {url} ({wire_bytes} bytes on the wire, {encoding} encoding)")
+        return sha256
+
+    def delete_snapshot(self, organization_id, snapshot_id):
+        """Delete a snapshot from Coveo by snapshotId. A snapshot that no longer exists counts as deleted."""
+        url = f"{self.snapshots_url(organization_id)}/{snapshot_id}"
+        try:
+            self._request("DELETE", url, organization_id, "delete")
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 404:
+                log_error(f"Failed to delete snapshot: {e}")
+                raise
+            log_info(f"Snapshot {snapshot_id} was already deleted")
+        except Exception as e:
+            log_error(f"Failed to delete snapshot: {e}")
+            raise
@@ -0,0 +1,373 @@
+import asyncio
+import contextlib
+import os
+import socket
+import aiohttp
+from aiohttp.abc import AbstractResolver
+from dns_cache import DNS_CACHE
+from regions import RegionResolver, probe_answer
+from circuit_breaker import BREAKER, CircuitOpenError, circuit_scopes
+from logger import log_info, log_error
+from http_metrics import METRICS
+from credentials import get_credential_provider
+from coveo_api import (
+    PLATFORM_URL, SNAPSHOTS_PATH, RESOURCE_TYPES, POOL_SIZE, CONNECT_TIMEOUT, READ_TIMEOUT, MAX_RETRIES,
+    BACKOFF_FACTOR, BACKOFF_MAX, DOWNLOAD_CHUNK_SIZE, SNAPSHOT_TIMEOUT, POLL_INTERVAL, POLL_MAX_INTERVAL,
+    RETRY_STATUSES, IDEMPOTENT_METHODS, GOVERNOR, SnapshotError, IncompleteDownloadError, ResumableDownload,
+    create_snapshot_body, _backoff_delay, _retry_delay, _retry_statuses
+)
+
+# Maximum concurrent connections (and therefore in-flight requests) per platform host
+CONCURRENCY_PER_HOST = int(os.getenv("COVEO_CONCURRENCY_PER_HOST", str(POOL_SIZE)))
+
+
+def _wire_bytes(response):
+    """Bytes of the response body received on the wire, before content decoding."""
+    # The EmptyStreamReader of a body-less response (e.g. a 204) cannot count its raw bytes
+    return response.content.total_raw_bytes if response.content.total_bytes else 0
+
+
+class CachedResolver(AbstractResolver):
+    """aiohttp resolver answering from the persistent DNS_CACHE shared with CoveoClient."""
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        addresses = await asyncio.to_thread(DNS_CACHE.resolve, host, port)
+        return [
+            {"hostname": host, "host": address, "port": port, "family": address_family, "proto": 0,
+             "flags": socket.AI_NUMERICHOST | socket.AI_NUMERICSERV}
+            for address_family, address in addresses if family in (socket.AF_UNSPEC, address_family)
+        ]
+
+    async def close(self):
+        pass
+
+
+class AsyncCoveoClient:
+    """
+    Asyncio counterpart of CoveoClient for driving many organizations from one process.
+
+    All calls share one aiohttp connection pool whose per-host connection limit bounds
+    concurrency towards each platform host; requests beyond the limit queue for a free
+    connection. Retries, timeouts, circuit breakers and request timings follow the same rules
+    as CoveoClient.
+
+    Use as an async context manager:
+
+        async with AsyncCoveoClient() as client:
+            snapshot_id = await client.create_snapshot(organization_id, snapshot_name)
+    """
+
+    def __init__(self, api_key=None, platform_url=None, concurrency_per_host=CONCURRENCY_PER_HOST,
+                 connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR, backoff_max=BACKOFF_MAX,
+                 governor=None, metrics=None, breaker=None, credentials=None):
+        self.credentials = credentials or get_credential_provider(api_key)
+        self.platform_url = (platform_url or PLATFORM_URL or "").rstrip("/") or None
+        self.governor = governor or GOVERNOR
+        self.breaker = breaker or BREAKER
+        self.metrics = metrics or METRICS
+        self.concurrency_per_host = concurrency_per_host
+        self.timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+        self.resolver = RegionResolver()
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.session = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def open(self):
+        """Create the shared connection pool. Must be called from a running event loop."""
+        if self.session is None:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=self.concurrency_per_host,
+                                             resolver=CachedResolver())
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=self.timeout,
+                # aiohttp sets Content-Type for json= bodies and negotiates the codings it can decode;
+                # Authorization is set per attempt from the credential provider
+                trace_configs=[self._trace_config()]
+            )
+
+    async def close(self):
+        """Close all pooled connections."""
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    @staticmethod
+    def _trace_config():
+        """Trace hooks adding connection set-up time to the RequestTiming passed as trace_request_ctx."""
+        async def on_connection_create_start(session, context, params):
+            context.connect_start = asyncio.get_running_loop().time()
+
+        async def on_connection_create_end(session, context, params):
+            if context.trace_request_ctx is not None:
+                context.trace_request_ctx.connected(asyncio.get_running_loop().time() - context.connect_start)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_start.append(on_connection_create_start)
+        trace_config.on_connection_create_end.append(on_connection_create_end)
+        return trace_config
+
+    async def base_url(self, organization_id):
+        """Return the platform URL to send the calls of organization_id to; see CoveoClient.base_url."""
+        if self.platform_url:
+            return self.platform_url
+        # The resolver blocks on its state file, so it runs in a worker thread and sends its probes back to this loop
+        loop = asyncio.get_running_loop()
+        probe = lambda url: asyncio.run_coroutine_threadsafe(self._probe_region(url, organization_id), loop).result()
+        return await asyncio.to_thread(self.resolver.platform_url, organization_id, probe)
+
+    async def _probe_region(self, url, organization_id):
+        """Ask regional host url about the organization; see CoveoClient._probe_region."""
+        try:
+            async with self._request("GET", url + SNAPSHOTS_PATH.format(organizationId=organization_id),
+                                     organization_id, "region", allow_redirects=False) as response:
+                return probe_answer(url, response.status, response.headers.get("Location"))
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError):
+            return None
+
+    async def snapshots_url(self, organization_id):
+        return await self.base_url(organization_id) + SNAPSHOTS_PATH.format(organizationId=organization_id)
+
+    async def _token(self, organization_id):
+        """Return the current token, fetching it in a worker thread only when none is cached."""
+        token = self.credentials.cached_token(organization_id)
+        if token is None:
+            token = await asyncio.to_thread(self.credentials.token, organization_id)
+        return token
+
+    @contextlib.asynccontextmanager
+    async def _request(self, method, url, organization_id, operation="request", **kwargs):
+        """Send a request unless its host or organization circuit is open; see CoveoClient._request."""
+        scopes = circuit_scopes(url, organization_id)
+        self.breaker.before_call(scopes)
+        responded = False
+        try:
+            async with self._send(method, url, organization_id, operation, **kwargs) as response:
+                # As in CoveoClient._request, the call counts as a success once its response is in:
+                # errors raised while the caller reads the body are not the breaker's to count
+                self.breaker.succeeded(scopes)
+                responded = True
+                yield response
+        except BaseException as e:
+            if responded:
+                raise
+            if isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+                self.breaker.failed(scopes)
+            elif isinstance(e, aiohttp.ClientResponseError):
+                if e.status in RETRY_STATUSES:
+                    self.breaker.failed(scopes)
+                else:
+                    self.breaker.succeeded(scopes)
+                if e.status == 403 and operation != "region" and not self.platform_url:
+                    # The organization may have moved to another region: resolve it again on the next call
+                    self.resolver.forget(organization_id)
+            else:
+                self.breaker.released(scopes)
+            raise
+
+    @contextlib.asynccontextmanager
+    async def _send(self, method, url, organization_id, operation, **kwargs):
+        """
+        Send a request through the shared pool, retrying transient failures.
+
+        Yields the successful response and releases its connection on exit, which is when
+        the attempt's timing is recorded. Rate limiting and the retry policy are the ones
+        of CoveoClient._request.
+        """
+        retry_statuses = _retry_statuses(method)
+        retry_errors = (aiohttp.ClientConnectionError, asyncio.TimeoutError) if method.upper() in IDEMPOTENT_METHODS \
+            else (aiohttp.ClientConnectorError,)
+
+        headers = kwargs.pop("headers", None) or {}
+        key_id = self.credentials.key_id(organization_id)
+        reauthenticated = False
+
+        attempt = 0
+        while True:
+            await self.governor.acquire_async(key_id, organization_id)
+            throttled = False
+            token = await self._token(organization_id)
+            timing = self.metrics.start(operation, organization_id, method, url, attempt)
+            try:
+                response = await self.session.request(method, url, trace_request_ctx=timing,
+                                                      headers={**headers, "Authorization": f"Bearer {token}"}, **kwargs)
+            except Exception as e:
+                timing.finish(error=e)
+                if not isinstance(e, retry_errors) or attempt >= self.max_retries:
+                    raise
+                delay = _backoff_delay(attempt, self.backoff_factor, self.backoff_max)
+                reason = str(e) or type(e).__name__
+            else:
+                timing.headers_received(response.status)
+                if response.status == 401 and not reauthenticated:
+                    reauthenticated = True
+                    timing.finish()
+                    response.release()
+                    self.credentials.invalidate(organization_id, token)
+                    log_info(f"{method} {url} was rejected with HTTP 401; retrying with a new token")
+                    continue
+                delay = _retry_delay(response.headers, attempt, self.backoff_factor, self.backoff_max)
+                throttled = response.status == 429
+                if throttled:
+                    self.governor.throttled(key_id, organization_id, delay)
+                else:
+                    self.governor.succeeded(key_id, organization_id)
+                if response.status not in retry_statuses or attempt >= self.max_retries:
+                    try:
+                        response.raise_for_status()
+                        yield response
+                    except BaseException as e:
+                        # Cancellation and an abandoned generator end the attempt too
+                        timing.finish(response.content.total_bytes, error=e, wire=_wire_bytes(response))
+                        raise
+                    else:
+                        timing.finish(response.content.total_bytes, wire=_wire_bytes(response))
+                    finally:
+                        response.release()
+                    return
+                reason = f"HTTP {response.status}"
+                timing.finish()
+                response.release()
+            attempt += 1
+            log_info(f"{method} {url} failed ({reason}); retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            if not throttled:
+                await asyncio.sleep(delay)
+
+    async def create_snapshot(self, organization_id, snapshot_name, resource_types=RESOURCE_TYPES):
+        """
+        Create a new snapshot of the organization.
+
+        Args:
+            organization_id (str): Coveo organization ID.
+            snapshot_name (str): Name for the snapshot.
+            resource_types (list): Resource types to export, all of them by default.
+
+        Returns:
+            str: The ID of the created snapshot.
+        """
+        url = f"{await self.snapshots_url(organization_id)}/self"
+        body = create_snapshot_body(snapshot_name, resource_types)
+        try:
+            async with self._request("POST", url, organization_id, "create", json=body) as response:
+                return (await response.json())["id"]
+        except Exception as e:
+            log_error(f"Failed to create snapshot: {e}")
+            raise
+
+    async def get_snapshot(self, organization_id, snapshot_id):
+        """Fetch the metadata of a snapshot, including its status."""
+        url = f"{await self.snapshots_url(organization_id)}/{snapshot_id}"
+        async with self._request("GET", url, organization_id, "status") as response:
+            return await response.json()
+
+    async def wait_for_snapshot(self, organization_id, snapshot_id, timeout=SNAPSHOT_TIMEOUT,
+                                poll_interval=POLL_INTERVAL, max_poll_interval=POLL_MAX_INTERVAL):
+        """
+        Poll a snapshot until it is COMPLETED, backing off exponentially between polls.
+
+        Returns:
+            dict: The completed snapshot model.
+
+        Raises:
+            SnapshotError: If the snapshot ends in the ERROR status.
+            TimeoutError: If the snapshot is not completed before the deadline.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        interval = poll_interval
+        while True:
+            snapshot = await self.get_snapshot(organization_id, snapshot_id)
+            status = snapshot.get("status")
+            if status == "COMPLETED":
+                return snapshot
+            if status == "ERROR":
+                raise SnapshotError(f"Snapshot {snapshot_id} failed with status ERROR")
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError(f"Snapshot {snapshot_id} not ready after {timeout:.0f} seconds (status {status})")
+            await asyncio.sleep(min(interval, remaining))
+            interval = min(interval * 2, max_poll_interval)
+
+    async def export_snapshot_content(self, organization_id, snapshot_id, output_path):
+        """
+        Stream the content of a snapshot to output_path, hashing it as it is written.
+
+        Returns:
+            tuple: The path to the saved snapshot content file and the hex SHA-256 of its bytes.
+        """
+        url = f"{await self.snapshots_url(organization_id)}/{snapshot_id}/content"
+        try:
+            return output_path, await self._download(url, output_path, organization_id)
+        except Exception as e:
+            log_error(f"Failed to export snapshot content: {e}")
+            raise
+
+    async def _download(self, url, output_path, organization_id):
+        """
+        Resumable download of url to output_path; see CoveoClient._download.
+
+        The bookkeeping is the same ResumableDownload; its file I/O runs in worker threads
+        so that writing one organization's snapshot to disk never stalls the event loop.
+        """
+        download = ResumableDownload(url, output_path)
+        await asyncio.to_thread(download.load)
+        wire_bytes = 0
+        encoding = "identity"
+
+        attempt = 0
+        while True:
+            try:
+                async with self._request("GET", url, organization_id, "content",
+                                         headers=download.request_headers()) as response:
+                    f = await asyncio.to_thread(download.start, response.status, response.headers)
+                    try:
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            await asyncio.to_thread(download.write, f, chunk)
+                    finally:
+                        wire_bytes += _wire_bytes(response)
+                        await asyncio.to_thread(f.close)
+                    encoding = response.headers.get("Content-Encoding", "identity")
+                await asyncio.to_thread(download.verify)
+                break
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError,
+                    IncompleteDownloadError) as e:
+                await asyncio.to_thread(download.save_progress)
+                if attempt >= self.max_retries:
+                    raise
+                delay = _backoff_delay(attempt, self.backoff_factor, self.backoff_max)
+                attempt += 1
+                log_info(f"Download of {url} interrupted at byte {download.received} ({e}); "
+                         f"retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            except aiohttp.ClientResponseError as e:
+                if e.status != 416 or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                download.restart()
+
+        sha256 = await asyncio.to_thread(download.finish)
+        log_info(f"Downloaded {download.received} bytes from {url} ({wire_bytes} bytes on the wire, {encoding} encoding)")
+        return sha256
+
+    async def delete_snapshot(self, organization_id, snapshot_id):
+        """Delete a snapshot from Coveo by snapshotId. A snapshot that no longer exists counts as deleted."""
+        url = f"{await self.snapshots_url(organization_id)}/{snapshot_id}"
+        try:
+            async with self._request("DELETE", url, organization_id, "delete"):
+                pass
+        except aiohttp.ClientResponseError as e:
+            if e.status != 404:
+                log_error(f"Failed to delete snapshot: {e}")
+                raise
+            log_info(f"Snapshot {snapshot_id} was already deleted")
+        except Exception as e:
+            log_error(f"Failed to delete snapshot: {e}")
+            raise
@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import threading
+import time
+import requests
+from logger import log_info, log_error
+
+# Tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = float(os.getenv("COVEO_TOKEN_REFRESH_MARGIN", "300"))
+# Seconds between attempts when refreshing a token fails
+TOKEN_RETRY_INTERVAL = 30.0
+
+
+def api_key_id(api_key):
+    """Non-secret identifier of an API key, used to key its rate budget."""
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:12]
+
+
+class StaticKeyProvider:
+    """
+    Credential provider handing out one API key for every organization.
+
+    Every provider exposes token(organization_id), the bearer token to send;
+    cached_token(organization_id), the same without any I/O (None if a fetch is needed);
+    key_id(organization_id), a non-secret identifier of the credential used for rate
+    budgets; and invalidate(organization_id, token), called when the platform rejected
+    token with a 401.
+    """
+
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+    def token(self, organization_id):
+        return self.api_key
+
+    def cached_token(self, organization_id):
+        return self.api_key
+
+    def key_id(self, organization_id):
+        return api_key_id(self.api_key)
+
+    def invalidate(self, organization_id, token):
+        pass
+
+
+class OAuthClientCredentialsProvider:
+    """
+    Credential provider fetching access tokens with the OAuth client-credentials grant.
+
+    The token is shared by every organization and cached until it expires. A background
+    thread refreshes it refresh_margin seconds before expiry, so calls never wait for a
+    token (or hit a 401) once the first one is fetched; if the refresh fails it is retried
+    until the token expires, after which calls fetch a new token themselves.
+    """
+
+    def __init__(self, token_url, client_id, client_secret, scope=None, refresh_margin=TOKEN_REFRESH_MARGIN,
+                 timeout=(5, 30)):
+        self.token_url = token_url
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.scope = scope
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        # lock only guards the cached token, so cached_token() never waits on the network;
+        # fetch_lock makes concurrent callers and the refresher share one fetch
+        self.lock = threading.Lock()
+        self.fetch_lock = threading.Lock()
+        self.access_token = None
+        self.expires_at = 0.0
+        self.refresher = None
+        self.wakeup = threading.Event()
+
+    def _fetch(self):
+        """Request a new access token and return it with its time.monotonic() expiry."""
+        data = {"grant_type": "client_credentials"}
+        if self.scope:
+            data["scope"] = self.scope
+        response = requests.post(self.token_url, data=data, auth=(self.client_id, self.client_secret),
+                                 timeout=self.timeout)
+        response.raise_for_status()
+        payload = response.json()
+        expires_in = float(payload.get("expires_in", 3600))
+        log_info(f"Fetched an access token for client {self.client_id}, valid for {expires_in:.0f}s")
+        return payload["access_token"], time.monotonic() + expires_in
+
+    def _store(self, access_token, expires_at):
+        with self.lock:
+            self.access_token = access_token
+            self.expires_at = expires_at
+        return access_token
+
+    def _refresh_due(self):
+        with self.lock:
+            return self.expires_at - self.refresh_margin - time.monotonic()
+
+    def _refresh_loop(self):
+        while True:
+            delay = self._refresh_due()
+            if delay > 0:
+                self.wakeup.wait(delay)
+                self.wakeup.clear()
+                continue
+            try:
+                with self.fetch_lock:
+                    if self._refresh_due() <= 0:
+                        self._store(*self._fetch())
+            except Exception as e:
+                log_error(f"Refreshing the access token failed: {e}")
+                # An invalidate() cuts the back-off short
+                self.wakeup.wait(TOKEN_RETRY_INTERVAL)
+                self.wakeup.clear()
+
+    def token(self, organization_id):
+        token = self.cached_token(organization_id)
+        if token is None:
+            with self.fetch_lock:
+                # Another caller or the refresher may have fetched one meanwhile
+                token = self.cached_token(organization_id) or self._store(*self._fetch())
+        with self.lock:
+            if self.refresher is None:
+                self.refresher = threading.Thread(target=self._refresh_loop, name="oauth-token-refresh", daemon=True)
+                self.refresher.start()
+        return token
+
+    def cached_token(self, organization_id):
+        with self.lock:
+            if self.access_token is not None and time.monotonic() < self.expires_at:
+                return self.access_token
+        return None
+
+    def key_id(self, organization_id):
+        return api_key_id(self.client_id)
+
+    def invalidate(self, organization_id, token):
+        with self.lock:
+            if token == self.access_token:
+                self.access_token = None
+                self.expires_at = 0.0
+        self.wakeup.set()
+
+
+class PerOrgKeyProvider:
+    """
+    Credential provider using the API key listed for each organization in a JSON file,
+    e.g. {"myorg": "xx-key"}; other organizations get the fallback provider's credentials.
+    """
+
+    def __init__(self, path, fallback=None):
+        with open(path) as f:
+            self.keys = {organization_id: StaticKeyProvider(key) for organization_id, key in json.load(f).items()}
+        self.fallback = fallback
+
+    def _provider(self, organization_id):
+        provider = self.keys.get(organization_id, self.fallback)
+        if provider is None:
+            raise KeyError(f"No credentials configured for organization {organization_id}")
+        return provider
+
+    def token(self, organization_id):
+        return self._provider(organization_id).token(organization_id)
+
+    def cached_token(self, organization_id):
+        return self._provider(organization_id).cached_token(organization_id)
+
+    def key_id(self, organization_id):
+        return self._provider(organization_id).key_id(organization_id)
+
+    def invalidate(self, organization_id, token):
+        self._provider(organization_id).invalidate(organization_id, token)
+
+
+def get_credential_provider(api_key=None):
+    """
+    Build the credential provider configured in the environment.
+
+    An explicit api_key wins. Otherwise OAuth client credentials (COVEO_OAUTH_TOKEN_URL,
+    COVEO_OAUTH_CLIENT_ID and COVEO_OAUTH_CLIENT_SECRET) are used when all are set, else
+    COVEO_API_KEY. COVEO_CREDENTIALS_FILE overrides either for the organizations it lists.
+    The environment is read on each call, so values loaded from .env are picked up.
+
+    Raises:
+        ValueError: If no credentials are configured at all.
+    """
+    if api_key:
+        return StaticKeyProvider(api_key)
+    token_url = os.getenv("COVEO_OAUTH_TOKEN_URL")
+    client_id = os.getenv("COVEO_OAUTH_CLIENT_ID")
+    client_secret = os.getenv("COVEO_OAUTH_CLIENT_SECRET")
+    if token_url and client_id and client_secret:
+        provider = OAuthClientCredentialsProvider(token_url, client_id, client_secret, os.getenv("COVEO_OAUTH_SCOPE"))
+    else:
+        api_key = os.getenv("COVEO_API_KEY")
+        provider = StaticKeyProvider(api_key) if api_key else None
+    credentials_file = os.getenv("COVEO_CREDENTIALS_FILE")
+    if credentials_file:
+        return PerOrgKeyProvider(credentials_file, provider)
+    if provider is None:
+        raise ValueError("No Coveo credentials configured: set COVEO_API_KEY, the COVEO_OAUTH_TOKEN_URL, "
+                         "COVEO_OAUTH_CLIENT_ID and COVEO_OAUTH_CLIENT_SECRET variables, or COVEO_CREDENTIALS_FILE")
+    return provider
@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from state import state_path
+from logger import log_info, log_error
+
+DELETE_QUEUE_FILE = "delete_queue.sqlite3"
+DELETE_BATCH_SIZE = int(os.getenv("COVEO_DELETE_BATCH_SIZE", "10"))
+# How long the run waits for queued deletes at exit; whatever is left is retried next run
+DELETE_DRAIN_TIMEOUT = float(os.getenv("COVEO_DELETE_DRAIN_TIMEOUT", "10"))
+# A snapshot is registered for deletion when created, to be deleted after this lease unless the
+# run finishes with it sooner; this is what lets the next run clean up after a crashed one
+DELETE_LEASE = float(os.getenv("COVEO_DELETE_LEASE", "7200"))
+DELETE_RETRY_BASE = 30.0
+DELETE_RETRY_MAX = 3600.0
+
+
+class DeleteQueue:
+    """
+    Persistent queue of server-side snapshots to delete, stored in SQLite.
+
+    Each entry has a due time: entries registered with a lease only become due once the
+    lease expires, and failed deletes are pushed back with exponential backoff.
+    """
+
+    def __init__(self, path=None):
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path or state_path(DELETE_QUEUE_FILE),
+                                          check_same_thread=False, isolation_level=None)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pending_deletes ("
+            " organization_id TEXT NOT NULL,"
+            " snapshot_id TEXT NOT NULL,"
+            " due REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " last_error TEXT,"
+            " PRIMARY KEY (organization_id, snapshot_id))"
+        )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def enqueue(self, organization_id, snapshot_id, delay=0.0):
+        """Schedule a snapshot for deletion in delay seconds, replacing any earlier schedule."""
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO pending_deletes (organization_id, snapshot_id, due) VALUES (?, ?, ?)"
+                " ON CONFLICT (organization_id, snapshot_id) DO UPDATE SET due = excluded.due",
+                (organization_id, snapshot_id, time.time() + delay)
+            )
+
+    def due(self, limit):
+        """Return up to limit (organization_id, snapshot_id, attempts) entries that are due now."""
+        with self.lock:
+            return self.connection.execute(
+                "SELECT organization_id, snapshot_id, attempts FROM pending_deletes"
+                " WHERE due <= ? ORDER BY due LIMIT ?", (time.time(), limit)
+            ).fetchall()
+
+    def next_due(self):
+        """Return the earliest due time in the queue, or None if it is empty."""
+        with self.lock:
+            return self.connection.execute("SELECT MIN(due) FROM pending_deletes").fetchone()[0]
+
+    def complete(self, organization_id, snapshot_id):
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM pending_deletes WHERE organization_id = ? AND snapshot_id = ?",
+                (organization_id, snapshot_id)
+            )
+
+    def failed(self, organization_id, snapshot_id, attempts, error):
+        """Record a failed delete and push the entry back with exponential backoff."""
+        delay = min(DELETE_RETRY_MAX, DELETE_RETRY_BASE * (2 ** attempts))
+        with self.lock:
+            self.connection.execute(
+                "UPDATE pending_deletes SET attempts = attempts + 1, due = ?, last_error = ?"
+                " WHERE organization_id = ? AND snapshot_id = ?",
+                (time.time() + delay, str(error), organization_id, snapshot_id)
+            )
+
+    def pending(self, organization_id):
+        """Return the IDs of the snapshots of an organization that are queued for deletion, due or not."""
+        with self.lock:
+            return {row[0] for row in self.connection.execute(
+                "SELECT snapshot_id FROM pending_deletes WHERE organization_id = ?", (organization_id,))}
+
+    def pending_count(self):
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM pending_deletes").fetchone()[0]
+
+
+class DeleteWorker(threading.Thread):
+    """
+    Background thread draining a DeleteQueue in batches of concurrent deletes.
+
+    The worker starts with whatever earlier runs left due in the queue, wakes up when
+    notify() is called after an enqueue and keeps going until stop() is called.
+    """
+
+    def __init__(self, client, queue, batch_size=DELETE_BATCH_SIZE):
+        super().__init__(name="snapshot-delete-worker", daemon=True)
+        self.client = client
+        self.queue = queue
+        self.batch_size = batch_size
+        self.wakeup = threading.Event()
+        self.stopping = threading.Event()
+        self.deadline = None
+
+    def notify(self):
+        self.wakeup.set()
+
+    def stop(self, timeout=DELETE_DRAIN_TIMEOUT):
+        """
+        Finish the deletes that are due, starting none after timeout seconds, then stop.
+
+        Deletes already in flight at the timeout are still waited for, so the client and
+        the queue can be closed once this returns.
+        """
+        self.deadline = time.monotonic() + timeout
+        self.stopping.set()
+        self.wakeup.set()
+        self.join(timeout)
+        if self.is_alive():
+            log_info("Waiting for the snapshot deletions in flight to finish")
+            self.join()
+        pending = self.queue.pending_count()
+        if pending:
+            log_info(f"{pending} snapshot deletion(s) still queued for a later run")
+
+    def _delete_entry(self, entry):
+        organization_id, snapshot_id, attempts = entry
+        try:
+            self.client.delete_snapshot(organization_id, snapshot_id)
+        except Exception as e:
+            self.queue.failed(organization_id, snapshot_id, attempts, e)
+            return
+        self.queue.complete(organization_id, snapshot_id)
+        log_info(f"Deleted snapshot {snapshot_id} from Coveo.")
+
+    def run(self):
+        with ThreadPoolExecutor(max_workers=self.batch_size) as pool:
+            while True:
+                if self.stopping.is_set() and time.monotonic() >= self.deadline:
+                    return
+                try:
+                    batch = self.queue.due(self.batch_size)
+                except Exception as e:
+                    log_error(f"Failed to read the snapshot deletion queue: {e}")
+                    return
+                if batch:
+                    list(pool.map(self._delete_entry, batch))
+                    continue
+                if self.stopping.is_set():
+                    return
+                next_due = self.queue.next_due()
+                timeout = None if next_due is None else max(0.0, next_due - time.time())
+                self.wakeup.wait(timeout)
+                self.wakeup.clear()
@@ -0,0 +1,115 @@
+import ipaddress
+import os
+import socket
+import threading
+import time
+from urllib3.exceptions import NameResolutionError
+from state import load_state, save_state
+from logger import log_info
+
+# Seconds a resolved platform host address is reused, across runs, before resolving it again
+DNS_CACHE_TTL = float(os.getenv("COVEO_DNS_CACHE_TTL", "3600"))
+
+STATE_FILE = "dns_cache.json"
+
+
+class DnsCache:
+    """
+    Host name resolutions shared by every connection and kept in the state directory.
+
+    Slow resolvers are only queried once per host and TTL instead of once per connection
+    and run. When a resolution fails, the last known addresses are used even if expired,
+    so a resolver outage does not stop backups of hosts that were reachable before.
+
+    Only resolutions are cached: no connection is opened ahead of time. Connections are
+    opened when a request needs one and kept alive by the client's pool, so the status
+    polls and the download that follow create_snapshot reuse its connection.
+    """
+
+    def __init__(self, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = None
+
+    def _load(self):
+        if self.entries is None:
+            self.entries = load_state(STATE_FILE)
+        return self.entries
+
+    def resolve(self, host, port):
+        """
+        Return the addresses of host as a list of (family, address) pairs.
+
+        Raises:
+            socket.gaierror: If host cannot be resolved and was never resolved before.
+        """
+        try:
+            return [(socket.AF_INET6 if ipaddress.ip_address(host).version == 6 else socket.AF_INET, host)]
+        except ValueError:
+            pass
+        with self.lock:
+            entry = self._load().get(host)
+        if entry and time.time() - entry["resolved"] < self.ttl:
+            return [tuple(address) for address in entry["addresses"]]
+        try:
+            infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            if not entry:
+                raise
+            log_info(f"Resolving {host} failed ({e}); using addresses cached {time.time() - entry['resolved']:.0f}s ago")
+            return [tuple(address) for address in entry["addresses"]]
+        addresses = []
+        for family, _, _, _, sockaddr in infos:
+            if (family, sockaddr[0]) not in addresses:
+                addresses.append((family, sockaddr[0]))
+        with self.lock:
+            entries = self._load()
+            entries[host] = {"addresses": addresses, "resolved": time.time()}
+            save_state(STATE_FILE, entries)
+        return addresses
+
+    def expire(self, host):
+        """
+        Resolve host again on next use, e.g. after connecting to its addresses failed.
+
+        The addresses are kept as the fallback for a failing resolver.
+        """
+        with self.lock:
+            entry = self._load().get(host)
+            if entry and entry["resolved"]:
+                entry["resolved"] = 0
+                save_state(STATE_FILE, self.entries)
+
+
+DNS_CACHE = DnsCache()
+
+
+class CachedDnsConnectionMixin:
+    """
+    Mixin for urllib3 connections that connects to the addresses cached in DNS_CACHE.
+
+    Like urllib3's create_connection, each address is tried in turn until one accepts the
+    connection. Only the address connected to changes: the Host header, TLS SNI and
+    certificate checks still use the host name.
+    """
+
+    def _new_conn(self):
+        host = self._dns_host
+        try:
+            addresses = DNS_CACHE.resolve(host.rstrip("."), self.port)
+        except socket.gaierror as e:
+            raise NameResolutionError(host, self, e) from e
+        try:
+            for index, (_, address) in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    return super()._new_conn()
+                except Exception:
+                    if index == len(addresses) - 1:
+                        raise
+        except Exception:
+            # None of the cached addresses answered: they may be stale
+            DNS_CACHE.expire(host.rstrip("."))
+            raise
+        finally:
+            self._dns_host = host
@@ -0,0 +1,538 @@
+"""
+Local stand-in for the Coveo snapshot endpoints used by coveo_api.py.
+
+Serves the same routes as the platform (create, list, status, content and delete), and a
+listing of each resource type for the change probe, with configurable latency, bandwidth,
+error rates and snapshot build time, so the backup pipeline can be benchmarked and
+exercised offline:
+
+    python src/fake_coveo_server.py --port 8080 --build-time 5 --bandwidth 2000000
+    COVEO_PLATFORM_URL=http://127.0.0.1:8080 python src/backup.py
+
+Snapshot content is built from the JSON inside the latest ZIP in snapshots/ (or each
+of them in turn with --rotate) or, with --synthetic, from a generated organization of
+the requested size.
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import re
+import signal
+import sys
+import threading
+import time
+import uuid
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+SNAPSHOT_DIR = os.path.join(PROJECT_ROOT, 'snapshots')
+
+LIST_ROUTE = re.compile(r"^/rest/organizations/(?P<org>[^/]+)/snapshots/?(?:\?.*)?$")
+ROUTE = re.compile(r"^/rest/organizations/(?P<org>[^/]+)/snapshots/(?P<snapshot>[^/?]+)(?P<content>/content)?/?(?:\?.*)?$")
+# Listing of one resource type, as the change probe reads (see change_probe.py)
+RESOURCE_ROUTE = re.compile(r"^/rest/organizations/(?P<org>[^/]+)/resources/(?P<type>[A-Z_]+)/?(?:\?.*)?$")
+TOKEN_ROUTE = "/oauth/token"
+# Shapes of snapshot listings the server can answer with; see FakeCoveoServer
+LISTINGS = ("list", "paged", "unpaged")
+CHUNK_SIZE = 64 * 1024
+# Parent types of the child resource types found in snapshots: a snapshot exports the
+# children of every type it requests. Types not listed are top-level, exported only when requested.
+CHILD_RESOURCE_PARENTS = {
+    "MAPPING": ["SOURCE"],
+    "SECURITY_PROVIDER": ["SOURCE"],
+    "ML_MODEL_ASSOCIATION": ["QUERY_PIPELINE", "ML_MODEL"],
+    **{child: ["QUERY_PIPELINE"] for child in (
+        "THESAURUS", "RESULT_RANKING", "STATEMENT_GROUP", "QUERY_PIPELINE_CONDITION", "FILTER", "SETTING",
+        "STOP_WORD", "RANKING_WEIGHT", "TRIGGER")},
+}
+
+# Relative share of each resource type in a generated organization, taken from a real snapshot
+SYNTHETIC_TYPE_WEIGHTS = {
+    "MAPPING": 2507, "THESAURUS": 664, "FIELD": 471, "RESULT_RANKING": 456, "STATEMENT_GROUP": 292,
+    "QUERY_PIPELINE_CONDITION": 91, "FILTER": 53, "SETTING": 45, "SOURCE": 34, "ML_MODEL_ASSOCIATION": 32,
+    "QUERY_PIPELINE": 30, "EXTENSION": 20, "ML_MODEL": 18, "STOP_WORD": 16, "SEARCH_PAGE": 7,
+    "RANKING_WEIGHT": 4, "TRIGGER": 3, "SECURITY_PROVIDER": 1,
+}
+
+
+def load_snapshot_documents(directory=SNAPSHOT_DIR):
+    """Return the raw JSON bytes of every snapshot ZIP in directory and its per-organization subdirectories, oldest first."""
+    paths = [os.path.join(root, fname) for root, _, fnames in os.walk(directory) for fname in fnames if fname.endswith(".zip")]
+    documents = []
+    for path in sorted(paths, key=os.path.basename):
+        with zipfile.ZipFile(path) as z:
+            members = [info for info in z.infolist() if info.filename.lower().endswith(".json")]
+            if len(members) == 1:
+                documents.append(z.read(members[0]))
+    return documents
+
+
+def generate_snapshot_document(resource_count, seed=0, change_rate=0.0, generation=0):
+    """
+    Generate a snapshot JSON document with about resource_count resources.
+
+    The document is fully determined by seed. With change_rate > 0, that fraction of the
+    resources is modified differently for each generation, simulating configuration drift
+    between consecutive snapshots.
+    """
+    rng = random.Random(seed)
+    total_weight = sum(SYNTHETIC_TYPE_WEIGHTS.values())
+    drift = random.Random(f"{seed}-{generation}")
+    resources = {}
+    for resource_type, weight in SYNTHETIC_TYPE_WEIGHTS.items():
+        count = max(1, round(resource_count * weight / total_weight))
+        entries = []
+        for i in range(count):
+            name = f"{resource_type.lower()}_{i}_{rng.getrandbits(32):08x}"
+            model = {
+                "name": name,
+                "description": f"Generated {resource_type.lower()} {i}",
+                "enabled": rng.random() < 0.8,
+                "position": rng.randint(0, 1000),
+                "tags": [f"tag{rng.randint(0, 50)}" for _ in range(rng.randint(0, 4))],
+            }
+            if change_rate and drift.random() < change_rate:
+                model["position"] = drift.randint(1001, 2000)
+            entries.append({"model": model, "parents": {}, "resourceName": name})
+        resources[resource_type] = entries
+    return json.dumps({"metadata": {"schemaVersion": "v1"}, "resources": resources}).encode("utf-8")
+
+
+def export_resources(document, resources_to_export):
+    """
+    Return the JSON document restricted to the requested resource types and their children.
+
+    The document is returned as is when nothing is left out.
+    """
+    requested = set(resources_to_export)
+    parsed = json.loads(document)
+    resources = parsed.get("resources", {})
+    kept = {resource_type: items for resource_type, items in resources.items()
+            if resource_type in requested or requested & set(CHILD_RESOURCE_PARENTS.get(resource_type, ()))}
+    if len(kept) == len(resources):
+        return document
+    return json.dumps({**parsed, "resources": kept}).encode("utf-8")
+
+
+def build_zip(snapshot_id, document, compression=zipfile.ZIP_DEFLATED):
+    """Wrap a snapshot JSON document in a ZIP whose single member is named after the snapshot."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression) as z:
+        z.writestr(f"{snapshot_id}.json", document)
+    return buffer.getvalue()
+
+
+class FakeCoveoServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server holding the fake platform state.
+
+    Args:
+        address (tuple): (host, port) to bind; port 0 picks a free port.
+        documents (list): Snapshot JSON documents, served in rotation for each new export.
+        document_factory (callable): Alternative to documents; called with the export
+            sequence number and returns the JSON bytes of that snapshot. Snapshots with the
+            same developerNotes share an export, and each holds only the resourcesToExport
+            types and their children (see CHILD_RESOURCE_PARENTS).
+        latency (float): Seconds added before answering every request.
+        bandwidth (float): Content download rate in bytes per second (0 for unlimited).
+        build_time (float): Seconds a snapshot stays IN_PROGRESS before COMPLETED.
+        error_rate_429 (float): Probability of answering any request with 429.
+        error_rate_5xx (float): Probability of answering any request with 503.
+        retry_after (float): Retry-After value sent with 429 responses.
+        seed (int): Seed for error injection.
+        stored (bool): Store the snapshot JSON uncompressed in the ZIP.
+        gzip (bool): Send content gzip-encoded to clients that accept it.
+        organizations (list): Organizations hosted by this server, as in one platform
+            region; requests for any other organization get a 403. None hosts them all.
+        stall_rate (float): Probability of answering any request stall_time seconds late.
+        stall_time (float): Extra delay of stalled requests, to reproduce tail latency.
+        token_lifetime (float): When set, POST /oauth/token issues access tokens valid for
+            this many seconds and every other request needs an unexpired one, else gets a 401.
+        listing (str): How snapshot listings answer: "list", a plain list of the requested
+            page; "paged", {"items": [...], "totalPages": n}; "unpaged", a plain list of every
+            snapshot whatever page and perPage ask for.
+        drift_on_export (bool): Move the organizations to their next state after each
+            export. When False, they only change when drift() is called, so the resource
+            listings read by the change probe stay the same between exports.
+    """
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), documents=None, document_factory=None, latency=0.0,
+                 bandwidth=0.0, build_time=0.0, error_rate_429=0.0, error_rate_5xx=0.0, retry_after=1.0,
+                 seed=0, verbose=False, stored=False, gzip=False, organizations=None, token_lifetime=0.0,
+                 stall_rate=0.0, stall_time=20.0, listing="list", drift_on_export=True):
+        super().__init__(address, FakeCoveoHandler)
+        if listing not in LISTINGS:
+            raise ValueError(f"Unknown listing {listing!r}; expected one of {', '.join(LISTINGS)}")
+        if document_factory is None:
+            documents = documents or load_snapshot_documents()
+            if not documents:
+                raise ValueError("No snapshot documents to serve")
+            document_factory = lambda sequence: documents[sequence % len(documents)]
+        self.document_factory = document_factory
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.build_time = build_time
+        self.error_rate_429 = error_rate_429
+        self.error_rate_5xx = error_rate_5xx
+        self.retry_after = retry_after
+        self.verbose = verbose
+        self.compression = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+        self.gzip = gzip
+        self.organizations = set(organizations) if organizations else None
+        self.token_lifetime = token_lifetime
+        self.stall_rate = stall_rate
+        self.stall_time = stall_time
+        self.listing = listing
+        self.tokens = {}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.snapshots = {}
+        self.drift_on_export = drift_on_export
+        self.sequence = 0
+        self.exports = {}
+        self.stats = {"requests": 0, "throttled": 0, "failed": 0, "created": 0, "deleted": 0, "content_bytes": 0,
+                      "tokens": 0, "unauthorized": 0, "stalled": 0}
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve in a background thread and return the base URL to use as COVEO_PLATFORM_URL."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def create(self, organization_id, body):
+        # Snapshots created with the same developerNotes belong to one export (e.g. its shards) and see
+        # the organization in the same state; unless drift_on_export is False, each new export sees the next one
+        export = (organization_id, body.get("developerNotes", ""))
+        with self.lock:
+            if export not in self.exports:
+                self.exports[export] = self.sequence
+                if self.drift_on_export:
+                    self.sequence += 1
+            sequence = self.exports[export]
+            self.stats["created"] += 1
+        document = self.document_factory(sequence)
+        if body.get("resourcesToExport"):
+            document = export_resources(document, body["resourcesToExport"])
+        snapshot_id = f"{organization_id}-{uuid.uuid4().hex[:26]}"
+        snapshot = {
+            "id": snapshot_id,
+            "organizationId": organization_id,
+            "developerNotes": body.get("developerNotes", ""),
+            "createdDate": int(time.time() * 1000),
+            "ready_at": time.monotonic() + self.build_time,
+            "content": build_zip(snapshot_id, document, self.compression),
+        }
+        if self.gzip:
+            snapshot["content_gzip"] = gzip.compress(snapshot["content"], compresslevel=6)
+        with self.lock:
+            self.snapshots[(organization_id, snapshot_id)] = snapshot
+        return snapshot
+
+    def seed_orphans(self, organization_id, count, age=86400.0):
+        """Add count completed snapshots created age seconds ago, as left behind by crashed backups."""
+        created = int((time.time() - age) * 1000)
+        with self.lock:
+            for i in range(count):
+                snapshot_id = f"{organization_id}-{uuid.uuid4().hex[:26]}"
+                self.snapshots[(organization_id, snapshot_id)] = {
+                    "id": snapshot_id,
+                    "organizationId": organization_id,
+                    "developerNotes": f"Snapshot - snapshot_{time.strftime('%Y%m%d_%H%M%S', time.localtime(created / 1000))}",
+                    "createdDate": created,
+                    "ready_at": 0.0,
+                    "content": b"",
+                }
+
+    def drift(self):
+        """Move the organizations to their next state, as seen by resource listings and the next export."""
+        with self.lock:
+            self.sequence += 1
+
+    def resources(self, organization_id, resource_type):
+        """Return the resources of one type in the organization, in the state its next export will see."""
+        return json.loads(self.document_factory(self.sequence)).get("resources", {}).get(resource_type, [])
+
+    def list(self, organization_id):
+        with self.lock:
+            return [snapshot for (org, _), snapshot in self.snapshots.items() if org == organization_id]
+
+    def issue_token(self):
+        token = uuid.uuid4().hex
+        with self.lock:
+            self.tokens[token] = time.monotonic() + self.token_lifetime
+            self.stats["tokens"] += 1
+        return token
+
+    def authorized(self, authorization):
+        """Whether the Authorization header carries a valid token (always true without token_lifetime)."""
+        if not self.token_lifetime:
+            return True
+        token = (authorization or "").removeprefix("Bearer ")
+        with self.lock:
+            if time.monotonic() < self.tokens.get(token, 0.0):
+                return True
+            self.stats["unauthorized"] += 1
+        return False
+
+    def inject_stall(self):
+        """Return the extra delay of this request: stall_time with probability stall_rate, else 0."""
+        if not self.stall_rate:
+            return 0.0
+        with self.lock:
+            if self.random.random() >= self.stall_rate:
+                return 0.0
+            self.stats["stalled"] += 1
+        return self.stall_time
+
+    def inject_error(self):
+        """Return 429, 503 or None according to the configured error rates."""
+        with self.lock:
+            self.stats["requests"] += 1
+            draw = self.random.random()
+            if draw < self.error_rate_429:
+                self.stats["throttled"] += 1
+                return 429
+            if draw < self.error_rate_429 + self.error_rate_5xx:
+                self.stats["failed"] += 1
+                return 503
+        return None
+
+
+class FakeCoveoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload=None, headers=None):
+        body = json.dumps(payload).encode("utf-8") if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _prelude(self):
+        """Apply latency and error injection; return the route match or None if answered."""
+        delay = self.server.latency + self.server.inject_stall()
+        if delay:
+            time.sleep(delay)
+        error = self.server.inject_error()
+        if error == 429:
+            self._send_json(429, {"message": "Too many requests"}, {"Retry-After": f"{self.server.retry_after:g}"})
+            return None
+        if error:
+            self._send_json(error, {"message": "Service unavailable"})
+            return None
+        match = ROUTE.match(self.path) or LIST_ROUTE.match(self.path) or RESOURCE_ROUTE.match(self.path)
+        if not match:
+            self._send_json(404, {"message": f"No route for {self.path}"})
+            return None
+        if not self.server.authorized(self.headers.get("Authorization")):
+            self._send_json(401, {"message": "Invalid or expired access token"})
+            return None
+        if self.server.organizations is not None and match["org"] not in self.server.organizations:
+            self._send_json(403, {"message": f"Organization {match['org']} is not hosted in this region"})
+            return None
+        return match
+
+    @staticmethod
+    def _model(snapshot):
+        return {
+            "id": snapshot["id"],
+            "developerNotes": snapshot["developerNotes"],
+            "createdDate": snapshot["createdDate"],
+            "status": "COMPLETED" if time.monotonic() >= snapshot["ready_at"] else "IN_PROGRESS",
+            "size": len(snapshot["content"]),
+        }
+
+    def _send_list(self, organization_id):
+        """Answer a snapshot listing, paged with page/perPage and revalidated with If-None-Match."""
+        query = parse_qs(urlsplit(self.path).query)
+        snapshots = [self._model(snapshot) for snapshot in self.server.list(organization_id)]
+        if "perPage" in query and self.server.listing != "unpaged":
+            per_page = int(query["perPage"][0])
+            page = int(query.get("page", ["0"])[0])
+            total_pages = -(-len(snapshots) // per_page)
+            snapshots = snapshots[page * per_page:(page + 1) * per_page]
+        # The ETag only covers the page's snapshots, so a page stays unchanged while pages are added after it
+        etag = f'"{hashlib.sha1(json.dumps(snapshots).encode("utf-8")).hexdigest()}"'
+        if "perPage" in query and self.server.listing == "paged":
+            snapshots = {"items": snapshots, "totalPages": total_pages}
+        if etag in self.headers.get("If-None-Match", ""):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self._send_json(200, snapshots, {"ETag": etag})
+
+    def _snapshot(self, match):
+        snapshot = self.server.snapshots.get((match["org"], match["snapshot"]))
+        if snapshot is None:
+            self._send_json(404, {"message": f"Snapshot {match['snapshot']} not found"})
+        return snapshot
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)) or 0)
+        if self.path == TOKEN_ROUTE and self.server.token_lifetime:
+            return self._send_json(200, {"access_token": self.server.issue_token(), "token_type": "Bearer",
+                                         "expires_in": self.server.token_lifetime})
+        match = self._prelude()
+        if not match:
+            return
+        if "snapshot" not in match.groupdict() or match["snapshot"] != "self" or match["content"]:
+            return self._send_json(404, {"message": f"No route for POST {self.path}"})
+        snapshot = self.server.create(match["org"], json.loads(body or b"{}"))
+        self._send_json(200, {"id": snapshot["id"]})
+
+    def do_GET(self):
+        match = self._prelude()
+        if not match:
+            return
+        if "type" in match.groupdict():
+            return self._send_json(200, self.server.resources(match["org"], match["type"]))
+        if "snapshot" not in match.groupdict():
+            return self._send_list(match["org"])
+        snapshot = self._snapshot(match)
+        if snapshot is None:
+            return
+        if not match["content"]:
+            return self._send_json(200, self._model(snapshot))
+        if time.monotonic() < snapshot["ready_at"]:
+            return self._send_json(412, {"message": "Snapshot is not ready"})
+        self._send_content(snapshot)
+
+    def _send_content(self, snapshot):
+        content = snapshot["content"]
+        etag = f'"{snapshot["id"]}"'
+        start = 0
+        encoding = None
+        range_match = re.match(r"bytes=(\d+)-$", self.headers.get("Range", ""))
+        if not range_match and "content_gzip" in snapshot and "gzip" in self.headers.get("Accept-Encoding", ""):
+            # As nginx does, the encoded representation only gets a weak ETag
+            content, encoding, etag = snapshot["content_gzip"], "gzip", f"W/{etag}"
+            self.send_response(200)
+        elif range_match and self.headers.get("If-Range", etag) == etag:
+            start = int(range_match.group(1))
+            if start >= len(content):
+                return self._send_json(416, headers={"Content-Range": f"bytes */{len(content)}"})
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(content) - 1}/{len(content)}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Vary", "Accept-Encoding")
+        self.send_header("Content-Length", str(len(content) - start))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", etag)
+        self.end_headers()
+        for offset in range(start, len(content), CHUNK_SIZE):
+            chunk = content[offset:offset + CHUNK_SIZE]
+            self.wfile.write(chunk)
+            if self.server.bandwidth:
+                time.sleep(len(chunk) / self.server.bandwidth)
+        with self.server.lock:
+            self.server.stats["content_bytes"] += len(content) - start
+
+    def do_DELETE(self):
+        match = self._prelude()
+        if not match:
+            return
+        if "snapshot" not in match.groupdict():
+            return self._send_json(405, {"message": "Method not allowed"})
+        if self._snapshot(match) is None:
+            return
+        with self.server.lock:
+            self.server.snapshots.pop((match["org"], match["snapshot"]), None)
+            self.server.stats["deleted"] += 1
+        self._send_json(204)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stand-in for the Coveo snapshot API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--snapshot-dir", default=SNAPSHOT_DIR, help="Directory of snapshot ZIPs to serve")
+    parser.add_argument("--rotate", action="store_true",
+                        help="Cycle through every snapshot ZIP instead of always serving the latest one")
+    parser.add_argument("--synthetic", type=int, metavar="RESOURCES",
+                        help="Serve generated snapshots with this many resources instead of snapshot ZIPs")
+    parser.add_argument("--change-rate", type=float, default=0.0,
+                        help="Fraction of generated resources that change between snapshots")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every request")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="Content bytes per second (0: unlimited)")
+    parser.add_argument("--build-time", type=float, default=0.0, help="Seconds before a snapshot is COMPLETED")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Probability of a 429 response")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Probability of a 503 response")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    parser.add_argument("--orphans", action="append", default=[], metavar="ORG:COUNT",
+                        help="Pre-create COUNT day-old snapshots in ORG, as left by crashed backups (repeatable)")
+    parser.add_argument("--stored", action="store_true", help="Store snapshot JSON uncompressed in the ZIP")
+    parser.add_argument("--gzip", action="store_true", help="Gzip content for clients sending Accept-Encoding: gzip")
+    parser.add_argument("--organizations", help="Comma-separated organizations hosted by this server (default: all)")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Probability of answering a request late")
+    parser.add_argument("--stall-time", type=float, default=20.0, help="Seconds a stalled request is answered late")
+    parser.add_argument("--token-lifetime", type=float, default=0.0, metavar="SECONDS",
+                        help="Issue OAuth tokens at POST /oauth/token and require them on every request")
+    parser.add_argument("--listing", choices=LISTINGS, default="list",
+                        help="Answer snapshot listings as a plain list of the page, with totalPages, or unpaged")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    documents = document_factory = None
+    if args.synthetic:
+        document_factory = lambda sequence: generate_snapshot_document(
+            args.synthetic, seed=args.seed, change_rate=args.change_rate, generation=sequence)
+    else:
+        documents = load_snapshot_documents(args.snapshot_dir)
+        if not args.rotate:
+            documents = documents[-1:]
+
+    server = FakeCoveoServer(
+        (args.host, args.port), documents=documents, document_factory=document_factory,
+        latency=args.latency, bandwidth=args.bandwidth, build_time=args.build_time,
+        error_rate_429=args.rate_429, error_rate_5xx=args.rate_5xx, retry_after=args.retry_after,
+        seed=args.seed, verbose=args.verbose, stored=args.stored, gzip=args.gzip,
+        organizations=args.organizations.split(",") if args.organizations else None,
+        token_lifetime=args.token_lifetime, stall_rate=args.stall_rate, stall_time=args.stall_time,
+        listing=args.listing)
+    for orphans in args.orphans:
+        organization_id, count = orphans.rsplit(":", 1)
+        server.seed_orphans(organization_id, int(count))
+    print(f"Fake Coveo API listening on {server.url}", flush=True)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,4 @@
-def commit_snapshot(snapshot_path, repo_path):
+def commit_snapshot(snapshot_path, repo_path, extra_paths=()):
     import os
     import git
     from datetime import datetime
@@ -7,8 +7,8 @@ def commit_snapshot(snapshot_path, repo_path):
         # Initialize the Git repository
         repo = git.Repo(repo_path)
 
-        # Add the new snapshot to the staging area
-        repo.index.add([snapshot_path])
+        # Add the new snapshot (and files that go with it, such as its manifest) to the staging area
+        repo.index.add([snapshot_path, *extra_paths])
 
         # Create a commit message with a timestamp
         commit_message = f"Backup snapshot: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {os.path.basename(snapshot_path)}"
@@ -22,6 +22,27 @@ def commit_snapshot(snapshot_path, repo_path):
         print(f"Error committing snapshot: {e}")
 
 
+def commit_manifest(manifest_path, repo_path):
+    import os
+    import git
+    from datetime import datetime
+
+    try:
+        repo = git.Repo(repo_path)
+
+        # Add the sidecar manifest rebuilt for a snapshot that is already committed
+        repo.index.add([manifest_path])
+
+        commit_message = f"Index snapshot: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} - {os.path.basename(manifest_path)}"
+
+        repo.index.commit(commit_message)
+
+        print(f"Committed snapshot manifest: {commit_message}")
+
+    except Exception as e:
+        print(f"Error committing snapshot manifest: {e}")
+
+
 def check_if_identical(snapshot1_path, snapshot2_path):
     import filecmp
 
@@ -0,0 +1,122 @@
+import collections
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http_metrics import _percentile
+from logger import log_info
+
+# Set to 1 to send a duplicate of slow status, list, probe and delete calls
+HEDGING_ENABLED = os.getenv("COVEO_HEDGING", "0") == "1"
+# Hedges allowed per hedgeable call, e.g. 0.05 adds at most 5% more requests
+HEDGE_BUDGET = float(os.getenv("COVEO_HEDGE_BUDGET", "0.05"))
+# Hedges that can be sent in a burst when the budget has been saved up
+HEDGE_BURST = float(os.getenv("COVEO_HEDGE_BURST", "5"))
+# Latency percentile after which a call is hedged, learned per operation
+HEDGE_PERCENTILE = float(os.getenv("COVEO_HEDGE_PERCENTILE", "0.95"))
+# Calls of an operation observed before its calls are hedged
+HEDGE_MIN_SAMPLES = int(os.getenv("COVEO_HEDGE_MIN_SAMPLES", "20"))
+# Lower bound of the hedge delay in seconds, so fast operations are never hedged on noise
+HEDGE_MIN_DELAY = float(os.getenv("COVEO_HEDGE_MIN_DELAY", "0.05"))
+
+# Most recent latencies kept per operation
+LATENCY_WINDOW = 500
+
+
+class Hedger:
+    """
+    Sends a duplicate of a call that is slower than usual and keeps the first answer.
+
+    The hedge delay of an operation is the HEDGE_PERCENTILE of its recent latencies, so
+    only the slowest few percent of calls are duplicated. Duplicates are paid for from a
+    budget shared by every client in the process: each call earns HEDGE_BUDGET of a hedge
+    (up to HEDGE_BURST saved), so hedging adds at most that share of load even when the
+    platform is slow across the board. The losing call cannot be interrupted mid-request;
+    it finishes in the background and its answer is discarded.
+    """
+
+    def __init__(self, budget=HEDGE_BUDGET, burst=HEDGE_BURST, percentile=HEDGE_PERCENTILE,
+                 min_samples=HEDGE_MIN_SAMPLES, min_delay=HEDGE_MIN_DELAY, workers=64):
+        self.budget = budget
+        self.burst = burst
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=LATENCY_WINDOW))
+        self.tokens = burst
+        self.stats = {"calls": 0, "hedged": 0, "won": 0}
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hedge")
+
+    def delay(self, operation):
+        """Return the hedge delay learned for operation, or None while too few calls were seen."""
+        with self.lock:
+            latencies = list(self.latencies[operation])
+        if len(latencies) < self.min_samples:
+            return None
+        return max(self.min_delay, _percentile(sorted(latencies), self.percentile))
+
+    def record(self, operation, seconds):
+        with self.lock:
+            self.latencies[operation].append(seconds)
+
+    def _take_token(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            self.stats["hedged"] += 1
+            return True
+
+    def call(self, operation, function):
+        """
+        Return function(), running a duplicate if the first run has not returned within the hedge delay.
+
+        When the first run to finish raised, the other one is still waited for; the
+        exception is only raised if both fail.
+        """
+        with self.lock:
+            self.stats["calls"] += 1
+            self.tokens = min(self.burst, self.tokens + self.budget)
+        delay = self.delay(operation)
+        if delay is None:
+            return self._timed(operation, function)
+
+        primary = self.pool.submit(self._timed, operation, function)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._take_token():
+            return primary.result()
+        hedge = self.pool.submit(self._timed, operation, function)
+        pending = {primary, hedge}
+        while True:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        with self.lock:
+                            self.stats["won"] += 1
+                    for other in pending:
+                        other.add_done_callback(_discard)
+                    return future.result()
+            if not pending:
+                return primary.result()
+
+    def _timed(self, operation, function):
+        start = time.monotonic()
+        result = function()
+        self.record(operation, time.monotonic() - start)
+        return result
+
+    def log_summary(self):
+        if self.stats["hedged"]:
+            log_info(f"Hedged {self.stats['hedged']} of {self.stats['calls']} call(s); "
+                     f"the duplicate answered first {self.stats['won']} time(s)")
+
+
+def _discard(future):
+    """Release the connection held by the response of a call that lost the race."""
+    if future.exception() is None and hasattr(future.result(), "close"):
+        future.result().close()
+
+
+HEDGER = Hedger()
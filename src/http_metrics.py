@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from dns_cache import CachedDnsConnectionMixin
+from logger import log_info, log_error
+
+# Optional JSON Lines file receiving one record per HTTP request
+METRICS_FILE = os.getenv("COVEO_METRICS_FILE")
+
+# Time spent opening connections (DNS, TCP and TLS) by the current thread since the last reset
+_connect_time = threading.local()
+
+
+def reset_connect_time():
+    _connect_time.value = 0.0
+
+
+def take_connect_time():
+    """Return the connect time accumulated by this thread since reset_connect_time()."""
+    return getattr(_connect_time, "value", 0.0)
+
+
+class TimedHTTPConnection(CachedDnsConnectionMixin, HTTPConnection):
+    """urllib3 connection recording how long it takes to open."""
+
+    def connect(self):
+        start = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _connect_time.value = take_connect_time() + time.monotonic() - start
+
+
+class TimedHTTPSConnection(CachedDnsConnectionMixin, HTTPSConnection):
+    """urllib3 TLS connection recording how long it takes to open, handshake included."""
+
+    def connect(self):
+        start = time.monotonic()
+        try:
+            super().connect()
+        finally:
+            _connect_time.value = take_connect_time() + time.monotonic() - start
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose pooled connections resolve hosts through DNS_CACHE and record their connect time."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+
+class RequestTiming:
+    """
+    Timing of one HTTP request attempt.
+
+    All durations are in seconds. connect covers DNS, TCP and TLS and is 0 when a pooled
+    connection was reused; ttfb runs from the start of the request to the response
+    headers, as in curl; transfer is the time spent reading the body after that. bytes
+    counts the decoded body and wireBytes what was received before content decoding.
+    """
+
+    def __init__(self, metrics, operation, organization_id, method, url, attempt):
+        self.metrics = metrics
+        self.record = {
+            "operation": operation,
+            "organizationId": organization_id,
+            "method": method,
+            "url": url,
+            "attempt": attempt,
+            "status": None,
+            "connect": 0.0,
+            "ttfb": None,
+            "transfer": 0.0,
+            "bytes": 0,
+            "wireBytes": 0,
+            "error": None,
+        }
+        self.start = time.monotonic()
+        self.headers_at = None
+
+    def connected(self, seconds):
+        """Add the time spent opening a connection for this request."""
+        self.record["connect"] += seconds
+
+    def headers_received(self, status, connect=None, ttfb=None):
+        """Record the response status; ttfb defaults to the time elapsed since the request started."""
+        self.headers_at = time.monotonic() if ttfb is None else self.start + ttfb
+        self.record["status"] = status
+        if connect is not None:
+            self.record["connect"] = connect
+        self.record["ttfb"] = self.headers_at - self.start
+
+    def finish(self, received=0, error=None, wire=None):
+        """Record the attempt once its body is read (or it failed); later calls are ignored."""
+        if self.metrics is None:
+            return
+        end = time.monotonic()
+        if self.headers_at is not None:
+            self.record["transfer"] = end - self.headers_at
+        self.record["bytes"] = received
+        self.record["wireBytes"] = received if wire is None else wire
+        if error is not None:
+            self.record["error"] = str(error) or type(error).__name__
+        self.record["total"] = end - self.start
+        self.metrics.add(self.record)
+        self.metrics = None
+
+
+def _percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class HttpMetrics:
+    """
+    Collects the RequestTiming records of every request made in the process.
+
+    Records are kept in memory for the run summary and, when a metrics file is configured,
+    appended to it as JSON Lines as they complete.
+    """
+
+    def __init__(self, metrics_file=METRICS_FILE):
+        self.metrics_file = metrics_file
+        self.lock = threading.Lock()
+        self.records = []
+
+    def start(self, operation, organization_id, method, url, attempt=0):
+        return RequestTiming(self, operation, organization_id, method, url, attempt)
+
+    def add(self, record):
+        record = dict(record, timestamp=time.time())
+        with self.lock:
+            self.records.append(record)
+            if self.metrics_file:
+                try:
+                    with open(self.metrics_file, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+                except OSError as e:
+                    log_error(f"Failed to write HTTP metrics to {self.metrics_file}: {e}")
+                    self.metrics_file = None
+
+    def summary(self):
+        """
+        Aggregate the records by operation and organization.
+
+        Returns:
+            dict: (operation, organization_id) to request, error and byte counts and the
+            median, 95th percentile and maximum of connect, ttfb and transfer times.
+        """
+        with self.lock:
+            records = list(self.records)
+        groups = {}
+        for record in records:
+            groups.setdefault((record["operation"], record["organizationId"]), []).append(record)
+        summary = {}
+        for key, group in groups.items():
+            stats = {
+                "requests": len(group),
+                "errors": sum(1 for r in group if r["error"] or (r["status"] or 0) >= 400),
+                "bytes": sum(r["bytes"] for r in group),
+                "wireBytes": sum(r["wireBytes"] for r in group),
+            }
+            for field in ("connect", "ttfb", "transfer"):
+                values = [r[field] for r in group if r[field] is not None]
+                if values:
+                    stats[field] = {
+                        "p50": _percentile(values, 0.5),
+                        "p95": _percentile(values, 0.95),
+                        "max": max(values),
+                    }
+            summary[key] = stats
+        return summary
+
+    def log_summary(self):
+        """Log one line per operation and organization with its request timings."""
+        for (operation, organization_id), stats in sorted(self.summary().items(), key=lambda item: str(item[0])):
+            timings = ", ".join(
+                f"{field} p50 {stats[field]['p50'] * 1000:.0f}ms p95 {stats[field]['p95'] * 1000:.0f}ms"
+                for field in ("connect", "ttfb", "transfer") if field in stats
+            )
+            log_info(f"HTTP {operation} [{organization_id}]: {stats['requests']} request(s), "
+                     f"{stats['errors']} error(s), {stats['bytes']} bytes ({stats['wireBytes']} on the wire); {timings}")
+
+
+METRICS = HttpMetrics()
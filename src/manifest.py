@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import json
+import os
+from canonical import merkle_root, zip_json_digests
+from state import state_path
+from logger import log_info, log_error
+
+# Bumped whenever the digests or the layout of manifests change; older manifests are rebuilt
+MANIFEST_VERSION = 3
+MANIFEST_SUFFIX = ".manifest.json"
+# State subdirectory keeping, per snapshot directory, the leaf digests of its latest manifest
+LEAVES_DIR = "manifest_leaves"
+
+
+def manifest_path(zip_path):
+    """Return the path of the sidecar manifest of a snapshot ZIP, e.g. snapshot_X.manifest.json."""
+    root, _ = os.path.splitext(zip_path)
+    return root + MANIFEST_SUFFIX
+
+
+def build_manifest(zip_path, zip_sha256):
+    """
+    Parse a snapshot ZIP once and return its manifest.
+
+    The manifest holds the archive's SHA-256, the canonical digest of its JSON and the
+    Merkle index of its resources: the root digest and, per resource type, its digest,
+    resource count and the leaf digest of each resource by resourceName (see canonical.py).
+    The leaves are not written to the sidecar; see write_manifest.
+    """
+    digest, types = zip_json_digests(zip_path)
+    return {
+        "version": MANIFEST_VERSION,
+        "archiveSha256": zip_sha256,
+        "contentDigest": digest.hex(),
+        "rootDigest": merkle_root(types),
+        "resourceTypes": types,
+    }
+
+
+def read_manifest(zip_path, zip_sha256):
+    """Return the sidecar manifest of zip_path, or None if it is missing, stale or not for this archive."""
+    try:
+        with open(manifest_path(zip_path)) as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log_error(f"Ignoring unreadable manifest of {zip_path}: {e}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("archiveSha256") != zip_sha256:
+        return None
+    return manifest
+
+
+def write_manifest(zip_path, manifest):
+    """
+    Atomically write the sidecar manifest of zip_path and return its path.
+
+    The sidecar is compact JSON without the leaf digests, which are most of a manifest's
+    size: they are kept gzip-compressed in the state directory instead (see
+    manifest_leaves), replacing those of the previous snapshot of the same directory.
+    """
+    types = manifest["resourceTypes"]
+    sidecar = {**manifest, "resourceTypes": {
+        resource_type: {key: value for key, value in entry.items() if key != "leaves"}
+        for resource_type, entry in types.items()
+    }}
+    path = manifest_path(zip_path)
+    # Created with open() rather than mkstemp() so that, like the ZIP, it gets the umask's permissions
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "w") as f:
+            json.dump(sidecar, f, sort_keys=True, separators=(",", ":"))
+            f.write("\n")
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
+    if types and all("leaves" in entry for entry in types.values()):
+        _save_leaves(zip_path, manifest)
+    return path
+
+
+def _leaves_path(zip_path):
+    directory = state_path(LEAVES_DIR)
+    os.makedirs(directory, exist_ok=True)
+    key = hashlib.sha256(os.path.dirname(os.path.abspath(zip_path)).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(directory, f"{key}.json.gz")
+
+
+def _save_leaves(zip_path, manifest):
+    path = _leaves_path(zip_path)
+    leaves = {resource_type: entry["leaves"] for resource_type, entry in manifest["resourceTypes"].items()}
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with gzip.open(temp_path, "wt", encoding="utf-8") as f:
+            json.dump({"archiveSha256": manifest["archiveSha256"], "leaves": leaves}, f, separators=(",", ":"))
+        os.replace(temp_path, path)
+    except Exception as e:
+        # Only a cache: the leaves can always be rebuilt from the ZIP
+        log_error(f"Could not save the resource index of {os.path.basename(zip_path)}: {e}")
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def _load_leaves(zip_path, zip_sha256):
+    try:
+        with gzip.open(_leaves_path(zip_path), "rt", encoding="utf-8") as f:
+            saved = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return saved["leaves"] if saved.get("archiveSha256") == zip_sha256 else None
+
+
+def manifest_leaves(zip_path, manifest):
+    """
+    Return manifest with the leaf digests of every resource type, as diff_manifests needs.
+
+    Sidecars are committed without them. They are read from the copy kept in the state
+    directory when this machine wrote the sidecar, and otherwise rebuilt by parsing the ZIP.
+    """
+    types = manifest["resourceTypes"]
+    if all("leaves" in entry for entry in types.values()):
+        return manifest
+    leaves = _load_leaves(zip_path, manifest["archiveSha256"])
+    if leaves is None:
+        log_info(f"Rebuilding the resource index of {os.path.basename(zip_path)}")
+        return build_manifest(zip_path, manifest["archiveSha256"])
+    return {**manifest, "resourceTypes": {
+        resource_type: {**entry, "leaves": leaves.get(resource_type, {})} for resource_type, entry in types.items()
+    }}
+
+
+def load_manifest(zip_path, zip_sha256, write=True):
+    """
+    Return the manifest of a snapshot ZIP, from its sidecar when it is current.
+
+    The ZIP is only parsed when the sidecar is missing, written by an older version or
+    describes different archive bytes; the rebuilt manifest is then saved as the sidecar
+    unless write is False.
+    """
+    manifest = read_manifest(zip_path, zip_sha256)
+    if manifest is None:
+        log_info(f"Building manifest of {os.path.basename(zip_path)}")
+        manifest = build_manifest(zip_path, zip_sha256)
+        if write:
+            write_manifest(zip_path, manifest)
+    return manifest
@@ -0,0 +1,100 @@
+import os
+import queue
+import threading
+import time
+from logger import log_info, log_error
+
+# Workers per stage of the multi-organization backup pipeline
+PIPELINE_CREATE_WORKERS = int(os.getenv("COVEO_PIPELINE_CREATE_WORKERS", "4"))
+# Snapshots waited on concurrently, i.e. building on the server at the same time
+PIPELINE_BUILD_WORKERS = int(os.getenv("COVEO_PIPELINE_BUILD_WORKERS", "16"))
+PIPELINE_DOWNLOAD_WORKERS = int(os.getenv("COVEO_PIPELINE_DOWNLOAD_WORKERS", "4"))
+# Items a stage can hold waiting for a free worker before the stage before it blocks
+PIPELINE_QUEUE_SIZE = int(os.getenv("COVEO_PIPELINE_QUEUE_SIZE", "4"))
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One pipeline stage: a function applied to each item by its own pool of workers.
+
+    The function returns the item to hand to the next stage, or None when the item
+    needs no further processing.
+    """
+
+    def __init__(self, name, function, workers=1, queue_size=PIPELINE_QUEUE_SIZE):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.lock = threading.Lock()
+        self.processed = 0
+        self.busy = 0.0
+
+
+class Pipeline:
+    """
+    Runs items through a sequence of stages that work concurrently.
+
+    Each stage reads from its own bounded queue, so a slow stage makes the stages before
+    it block on put() instead of piling up work (backpressure), while items already past
+    it keep moving. When a stage fails on an item, on_error(item, error) is called and
+    the item leaves the pipeline; the other items are not affected.
+    """
+
+    def __init__(self, stages, on_error=None):
+        self.stages = stages
+        self.on_error = on_error
+
+    def _work(self, index):
+        stage = self.stages[index]
+        next_stage = self.stages[index + 1] if index + 1 < len(self.stages) else None
+        while True:
+            item = stage.queue.get()
+            if item is _DONE:
+                return
+            start = time.monotonic()
+            try:
+                result = stage.function(item)
+            except Exception as e:
+                result = None
+                if self.on_error:
+                    try:
+                        self.on_error(item, e)
+                    except Exception as handler_error:
+                        # A dead worker would leave its queue unread and block the stages feeding it
+                        log_error(f"Pipeline error handler failed after stage {stage.name} failed "
+                                  f"({e}): {handler_error}")
+                else:
+                    log_error(f"Pipeline stage {stage.name} failed: {e}")
+            with stage.lock:
+                stage.processed += 1
+                stage.busy += time.monotonic() - start
+            if result is not None and next_stage is not None:
+                next_stage.queue.put(result)
+
+    def run(self, items):
+        """Feed items through every stage and return once all of them are done."""
+        start = time.monotonic()
+        threads = []
+        for index, stage in enumerate(self.stages):
+            threads.append([
+                threading.Thread(target=self._work, args=(index,), name=f"pipeline-{stage.name}-{n}", daemon=True)
+                for n in range(stage.workers)
+            ])
+            for thread in threads[-1]:
+                thread.start()
+
+        for item in items:
+            self.stages[0].queue.put(item)
+        # A stage is drained once its workers stop; only then can the next one be told to stop
+        for stage, stage_threads in zip(self.stages, threads):
+            for _ in stage_threads:
+                stage.queue.put(_DONE)
+            for thread in stage_threads:
+                thread.join()
+
+        elapsed = time.monotonic() - start
+        log_info(f"Pipeline finished in {elapsed:.1f}s: " + ", ".join(
+            f"{stage.name} {stage.processed} item(s) / {stage.busy:.1f}s busy" for stage in self.stages))
@@ -0,0 +1,120 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from state import load_state, save_state
+from logger import log_info, log_error
+
+# Platform host of each Coveo region
+REGION_URLS = {
+    "us": "https://platform.cloud.coveo.com",
+    "ca": "https://platform-ca.cloud.coveo.com",
+    "eu": "https://platform-eu.cloud.coveo.com",
+    "au": "https://platform-au.cloud.coveo.com",
+}
+# Host used when an organization's region cannot be worked out
+DEFAULT_REGION = "eu"
+# Pin every organization to one region instead of resolving it (us, ca, eu or au)
+REGION = os.getenv("COVEO_REGION", "").lower()
+# How long a resolved region is trusted before it is checked again, in seconds
+REGION_CACHE_TTL = float(os.getenv("COVEO_REGION_CACHE_TTL", str(7 * 24 * 3600)))
+# Seconds the default region is used for an organization no regional host recognized, before probing again
+REGION_RETRY_INTERVAL = 300.0
+
+STATE_FILE = "regions.json"
+
+
+def probe_answer(url, status, location=None):
+    """
+    Return the platform URL serving an organization according to a probe of regional host url.
+
+    A success means url serves it; a redirect to another regional host means that host
+    does. Anything else (typically a 403 or 404) says nothing, so None is returned.
+    """
+    if 200 <= status < 300:
+        return url
+    if 300 <= status < 400 and location:
+        location = urlsplit(location)
+        redirected = f"{location.scheme}://{location.netloc}"
+        return redirected if redirected in REGION_URLS.values() else None
+    return None
+
+
+class RegionResolver:
+    """
+    Works out which regional platform host serves each organization.
+
+    An organization only exists in one region, so the resolver asks every regional host
+    about the organization at once and keeps the host whose answer probe_answer accepts.
+    The probes are sent by the owning client (see platform_url), so they share its
+    connection pool, rate limits, circuit breakers and request timings. Answers are
+    cached in memory and in the state directory for REGION_CACHE_TTL, so each
+    organization is probed once per TTL across runs. When no host answers, the default
+    region is used without probing again for REGION_RETRY_INTERVAL.
+    """
+
+    def __init__(self, region=REGION, ttl=REGION_CACHE_TTL, retry_interval=REGION_RETRY_INTERVAL):
+        if region and region not in REGION_URLS:
+            raise ValueError(f"Unknown COVEO_REGION {region!r}; expected one of {', '.join(REGION_URLS)}")
+        self.region = region
+        self.ttl = ttl
+        self.retry_interval = retry_interval
+        self.lock = threading.Lock()
+        self.resolved = {}
+        self.failed = {}
+
+    def platform_url(self, organization_id, probe):
+        """
+        Return the platform URL serving organization_id, probing the regions if needed.
+
+        Args:
+            organization_id (str): Coveo organization ID.
+            probe (callable): probe(url) asks regional host url about the organization
+                and returns probe_answer for its response, or None if it failed.
+        """
+        if self.region:
+            return REGION_URLS[self.region]
+        with self.lock:
+            if organization_id in self.resolved:
+                return self.resolved[organization_id]
+            if time.monotonic() < self.failed.get(organization_id, 0.0):
+                return REGION_URLS[DEFAULT_REGION]
+            cached = load_state(STATE_FILE).get(organization_id)
+        if cached and time.time() - cached["resolved"] < self.ttl and cached["url"] in REGION_URLS.values():
+            url = cached["url"]
+        else:
+            url = self._probe(organization_id, probe)
+            if url is None:
+                with self.lock:
+                    self.failed[organization_id] = time.monotonic() + self.retry_interval
+                return REGION_URLS[DEFAULT_REGION]
+            log_info(f"Organization {organization_id} is served by {url}")
+            with self.lock:
+                state = load_state(STATE_FILE)
+                state[organization_id] = {"url": url, "resolved": time.time()}
+                save_state(STATE_FILE, state)
+        with self.lock:
+            self.resolved[organization_id] = url
+        return url
+
+    def forget(self, organization_id):
+        """Drop the cached region of an organization, e.g. after its host refused a call with a 403."""
+        if self.region:
+            return
+        with self.lock:
+            if self.resolved.pop(organization_id, None) is None:
+                return
+            state = load_state(STATE_FILE)
+            if state.pop(organization_id, None) is not None:
+                save_state(STATE_FILE, state)
+        log_info(f"Region of organization {organization_id} will be resolved again")
+
+    def _probe(self, organization_id, probe):
+        with ThreadPoolExecutor(max_workers=len(REGION_URLS)) as pool:
+            answers = list(pool.map(probe, REGION_URLS.values()))
+        found = next((url for url in answers if url), None)
+        if found is None:
+            log_error(f"Could not find the region of organization {organization_id}; "
+                      f"using {REGION_URLS[DEFAULT_REGION]} for the next {self.retry_interval:.0f}s")
+        return found
@@ -0,0 +1,159 @@
+import json
+import os
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from coveo_api import RESOURCE_TYPES
+from canonical import resource_keys
+from compare import file_sha256
+from logger import log_info, log_error
+
+# Resource type groups exported as separate snapshots, e.g. "SOURCE;FIELD,EXTENSION".
+# Types not listed are exported together in one extra shard. Empty disables sharding.
+SNAPSHOT_SHARDS = os.getenv("COVEO_SNAPSHOT_SHARDS", "")
+
+
+def parse_shards(spec, resource_types=RESOURCE_TYPES):
+    """
+    Parse a shard specification into lists of resource types.
+
+    Shards are separated by ';' and types within a shard by ','. Every resource type
+    not named in spec is added to a final shard, so the shards always cover the same
+    resources as an unsharded snapshot.
+
+    Returns:
+        list: One list of resource types per shard.
+    """
+    shards = []
+    seen = set()
+    for group in spec.split(";"):
+        types = [t.strip().upper() for t in group.split(",") if t.strip()]
+        for resource_type in types:
+            if resource_type not in resource_types:
+                raise ValueError(f"Unknown resource type in COVEO_SNAPSHOT_SHARDS: {resource_type}")
+            if resource_type in seen:
+                raise ValueError(f"Resource type {resource_type} appears in more than one shard")
+            seen.add(resource_type)
+        if types:
+            shards.append(types)
+    remaining = [t for t in resource_types if t not in seen]
+    if remaining:
+        shards.append(remaining)
+    return shards
+
+
+def merge_snapshot_documents(documents):
+    """
+    Merge the JSON documents of several shard snapshots into one logical snapshot.
+
+    Every top-level key other than "resources" (such as "metadata") must be equal in all
+    shards, and resources exported by more than one shard (shared children) identical.
+    Each type keeps the platform's order: that of the shard holding the most resources of
+    the type, i.e. the one that requested it, followed by any resources only other shards
+    hold. Only the order of object keys differs from an unsharded export, which the
+    canonical digest ignores (see canonical.py); arrays are hashed in order.
+    """
+    schema_versions = {document.get("metadata", {}).get("schemaVersion") for document in documents}
+    if len(schema_versions) != 1:
+        raise ValueError(f"Shards have different schema versions: {sorted(map(str, schema_versions))}")
+
+    merged = {}
+    for key in dict.fromkeys(key for document in documents for key in document):
+        if key == "resources":
+            merged[key] = _merge_resources([document.get("resources", {}) for document in documents])
+            continue
+        values = [document.get(key) for document in documents]
+        if any(value != values[0] for value in values):
+            raise ValueError(f"Shards disagree on top-level {key!r}")
+        merged[key] = values[0]
+    return merged
+
+
+def _merge_resources(shard_resources):
+    merged = {}
+    for resource_type in dict.fromkeys(t for resources in shard_resources for t in resources):
+        # Stable sort: between shards holding as many resources, the first one's order wins
+        lists = sorted((resources[resource_type] for resources in shard_resources if resource_type in resources),
+                       key=len, reverse=True)
+        by_key = {}
+        for items in lists:
+            names = [item.get("resourceName") if isinstance(item, dict) else None for item in items]
+            for key, item in zip(resource_keys(names), items):
+                if key not in by_key:
+                    by_key[key] = item
+                elif by_key[key] != item:
+                    raise ValueError(f"Shards disagree on {resource_type} resource {key}")
+        merged[resource_type] = list(by_key.values())
+    return merged
+
+
+def _export_shard(client, organization_id, snapshot_name, resource_types, snapshot_ids, on_created):
+    """Create, wait for and download one shard snapshot; return the path of its ZIP."""
+    snapshot_id = client.create_snapshot(organization_id, snapshot_name, resource_types)
+    snapshot_ids.append(snapshot_id)
+    if on_created:
+        on_created(snapshot_id)
+    log_info(f"Created shard snapshot {snapshot_id} for {', '.join(resource_types)}")
+    client.wait_for_snapshot(organization_id, snapshot_id)
+    fd, path = tempfile.mkstemp(suffix=".zip")
+    os.close(fd)
+    try:
+        client.export_snapshot_content(organization_id, snapshot_id, path)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def _read_document(zip_path):
+    with zipfile.ZipFile(zip_path) as z:
+        members = [info for info in z.infolist() if not info.is_dir() and info.filename.lower().endswith('.json')]
+        if len(members) != 1:
+            raise ValueError(f"Expected exactly one JSON file in {zip_path}, found {len(members)}")
+        with z.open(members[0]) as f:
+            return json.load(f)
+
+
+def export_sharded_snapshot(client, organization_id, snapshot_name, shards, output_path, on_created=None):
+    """
+    Export one snapshot per shard in parallel and merge them into a single snapshot ZIP.
+
+    All shards are created, built and downloaded concurrently, so the export takes as
+    long as the slowest shard. If any shard fails, the shard snapshots already created
+    are deleted before the error is raised.
+
+    on_created(snapshot_id) is called as soon as each shard snapshot exists, so the
+    caller can register it for deletion (see delete_queue.DELETE_LEASE) before anything
+    else can fail, including a crash of the whole process.
+
+    Returns:
+        tuple: output_path, the hex SHA-256 of the merged ZIP and the list of shard snapshot IDs.
+    """
+    snapshot_ids = []
+    paths = []
+    try:
+        # Every shard runs to completion, even when one fails, so that all of them can be cleaned up
+        with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+            futures = [
+                pool.submit(_export_shard, client, organization_id, snapshot_name, shard, snapshot_ids, on_created)
+                for shard in shards
+            ]
+        paths = [future.result() for future in futures if future.exception() is None]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        if errors:
+            raise errors[0]
+
+        merged = merge_snapshot_documents([_read_document(path) for path in paths])
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as z:
+            z.writestr(f"{snapshot_ids[0]}.json", json.dumps(merged, indent=2, ensure_ascii=False))
+        return output_path, file_sha256(output_path), snapshot_ids
+    except Exception:
+        for snapshot_id in snapshot_ids:
+            try:
+                client.delete_snapshot(organization_id, snapshot_id)
+            except Exception as e:
+                log_error(f"Failed to delete shard snapshot {snapshot_id}: {e}")
+        raise
+    finally:
+        for path in paths:
+            os.remove(path)
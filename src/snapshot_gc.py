@@ -0,0 +1,118 @@
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import get_organization_ids
+from coveo_api import CoveoClient, SNAPSHOT_NOTES_PREFIX
+from delete_queue import DeleteQueue, DELETE_LEASE
+from http_metrics import METRICS
+from hedging import HEDGER
+from logger import log_info, log_error
+
+# Snapshots created by backup.py are named snapshot_<timestamp>
+TOOL_NOTES_PREFIX = f"{SNAPSHOT_NOTES_PREFIX}snapshot_"
+GC_CONCURRENCY = 16
+
+
+def find_orphaned_snapshots(client, organization_id, older_than, queued=()):
+    """
+    Return the snapshots of an organization created by this tool more than older_than seconds ago.
+
+    Snapshots without a createdDate are never considered orphaned, nor are the queued IDs:
+    backup.py's delete queue already holds them, leased by a run in progress or committed
+    and waiting for their delete.
+    """
+    cutoff_ms = (time.time() - older_than) * 1000
+    return [
+        snapshot for snapshot in client.list_snapshots(organization_id)
+        if (snapshot.get("developerNotes") or "").startswith(TOOL_NOTES_PREFIX)
+        and snapshot.get("createdDate") is not None and snapshot["createdDate"] < cutoff_ms
+        and snapshot["id"] not in queued
+    ]
+
+
+def collect_orphaned_snapshots(organization_ids, older_than=DELETE_LEASE, concurrency=GC_CONCURRENCY,
+                               dry_run=False, client=None, queue=None):
+    """
+    Delete orphaned snapshots of every organization with bounded concurrency.
+
+    Organizations are listed in parallel, then all deletes run in one pool of at most
+    concurrency workers, across organizations. Snapshots in the delete queue (by default
+    the one in the state directory) are left to backup.py.
+
+    Returns:
+        dict: Organization ID to {"found", "deleted", "failed"} counts.
+    """
+    own_client = client is None
+    client = client or CoveoClient(pool_size=concurrency)
+    own_queue = queue is None
+    queue = queue or DeleteQueue()
+    summary = {organization_id: {"found": 0, "deleted": 0, "failed": 0} for organization_id in organization_ids}
+
+    def list_orphans(organization_id):
+        try:
+            return find_orphaned_snapshots(client, organization_id, older_than, queue.pending(organization_id))
+        except Exception as e:
+            log_error(f"Failed to list snapshots of {organization_id}: {e}")
+            summary[organization_id]["failed"] += 1
+            return []
+
+    def delete(organization_id, snapshot):
+        try:
+            client.delete_snapshot(organization_id, snapshot["id"])
+            return organization_id, True
+        except Exception:
+            return organization_id, False
+
+    try:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            orphans = [
+                (organization_id, snapshot)
+                for organization_id, snapshots in zip(organization_ids, pool.map(list_orphans, organization_ids))
+                for snapshot in snapshots
+            ]
+            for organization_id, _ in orphans:
+                summary[organization_id]["found"] += 1
+            if dry_run:
+                for organization_id, snapshot in orphans:
+                    log_info(f"Would delete {organization_id} snapshot {snapshot['id']} ({snapshot.get('developerNotes')})")
+                return summary
+            for organization_id, deleted in pool.map(lambda orphan: delete(*orphan), orphans):
+                summary[organization_id]["deleted" if deleted else "failed"] += 1
+        return summary
+    finally:
+        if own_client:
+            client.close()
+        if own_queue:
+            queue.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Delete snapshots left on the Coveo platform by interrupted backups.")
+    parser.add_argument("--org", action="append", dest="organization_ids",
+                        help="Organization to clean up (repeatable); defaults to COVEO_ORGANIZATION_IDS or COVEO_ORGANIZATION_ID")
+    parser.add_argument("--older-than", type=float, default=DELETE_LEASE / 3600,
+                        help="Only delete snapshots older than this many hours (default: %(default)g)")
+    parser.add_argument("--concurrency", type=int, default=GC_CONCURRENCY, help="Maximum concurrent API calls")
+    parser.add_argument("--dry-run", action="store_true", help="List orphaned snapshots without deleting them")
+    args = parser.parse_args()
+
+    organization_ids = args.organization_ids or get_organization_ids()
+    if not organization_ids:
+        parser.error("no organization given and COVEO_ORGANIZATION_IDS / COVEO_ORGANIZATION_ID is not set")
+
+    start = time.monotonic()
+    summary = collect_orphaned_snapshots(organization_ids, args.older_than * 3600, args.concurrency, args.dry_run)
+    elapsed = time.monotonic() - start
+    METRICS.log_summary()
+    HEDGER.log_summary()
+
+    print(f"{'Organization':<40} {'Found':>7} {'Deleted':>8} {'Failed':>7}")
+    for organization_id, counts in summary.items():
+        print(f"{organization_id:<40} {counts['found']:>7} {counts['deleted']:>8} {counts['failed']:>7}")
+    totals = {key: sum(counts[key] for counts in summary.values()) for key in ("found", "deleted", "failed")}
+    print(f"{'Total':<40} {totals['found']:>7} {totals['deleted']:>8} {totals['failed']:>7}  ({elapsed:.1f}s)")
+    return 1 if totals["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,35 @@
+import json
+import os
+import tempfile
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Local state kept between runs (caches, queues); never committed
+STATE_DIR = os.getenv("COVEO_STATE_DIR", os.path.join(PROJECT_ROOT, '.cache'))
+
+
+def state_path(name):
+    """Return the path of a state file, creating the state directory if needed."""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    return os.path.join(STATE_DIR, name)
+
+
+def load_state(name, default=None):
+    """Load a JSON state file, returning default if it is missing or unreadable."""
+    try:
+        with open(state_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {} if default is None else default
+
+
+def save_state(name, data):
+    """Atomically replace a JSON state file so a crash never leaves it half-written."""
+    path = state_path(name)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=f".{name}.")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(temp_path, path)
+    except Exception:
+        os.remove(temp_path)
+        raise
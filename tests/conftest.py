@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import state  # noqa: E402
+from circuit_breaker import CircuitBreaker  # noqa: E402
+from coveo_api import RateLimitGovernor  # noqa: E402
+from fake_coveo_server import FakeCoveoServer, generate_snapshot_document  # noqa: E402
+from http_metrics import HttpMetrics  # noqa: E402
+
+ORGANIZATION_ID = "testorg"
+
+
+@pytest.fixture(autouse=True)
+def state_dir(tmp_path, monkeypatch):
+    """Give every test its own state directory, so caches, circuits and queues never leak between tests."""
+    directory = tmp_path / "state"
+    monkeypatch.setattr(state, "STATE_DIR", str(directory))
+    return directory
+
+
+@pytest.fixture
+def fake_server():
+    """Start FakeCoveoServer instances serving small generated snapshots; they are stopped after the test."""
+    servers = []
+
+    def start(resource_count=200, **options):
+        options.setdefault("document_factory", lambda sequence: generate_snapshot_document(
+            resource_count, change_rate=0.1, generation=sequence))
+        server = FakeCoveoServer(**options)
+        server.start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture
+def client_options():
+    """Client keyword arguments for a fake server: a private governor, breaker and metrics, and near-instant backoff."""
+    def options(server, **overrides):
+        return {
+            "api_key": "test-key",
+            "platform_url": server.url,
+            "backoff_factor": 0.01,
+            "governor": RateLimitGovernor(rate_per_key=1000, rate_per_org=1000),
+            "breaker": CircuitBreaker(),
+            "metrics": HttpMetrics(metrics_file=None),
+            **overrides,
+        }
+    return options
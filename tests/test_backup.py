@@ -0,0 +1,107 @@
+import json
+import os
+import zipfile
+
+import pytest
+import requests
+
+import backup
+from backup import (OrgBackup, backup_failed, build_stage, commit_stage, create_stage, download_path,
+                    download_stage)
+from compare import file_sha256
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient, _write_progress
+from delete_queue import DeleteQueue, DeleteWorker
+from fake_coveo_server import generate_snapshot_document
+from manifest import manifest_path
+
+
+def write_snapshot(path, document, indent=None):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(f"{os.path.basename(path)[:-4]}.json", json.dumps(document, indent=indent))
+    return str(path)
+
+
+@pytest.fixture
+def commits(monkeypatch):
+    """Record what commit_stage commits instead of committing to the repository."""
+    commits = []
+    monkeypatch.setattr(backup, "commit_snapshot", lambda path, repo, extra_paths=(): commits.append(
+        [path, *extra_paths]))
+    monkeypatch.setattr(backup, "commit_manifest", lambda path, repo: commits.append([path]))
+    return commits
+
+
+def test_legacy_snapshot_is_indexed_once(tmp_path, commits, monkeypatch):
+    document = json.loads(generate_snapshot_document(50))
+    snapshot_dir = tmp_path / "snapshots"
+    snapshot_dir.mkdir()
+    # Saved by an older version: no sidecar manifest
+    legacy_path = write_snapshot(snapshot_dir / "snapshot_20240101_000000.zip", document)
+    delete_worker = DeleteWorker(None, DeleteQueue())
+
+    def run(name):
+        org_backup = OrgBackup(ORGANIZATION_ID, name, str(snapshot_dir))
+        # The same resources, but other JSON bytes than the committed snapshot
+        org_backup.temp_zip_path = write_snapshot(tmp_path / f"{name}.zip", document, indent=1)
+        org_backup.temp_zip_sha256 = file_sha256(org_backup.temp_zip_path)
+        commit_stage(delete_worker, org_backup)
+        assert not os.path.exists(org_backup.temp_zip_path)
+
+    run("snapshot_20240102_000000")
+    assert commits == [[manifest_path(legacy_path)]]
+
+    parsed = []
+    build_manifest = backup.build_manifest
+    monkeypatch.setattr(backup, "build_manifest", lambda path, sha256: parsed.append(path) or build_manifest(
+        path, sha256))
+    run("snapshot_20240103_000000")
+    assert commits == [[manifest_path(legacy_path)]]
+    assert legacy_path not in parsed
+    delete_worker.queue.close()
+
+
+def test_next_run_resumes_an_interrupted_download(fake_server, client_options, tmp_path, commits):
+    server = fake_server()
+    snapshot_dir = str(tmp_path / "snapshots")
+    with CoveoClient(**client_options(server)) as client:
+        delete_worker = DeleteWorker(client, DeleteQueue())
+        first = OrgBackup(ORGANIZATION_ID, "snapshot_1", snapshot_dir)
+        build_stage(client, create_stage(client, delete_worker, first))
+        snapshot_id = first.snapshot_ids[0]
+        # The connection dropped after 1000 bytes
+        zip_path = download_path(ORGANIZATION_ID, snapshot_id)
+        content = server.snapshots[(ORGANIZATION_ID, snapshot_id)]["content"]
+        with open(f"{zip_path}.part", "wb") as f:
+            f.write(content[:1000])
+        _write_progress(f"{zip_path}.part.json", f"{client.snapshots_url(ORGANIZATION_ID)}/{snapshot_id}/content",
+                        f'"{snapshot_id}"', len(content), 1000)
+        backup_failed(delete_worker, first, requests.ConnectionError("Connection reset by peer"))
+        assert delete_worker.queue.due(10) == [] and os.path.exists(f"{zip_path}.part")
+
+        second = OrgBackup(ORGANIZATION_ID, "snapshot_2", snapshot_dir)
+        download_stage(client, delete_worker, build_stage(client, create_stage(client, delete_worker, second)))
+        assert second.snapshot_ids == [snapshot_id] and server.stats["created"] == 1
+        assert server.stats["content_bytes"] == len(content) - 1000
+        commit_stage(delete_worker, second)
+        final_zip_path = os.path.join(snapshot_dir, "snapshot_2.zip")
+        assert commits == [[final_zip_path, manifest_path(final_zip_path)]]
+        assert not os.listdir(os.path.dirname(zip_path))
+        assert delete_worker.queue.due(10) == [(ORGANIZATION_ID, snapshot_id, 0)]
+        delete_worker.queue.close()
+
+
+def test_failed_backup_removes_its_download(fake_server, client_options, tmp_path):
+    server = fake_server()
+    with CoveoClient(**client_options(server)) as client:
+        delete_worker = DeleteWorker(client, DeleteQueue())
+        org_backup = create_stage(client, delete_worker, OrgBackup(ORGANIZATION_ID, "snapshot_1", str(tmp_path)))
+        zip_path = download_path(ORGANIZATION_ID, org_backup.snapshot_ids[0])
+        for path in (f"{zip_path}.part", f"{zip_path}.part.json"):
+            with open(path, "w") as f:
+                f.write("{}")
+        # Not a dropped connection: nothing to resume
+        backup_failed(delete_worker, org_backup, requests.HTTPError("404 Client Error"))
+        assert not os.path.exists(f"{zip_path}.part") and not os.path.exists(f"{zip_path}.part.json")
+        assert delete_worker.queue.due(10) == [(ORGANIZATION_ID, org_backup.snapshot_ids[0], 0)]
+        delete_worker.queue.close()
@@ -0,0 +1,64 @@
+import itertools
+import time
+
+import pytest
+
+import backup
+import change_probe
+from backup import OrgBackup, create_stage
+from change_probe import record_snapshot_fingerprints
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+from delete_queue import DeleteQueue, DeleteWorker
+
+RUNS = itertools.count()
+
+
+@pytest.fixture
+def probed_server(fake_server, client_options, monkeypatch):
+    """A fake server whose organization only changes on drift(), and a runner of the create stage probing it."""
+    server = fake_server(drift_on_export=False)
+    monkeypatch.setattr(change_probe, "DEFAULT_PROBES", {
+        resource_type: f"/rest/organizations/{{organizationId}}/resources/{resource_type}"
+        for resource_type in ("FIELD", "SOURCE", "QUERY_PIPELINE")})
+    monkeypatch.setattr(backup, "CHANGE_PROBE_ENABLED", True)
+    with CoveoClient(**client_options(server)) as client:
+        delete_worker = DeleteWorker(client, DeleteQueue())
+        yield server, lambda **kwargs: run_create_stage(client, delete_worker, **kwargs)
+        delete_worker.queue.close()
+
+
+def run_create_stage(client, delete_worker, snapshot_time=None):
+    """Run the create stage; when it snapshots, record its fingerprints as a stored snapshot would."""
+    org_backup = create_stage(client, delete_worker, OrgBackup(ORGANIZATION_ID, f"snapshot_{next(RUNS)}", "unused"))
+    if org_backup is not None:
+        record_snapshot_fingerprints(ORGANIZATION_ID, org_backup.fingerprints,
+                                     org_backup.probe_time if snapshot_time is None else snapshot_time)
+    return org_backup
+
+
+def test_unchanged_organization_is_not_snapshotted(probed_server):
+    server, run = probed_server
+    assert run() is not None
+    assert server.stats["created"] == 1
+
+    assert run() is None
+    assert run() is None
+    assert server.stats["created"] == 1
+
+    server.drift()
+    assert run() is not None
+    assert server.stats["created"] == 2
+    assert run() is None
+
+
+def test_full_snapshot_is_forced_after_max_age(probed_server):
+    server, run = probed_server
+    run(snapshot_time=time.time() - change_probe.CHANGE_PROBE_MAX_AGE - 60)
+    assert server.stats["created"] == 1
+
+    # Unchanged, but the last full snapshot is too old
+    assert run() is not None
+    assert server.stats["created"] == 2
+    assert run() is None
+    assert server.stats["created"] == 2
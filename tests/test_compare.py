@@ -0,0 +1,106 @@
+import json
+import zipfile
+
+import pytest
+
+import compare
+from compare import compare_jsons_in_zips, diff_documents, diff_snapshots, field_paths, file_sha256
+from manifest import build_manifest
+
+
+def write_snapshot(path, document, member="snapshot.json"):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(member, json.dumps(document))
+    return str(path)
+
+
+def resource(name, **model):
+    return {"resourceName": name, "model": model}
+
+
+OLD = {"resources": {
+    "FIELD": [resource("title", type="STRING", facet=False), resource("author", type="STRING")],
+    "SOURCE": [resource("web", urls=["a", "b"])],
+}}
+NEW = {"resources": {
+    "FIELD": [resource("title", type="STRING", facet=True), resource("date", type="DATE")],
+    "SOURCE": [resource("web", urls=["a", "c", "d"])],
+}}
+EXPECTED = [
+    {"type": "FIELD", "resourceName": "author", "change": "removed", "paths": []},
+    {"type": "FIELD", "resourceName": "date", "change": "added", "paths": []},
+    {"type": "FIELD", "resourceName": "title", "change": "modified", "paths": ["model.facet"]},
+    {"type": "SOURCE", "resourceName": "web", "change": "modified", "paths": ["model.urls[1]", "model.urls[2]"]},
+]
+
+
+@pytest.mark.parametrize("old, new, paths", [
+    ({"a": 1}, {"a": 1}, []),
+    ({"a": 1}, {"a": 2}, ["a"]),
+    ({"a": {"b": [1, 2]}}, {"a": {"b": [1, 3, 4]}}, ["a.b[1]", "a.b[2]"]),
+    ({"a": 1, "b": 2}, {"b": 2, "c": 3}, ["a", "c"]),
+    # A value that changes type is reported where it changes, even when it compares equal
+    ({"a": 1}, {"a": True}, ["a"]),
+    ({"a": {"b": 1}}, {"a": [1]}, ["a"]),
+])
+def test_field_paths(old, new, paths):
+    assert field_paths(old, new) == paths
+
+
+def test_diff_documents():
+    assert diff_documents(OLD, NEW) == EXPECTED
+    assert diff_documents(OLD, OLD) == []
+
+
+def test_diff_documents_keys_repeated_and_unnamed_resources():
+    old = {"resources": {"FILTER": [resource("f", v=1), resource("f", v=2), {"model": {"v": 3}}]}}
+    new = {"resources": {"FILTER": [resource("f", v=1), resource("f", v=5), {"model": {"v": 3}}]}}
+    assert diff_documents(old, new) == [
+        {"type": "FILTER", "resourceName": "f#2", "change": "modified", "paths": ["model.v"]},
+    ]
+
+
+@pytest.mark.parametrize("with_manifests", [False, True])
+def test_diff_snapshots(tmp_path, with_manifests):
+    old_path = write_snapshot(tmp_path / "old.zip", OLD)
+    new_path = write_snapshot(tmp_path / "new.zip", NEW)
+    manifests = [build_manifest(path, file_sha256(path)) for path in (old_path, new_path)] if with_manifests \
+        else [None, None]
+    assert diff_snapshots(old_path, new_path, *manifests) == EXPECTED
+
+
+def test_diff_snapshots_skips_parsing_when_manifests_agree(tmp_path, monkeypatch):
+    old_path = write_snapshot(tmp_path / "old.zip", OLD)
+    # Same resources, other key order and another member name
+    same_path = write_snapshot(tmp_path / "same.zip", {"resources": dict(reversed(OLD["resources"].items()))},
+                               member="other.json")
+    manifests = [build_manifest(path, file_sha256(path)) for path in (old_path, same_path)]
+    monkeypatch.setattr("compare.read_snapshot_document", lambda path: pytest.fail("a ZIP was parsed"))
+    assert diff_snapshots(old_path, same_path, *manifests) == []
+    assert compare_jsons_in_zips(old_path, same_path)
+
+
+def test_identical_json_bytes_are_equal_without_parsing(tmp_path, monkeypatch):
+    old_path = write_snapshot(tmp_path / "old.zip", OLD, member="snapshot_1.json")
+    new_path = write_snapshot(tmp_path / "new.zip", OLD, member="snapshot_2.json")
+    monkeypatch.setattr("compare.zip_json_digest", lambda path: pytest.fail("a JSON member was parsed"))
+    monkeypatch.setattr("compare.read_manifest", lambda *args: pytest.fail("a manifest was read"))
+    assert compare_jsons_in_zips(old_path, new_path)
+
+
+def test_same_size_with_another_crc_falls_through_to_digests(tmp_path, monkeypatch):
+    old_path = write_snapshot(tmp_path / "old.zip", {"a": 1, "b": 2})
+    same_path = write_snapshot(tmp_path / "same.zip", {"b": 2, "a": 1})
+    other_path = write_snapshot(tmp_path / "other.zip", {"a": 1, "b": 3})
+    digested = []
+
+    def spy(path, digest=compare.zip_json_digest):
+        digested.append(path)
+        return digest(path)
+
+    monkeypatch.setattr("compare.zip_json_digest", spy)
+    assert compare.zip_json_checksum(old_path)[1] == compare.zip_json_checksum(same_path)[1]
+    assert not compare.same_json_bytes(old_path, same_path)
+    assert compare_jsons_in_zips(old_path, same_path)
+    assert not compare_jsons_in_zips(old_path, other_path)
+    assert digested == [old_path, same_path, old_path, other_path]
@@ -0,0 +1,75 @@
+import hashlib
+import os
+
+import pytest
+
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient, _write_progress
+
+
+def snapshot_content(server, snapshot_id):
+    return server.snapshots[(ORGANIZATION_ID, snapshot_id)]["content"]
+
+
+@pytest.mark.parametrize("gzip", [False, True])
+def test_download_counts_wire_and_decoded_bytes(fake_server, client_options, tmp_path, gzip):
+    server = fake_server(stored=gzip, gzip=gzip)
+    output_path = str(tmp_path / "snapshot.zip")
+    with CoveoClient(**client_options(server)) as client:
+        snapshot_id = client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+        client.wait_for_snapshot(ORGANIZATION_ID, snapshot_id, poll_interval=0.05)
+        _, sha256 = client.export_snapshot_content(ORGANIZATION_ID, snapshot_id, output_path)
+        metrics = client.metrics
+
+    content = snapshot_content(server, snapshot_id)
+    with open(output_path, "rb") as f:
+        assert f.read() == content
+    assert sha256 == hashlib.sha256(content).hexdigest()
+    assert not os.path.exists(f"{output_path}.part") and not os.path.exists(f"{output_path}.part.json")
+    download = metrics.summary()[("content", ORGANIZATION_ID)]
+    assert download["bytes"] == len(content)
+    if gzip:
+        # The stored ZIP went through gzip on the wire and was decoded while streamed to disk
+        assert download["wireBytes"] == server.stats["content_bytes"] < download["bytes"]
+    else:
+        assert download["wireBytes"] == download["bytes"]
+
+
+def _leave_partial_download(server, snapshot_id, output_path, received, validator=None):
+    """Leave the .part file and progress record a download interrupted after received bytes would leave."""
+    content = snapshot_content(server, snapshot_id)
+    with open(f"{output_path}.part", "wb") as f:
+        f.write(content[:received])
+    url = f"{server.url}/rest/organizations/{ORGANIZATION_ID}/snapshots/{snapshot_id}/content"
+    _write_progress(f"{output_path}.part.json", url, validator or f'"{snapshot_id}"', len(content), received)
+    return content
+
+
+@pytest.mark.parametrize("case", ["resumed", "stale validator", "offset past the end"])
+def test_resumes_interrupted_download(fake_server, client_options, tmp_path, case):
+    server = fake_server()
+    output_path = str(tmp_path / "snapshot.zip")
+    with CoveoClient(**client_options(server)) as client:
+        snapshot_id = client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+        client.wait_for_snapshot(ORGANIZATION_ID, snapshot_id, poll_interval=0.05)
+    size = len(snapshot_content(server, snapshot_id))
+    if case == "resumed":
+        content = _leave_partial_download(server, snapshot_id, output_path, 1000)
+        expected_bytes = size - 1000
+    elif case == "stale validator":
+        # The snapshot changed since the interruption: If-Range fails and the whole body comes back
+        content = _leave_partial_download(server, snapshot_id, output_path, 1000, validator='"stale"')
+        expected_bytes = size
+    else:
+        # The recorded offset is not satisfiable (416): the download starts over
+        content = _leave_partial_download(server, snapshot_id, output_path, size)
+        expected_bytes = size
+
+    # As in a later run: another client picks up what the first left
+    with CoveoClient(**client_options(server)) as client:
+        _, sha256 = client.export_snapshot_content(ORGANIZATION_ID, snapshot_id, output_path)
+    with open(output_path, "rb") as f:
+        assert f.read() == content
+    assert sha256 == hashlib.sha256(content).hexdigest()
+    assert server.stats["content_bytes"] == expected_bytes
+    assert not os.path.exists(f"{output_path}.part.json")
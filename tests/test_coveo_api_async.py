@@ -0,0 +1,168 @@
+import asyncio
+import hashlib
+import os
+
+import aiohttp
+import pytest
+
+from conftest import ORGANIZATION_ID
+from circuit_breaker import CircuitBreaker
+from coveo_api import _write_progress
+from coveo_api_async import AsyncCoveoClient
+from http_metrics import RequestTiming
+
+
+def snapshot_content(server, snapshot_id):
+    return server.snapshots[(ORGANIZATION_ID, snapshot_id)]["content"]
+
+
+async def take_snapshot(client, output_path, poll_interval=0.05):
+    """Create a snapshot, wait until it is built and download it; return its ID, model, path and SHA-256."""
+    snapshot_id = await client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+    model = await client.wait_for_snapshot(ORGANIZATION_ID, snapshot_id, poll_interval=poll_interval)
+    path, sha256 = await client.export_snapshot_content(ORGANIZATION_ID, snapshot_id, output_path)
+    return snapshot_id, model, path, sha256
+
+
+@pytest.mark.parametrize("gzip", [False, True])
+def test_create_poll_and_download(fake_server, client_options, tmp_path, gzip):
+    server = fake_server(build_time=0.3, stored=gzip, gzip=gzip)
+    output_path = str(tmp_path / "snapshot.zip")
+
+    async def scenario():
+        async with AsyncCoveoClient(**client_options(server)) as client:
+            snapshot_id = await client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+            first = await client.get_snapshot(ORGANIZATION_ID, snapshot_id)
+            model = await client.wait_for_snapshot(ORGANIZATION_ID, snapshot_id, poll_interval=0.05)
+            _, sha256 = await client.export_snapshot_content(ORGANIZATION_ID, snapshot_id, output_path)
+            await client.delete_snapshot(ORGANIZATION_ID, snapshot_id)
+            return snapshot_id, first, model, sha256, client.metrics
+
+    snapshot_id, first, model, sha256, metrics = asyncio.run(scenario())
+    content = snapshot_content(server, snapshot_id) if (ORGANIZATION_ID, snapshot_id) in server.snapshots else None
+    assert first["status"] == "IN_PROGRESS"
+    assert model["status"] == "COMPLETED"
+    assert content is None and server.stats["deleted"] == 1
+    with open(output_path, "rb") as f:
+        assert hashlib.sha256(f.read()).hexdigest() == sha256
+    assert not os.path.exists(f"{output_path}.part") and not os.path.exists(f"{output_path}.part.json")
+    download = metrics.summary()[("content", ORGANIZATION_ID)]
+    if gzip:
+        assert download["wireBytes"] < download["bytes"]
+    else:
+        assert download["wireBytes"] == download["bytes"]
+
+
+def test_retries_throttled_and_failing_requests(fake_server, client_options, tmp_path):
+    server = fake_server(error_rate_429=0.2, error_rate_5xx=0.2, retry_after=0.01, seed=7)
+
+    async def scenario():
+        async with AsyncCoveoClient(**client_options(server, max_retries=10)) as client:
+            return await asyncio.gather(*(take_snapshot(client, str(tmp_path / f"snapshot_{n}.zip")) for n in range(4)))
+
+    for snapshot_id, model, path, sha256 in asyncio.run(scenario()):
+        assert model["status"] == "COMPLETED"
+        assert sha256 == hashlib.sha256(snapshot_content(server, snapshot_id)).hexdigest()
+    assert server.stats["throttled"] > 0 and server.stats["failed"] > 0
+    assert server.stats["created"] == 4
+
+
+def test_gives_up_after_max_retries(fake_server, client_options):
+    server = fake_server(error_rate_5xx=1.0)
+
+    async def scenario():
+        async with AsyncCoveoClient(**client_options(server, max_retries=2)) as client:
+            await client.get_snapshot(ORGANIZATION_ID, "missing")
+
+    with pytest.raises(aiohttp.ClientResponseError) as excinfo:
+        asyncio.run(scenario())
+    assert excinfo.value.status == 503
+    assert server.stats["requests"] == 3
+
+
+def _leave_partial_download(server, snapshot_id, output_path, received, validator=None):
+    """Leave the .part file and progress record a download interrupted after received bytes would leave."""
+    content = snapshot_content(server, snapshot_id)
+    with open(f"{output_path}.part", "wb") as f:
+        f.write(content[:received])
+    url = f"{server.url}/rest/organizations/{ORGANIZATION_ID}/snapshots/{snapshot_id}/content"
+    _write_progress(f"{output_path}.part.json", url, validator or f'"{snapshot_id}"', len(content), received)
+    return content
+
+
+@pytest.mark.parametrize("case", ["resumed", "stale validator", "offset past the end"])
+def test_resumes_interrupted_download(fake_server, client_options, tmp_path, case):
+    server = fake_server()
+    output_path = str(tmp_path / "snapshot.zip")
+
+    async def create():
+        async with AsyncCoveoClient(**client_options(server)) as client:
+            snapshot_id = await client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+            await client.wait_for_snapshot(ORGANIZATION_ID, snapshot_id, poll_interval=0.05)
+            return snapshot_id
+
+    async def download(snapshot_id):
+        async with AsyncCoveoClient(**client_options(server)) as client:
+            return await client.export_snapshot_content(ORGANIZATION_ID, snapshot_id, output_path)
+
+    snapshot_id = asyncio.run(create())
+    size = len(snapshot_content(server, snapshot_id))
+    if case == "resumed":
+        content = _leave_partial_download(server, snapshot_id, output_path, 1000)
+        expected_bytes = size - 1000
+    elif case == "stale validator":
+        # The snapshot changed since the interruption: If-Range fails and the whole body comes back
+        content = _leave_partial_download(server, snapshot_id, output_path, 1000, validator='"stale"')
+        expected_bytes = size
+    else:
+        # The recorded offset is not satisfiable (416): the download starts over
+        content = _leave_partial_download(server, snapshot_id, output_path, size)
+        expected_bytes = size
+
+    _, sha256 = asyncio.run(download(snapshot_id))
+    with open(output_path, "rb") as f:
+        assert f.read() == content
+    assert sha256 == hashlib.sha256(content).hexdigest()
+    assert server.stats["content_bytes"] == expected_bytes
+    assert not os.path.exists(f"{output_path}.part.json")
+
+
+def test_errors_while_reading_the_body_leave_the_circuit_alone(fake_server, client_options):
+    server = fake_server()
+    breaker = CircuitBreaker(failure_threshold=1)
+    url = f"{server.url}/rest/organizations/{ORGANIZATION_ID}/snapshots"
+
+    async def scenario():
+        async with AsyncCoveoClient(**client_options(server, breaker=breaker)) as client:
+            with pytest.raises(aiohttp.ServerDisconnectedError):
+                async with client._request("GET", url, ORGANIZATION_ID, "list"):
+                    raise aiohttp.ServerDisconnectedError()
+            # The circuit would be open had the caller's error been counted as a failure
+            async with client._request("GET", url, ORGANIZATION_ID, "list") as response:
+                return response.status
+
+    assert asyncio.run(scenario()) == 200
+
+
+def test_each_attempt_is_finished_once(fake_server, client_options, monkeypatch):
+    server = fake_server()
+    finished = []
+
+    def finish(timing, *args, real_finish=RequestTiming.finish, **kwargs):
+        finished.append(timing)
+        real_finish(timing, *args, **kwargs)
+
+    monkeypatch.setattr(RequestTiming, "finish", finish)
+
+    async def scenario():
+        async with AsyncCoveoClient(**client_options(server)) as client:
+            snapshot_id = await client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+            await client.get_snapshot(ORGANIZATION_ID, snapshot_id)
+            with pytest.raises(aiohttp.ClientResponseError):
+                await client.get_snapshot(ORGANIZATION_ID, "missing")
+            return client.metrics
+
+    metrics = asyncio.run(scenario())
+    assert len(finished) == len(set(map(id, finished))) == len(metrics.records) == 3
+    assert [record["status"] for record in metrics.records] == [200, 200, 404]
+    assert metrics.records[-1]["error"]
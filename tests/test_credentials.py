@@ -0,0 +1,68 @@
+import threading
+import time
+
+import pytest
+
+import credentials
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+from credentials import OAuthClientCredentialsProvider, get_credential_provider
+
+
+def oauth_provider(server, refresh_margin):
+    return OAuthClientCredentialsProvider(f"{server.url}/oauth/token", "client", "secret", refresh_margin=refresh_margin)
+
+
+def test_refreshes_tokens_before_they_expire(fake_server, client_options):
+    server = fake_server(token_lifetime=1.0)
+    provider = oauth_provider(server, refresh_margin=0.5)
+
+    with CoveoClient(**client_options(server, api_key=None, credentials=provider)) as client:
+        deadline = time.monotonic() + 2.5
+        while time.monotonic() < deadline:
+            assert client.list_snapshots(ORGANIZATION_ID) == []
+            time.sleep(0.1)
+    assert server.stats["tokens"] >= 3
+    assert server.stats["unauthorized"] == 0
+
+
+def test_fetches_a_new_token_after_a_401(fake_server, client_options):
+    server = fake_server(token_lifetime=60.0)
+    provider = oauth_provider(server, refresh_margin=0.0)
+
+    with CoveoClient(**client_options(server, api_key=None, credentials=provider)) as client:
+        assert client.list_snapshots(ORGANIZATION_ID) == []
+        # The platform revokes every token it issued
+        server.tokens.clear()
+        assert client.list_snapshots(ORGANIZATION_ID, max_age=0) == []
+    assert server.stats["unauthorized"] == 1
+    assert server.stats["tokens"] == 2
+
+
+def test_cached_token_does_not_wait_for_a_refresh(fake_server, monkeypatch):
+    server = fake_server(token_lifetime=60.0)
+    # The refresher starts renewing the token 0.2s after it is fetched
+    provider = oauth_provider(server, refresh_margin=59.8)
+    fetch = provider._fetch
+
+    def fetch_slowly_in_the_refresher():
+        if threading.current_thread() is provider.refresher:
+            time.sleep(1.0)
+        return fetch()
+
+    monkeypatch.setattr(provider, "_fetch", fetch_slowly_in_the_refresher)
+    token = provider.token(ORGANIZATION_ID)
+    time.sleep(0.5)
+    started = time.monotonic()
+    assert provider.cached_token(ORGANIZATION_ID) == token
+    assert time.monotonic() - started < 0.1
+    assert server.stats["tokens"] == 1
+
+
+def test_refuses_to_run_without_credentials(monkeypatch):
+    for name in ("COVEO_API_KEY", "COVEO_OAUTH_TOKEN_URL", "COVEO_OAUTH_CLIENT_ID", "COVEO_OAUTH_CLIENT_SECRET",
+                 "COVEO_CREDENTIALS_FILE"):
+        monkeypatch.delenv(name, raising=False)
+    with pytest.raises(ValueError, match="No Coveo credentials"):
+        get_credential_provider()
+    assert isinstance(get_credential_provider("key"), credentials.StaticKeyProvider)
@@ -0,0 +1,28 @@
+import time
+
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+from delete_queue import DeleteQueue, DeleteWorker
+
+
+def test_stop_waits_for_deletes_in_flight(fake_server, client_options, state_dir):
+    server = fake_server()
+    client = CoveoClient(**client_options(server))
+    snapshot_ids = [client.create_snapshot(ORGANIZATION_ID, f"snapshot_{n}") for n in range(3)]
+    server.latency = 0.5
+    queue = DeleteQueue()
+    for snapshot_id in snapshot_ids:
+        queue.enqueue(ORGANIZATION_ID, snapshot_id)
+    # A leased snapshot is not due yet and stays queued
+    queue.enqueue(ORGANIZATION_ID, "leased", delay=3600)
+
+    worker = DeleteWorker(client, queue)
+    worker.start()
+    time.sleep(0.1)
+    worker.stop(timeout=0)
+    assert not worker.is_alive()
+    client.close()
+
+    assert server.stats["deleted"] == 3
+    assert queue.pending_count() == 1
+    queue.close()
@@ -0,0 +1,74 @@
+import socket
+import time
+
+import pytest
+
+import dns_cache
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+from dns_cache import DnsCache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = DnsCache()
+    monkeypatch.setattr(dns_cache, "DNS_CACHE", cache)
+    return cache
+
+
+def seed(cache, host, addresses):
+    """Cache addresses for host as if it had just been resolved."""
+    cache._load()[host] = {"addresses": addresses, "resolved": time.time()}
+
+
+def test_tries_each_cached_address(fake_server, client_options, cache):
+    server = fake_server()
+    port = server.url.rsplit(":", 1)[1]
+    # Nothing listens on 127.0.0.2, so the connection is refused there before 127.0.0.1 answers
+    seed(cache, "platform.test", [(socket.AF_INET, "127.0.0.2"), (socket.AF_INET, "127.0.0.1")])
+
+    with CoveoClient(**client_options(server, platform_url=f"http://platform.test:{port}")) as client:
+        assert client.list_snapshots(ORGANIZATION_ID) == []
+    assert cache._load()["platform.test"]["resolved"] > 0
+
+
+def test_expires_addresses_that_all_fail(fake_server, client_options, cache):
+    server = fake_server()
+    port = server.url.rsplit(":", 1)[1]
+    seed(cache, "platform.test", [(socket.AF_INET, "127.0.0.2"), (socket.AF_INET, "127.0.0.3")])
+
+    with CoveoClient(**client_options(server, platform_url=f"http://platform.test:{port}", max_retries=0)) as client:
+        with pytest.raises(Exception):
+            client.list_snapshots(ORGANIZATION_ID)
+    entry = cache._load()["platform.test"]
+    assert entry["resolved"] == 0 and len(entry["addresses"]) == 2
+
+
+def test_resolves_again_once_the_ttl_expires(fake_server, client_options, cache, monkeypatch):
+    server = fake_server()
+    port = server.url.rsplit(":", 1)[1]
+    lookups = []
+    real_getaddrinfo = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        # urllib3 also calls getaddrinfo, with the cached address it connects to
+        if host != "platform.test":
+            return real_getaddrinfo(host, port, *args, **kwargs)
+        lookups.append(host)
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", ("127.0.0.1", int(port)))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", getaddrinfo)
+    options = client_options(server, platform_url=f"http://platform.test:{port}")
+    seed(cache, "platform.test", [(socket.AF_INET, "127.0.0.1")])
+    # A new client per call, so every call opens a connection and goes through the cache
+    for _ in range(3):
+        with CoveoClient(**options) as client:
+            client.list_snapshots(ORGANIZATION_ID, max_age=0)
+    assert lookups == []
+
+    cache._load()["platform.test"]["resolved"] -= cache.ttl + 1
+    for _ in range(3):
+        with CoveoClient(**options) as client:
+            client.list_snapshots(ORGANIZATION_ID, max_age=0)
+    assert lookups == ["platform.test"]
+    assert time.time() - cache._load()["platform.test"]["resolved"] < cache.ttl
@@ -0,0 +1,34 @@
+import json
+import zipfile
+import io
+
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient, RESOURCE_TYPES
+from fake_coveo_server import CHILD_RESOURCE_PARENTS
+
+
+def snapshot_document(server, snapshot_id):
+    with zipfile.ZipFile(io.BytesIO(server.snapshots[(ORGANIZATION_ID, snapshot_id)]["content"])) as z:
+        return json.loads(z.read(z.namelist()[0]))
+
+
+def test_exports_requested_types_and_their_children(fake_server, client_options):
+    server = fake_server()
+    with CoveoClient(**client_options(server)) as client:
+        full = client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+        pipelines = client.create_snapshot(ORGANIZATION_ID, "snapshot_test", ["QUERY_PIPELINE"])
+    full_resources = snapshot_document(server, full)["resources"]
+    pipeline_resources = snapshot_document(server, pipelines)["resources"]
+    assert set(pipeline_resources) == {"QUERY_PIPELINE"} | {
+        child for child, parents in CHILD_RESOURCE_PARENTS.items() if "QUERY_PIPELINE" in parents}
+    # Snapshots of one export see the organization in the same state
+    assert all(pipeline_resources[t] == full_resources[t] for t in pipeline_resources)
+    assert set(full_resources) <= set(RESOURCE_TYPES) | set(CHILD_RESOURCE_PARENTS)
+
+
+def test_organization_drifts_between_exports(fake_server, client_options):
+    server = fake_server()
+    with CoveoClient(**client_options(server)) as client:
+        first = client.create_snapshot(ORGANIZATION_ID, "snapshot_1")
+        second = client.create_snapshot(ORGANIZATION_ID, "snapshot_2")
+    assert snapshot_document(server, first) != snapshot_document(server, second)
@@ -0,0 +1,36 @@
+import time
+
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+from hedging import Hedger
+
+
+def test_hedges_stalled_calls(fake_server, client_options):
+    server = fake_server(stall_rate=0.1, stall_time=1.0, seed=3)
+    hedger = Hedger(budget=1.0, burst=10, percentile=0.5, min_samples=10, min_delay=0.2)
+
+    with CoveoClient(**client_options(server, hedger=hedger)) as client:
+        snapshot_id = client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+        durations = []
+        for _ in range(60):
+            started = time.monotonic()
+            assert client.get_snapshot(ORGANIZATION_ID, snapshot_id)["id"] == snapshot_id
+            durations.append(time.monotonic() - started)
+
+    assert server.stats["stalled"] >= 3
+    assert hedger.stats["hedged"] > 0 and hedger.stats["won"] > 0
+    # Once the hedge delay is learned, a stalled call is answered by its duplicate
+    assert max(durations[hedger.min_samples:]) < 0.5
+
+
+def test_hedges_stay_within_budget(fake_server, client_options):
+    server = fake_server(stall_rate=1.0, stall_time=0.1)
+    hedger = Hedger(budget=0.1, burst=1, percentile=0.5, min_samples=1, min_delay=0.05)
+
+    with CoveoClient(**client_options(server, hedger=hedger)) as client:
+        snapshot_id = client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+        for _ in range(20):
+            client.get_snapshot(ORGANIZATION_ID, snapshot_id)
+
+    # One saved-up hedge, then one for every ten calls
+    assert hedger.stats["hedged"] <= 1 + 20 * 0.1
@@ -0,0 +1,41 @@
+import json
+
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+from http_metrics import HttpMetrics
+
+
+def test_sync_client_records_every_attempt(fake_server, client_options, tmp_path):
+    server = fake_server(error_rate_5xx=0.3, seed=1)
+    metrics_file = tmp_path / "metrics.jsonl"
+    metrics = HttpMetrics(metrics_file=str(metrics_file))
+    with CoveoClient(**client_options(server, metrics=metrics, max_retries=10)) as client:
+        snapshot_id = client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+        client.wait_for_snapshot(ORGANIZATION_ID, snapshot_id, poll_interval=0.05)
+        size = len(server.snapshots[(ORGANIZATION_ID, snapshot_id)]["content"])
+        client.export_snapshot_content(ORGANIZATION_ID, snapshot_id, str(tmp_path / "snapshot.zip"))
+        client.delete_snapshot(ORGANIZATION_ID, snapshot_id)
+
+    with open(metrics_file) as f:
+        records = [json.loads(line) for line in f]
+    assert records == metrics.records
+    # One record per attempt, retries included
+    assert len(records) == server.stats["requests"]
+    for record in records:
+        assert record["organizationId"] == ORGANIZATION_ID and record["total"] >= record["ttfb"] >= 0
+
+    summary = metrics.summary()
+    assert sum(stats["requests"] for stats in summary.values()) == len(records)
+    assert sum(stats["errors"] for stats in summary.values()) == server.stats["failed"] > 0
+    content = summary[("content", ORGANIZATION_ID)]
+    assert content["bytes"] == content["wireBytes"] == size
+    assert set(content) >= {"connect", "ttfb", "transfer"}
+    assert {operation for operation, _ in summary} >= {"create", "content", "delete"}
+
+
+def test_unwritable_metrics_file_is_given_up(tmp_path):
+    metrics = HttpMetrics(metrics_file=str(tmp_path / "missing" / "metrics.jsonl"))
+    for attempt in range(2):
+        metrics.start("list", ORGANIZATION_ID, "GET", "http://example", attempt).finish(10)
+    assert metrics.metrics_file is None
+    assert metrics.summary()[("list", ORGANIZATION_ID)]["requests"] == 2
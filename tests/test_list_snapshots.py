@@ -0,0 +1,50 @@
+import pytest
+
+import coveo_api
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+
+
+@pytest.fixture(autouse=True)
+def page_size(monkeypatch):
+    monkeypatch.setattr(coveo_api, "LIST_PAGE_SIZE", 2)
+    return 2
+
+
+def list_requests(client):
+    return client.metrics.summary()[("list", ORGANIZATION_ID)]["requests"]
+
+
+@pytest.mark.parametrize("listing", ["list", "paged"])
+def test_lists_every_page(fake_server, client_options, listing):
+    server = fake_server(listing=listing)
+    server.seed_orphans(ORGANIZATION_ID, 5)
+
+    with CoveoClient(**client_options(server)) as client:
+        snapshots = client.list_snapshots(ORGANIZATION_ID)
+        assert list_requests(client) == 3
+    assert sorted(snapshot["id"] for snapshot in snapshots) == sorted(snapshot_id for _, snapshot_id in server.snapshots)
+
+
+@pytest.mark.parametrize("count", [1, 2, 3])
+def test_stops_when_the_platform_ignores_paging(fake_server, client_options, count):
+    server = fake_server(listing="unpaged")
+    server.seed_orphans(ORGANIZATION_ID, count)
+
+    with CoveoClient(**client_options(server)) as client:
+        snapshots = client.list_snapshots(ORGANIZATION_ID)
+        # A full first page is followed by a second request, which sends the same snapshots again
+        assert list_requests(client) == (2 if count == 2 else 1)
+    assert len(snapshots) == count
+
+
+@pytest.mark.parametrize("listing", ["list", "paged"])
+def test_finds_pages_added_after_an_unchanged_full_page(fake_server, client_options, listing):
+    server = fake_server(listing=listing)
+    server.seed_orphans(ORGANIZATION_ID, 2)
+
+    with CoveoClient(**client_options(server)) as client:
+        assert len(client.list_snapshots(ORGANIZATION_ID)) == 2
+        server.seed_orphans(ORGANIZATION_ID, 1, age=0.0)
+        # The first page is revalidated with a 304, and the new snapshot is on a page after it
+        assert len(client.list_snapshots(ORGANIZATION_ID, max_age=0)) == 3
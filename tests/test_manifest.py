@@ -0,0 +1,54 @@
+import json
+import zipfile
+
+import pytest
+
+from compare import diff_manifests, file_sha256
+from fake_coveo_server import generate_snapshot_document
+from manifest import build_manifest, load_manifest, manifest_leaves, manifest_path, read_manifest, write_manifest
+
+
+def write_snapshot(directory, name, document):
+    path = str(directory / f"{name}.zip")
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as z:
+        z.writestr(f"{name}.json", document)
+    return path
+
+
+@pytest.fixture
+def snapshots(tmp_path):
+    """Two consecutive snapshots of a drifting organization and their manifests."""
+    paths = [write_snapshot(tmp_path, f"snapshot_{generation}",
+                            generate_snapshot_document(300, change_rate=0.05, generation=generation))
+             for generation in range(2)]
+    return [(path, build_manifest(path, file_sha256(path))) for path in paths]
+
+
+def test_sidecar_is_compact_and_leaves_out_the_leaves(snapshots):
+    path, manifest = snapshots[0]
+    write_manifest(path, manifest)
+    with open(manifest_path(path)) as f:
+        text = f.read()
+    assert "\n " not in text
+    sidecar = json.loads(text)
+    assert all("leaves" not in entry for entry in sidecar["resourceTypes"].values())
+    assert sidecar == read_manifest(path, manifest["archiveSha256"])
+
+
+def test_leaves_come_back_from_the_state_directory(snapshots, monkeypatch):
+    (old_path, old_manifest), (new_path, new_manifest) = snapshots
+    write_manifest(old_path, old_manifest)
+    sidecar = load_manifest(old_path, old_manifest["archiveSha256"])
+
+    monkeypatch.setattr("manifest.build_manifest", lambda *args: pytest.fail("the ZIP was parsed"))
+    assert manifest_leaves(old_path, sidecar) == old_manifest
+    assert diff_manifests(manifest_leaves(old_path, sidecar), new_manifest)
+
+
+def test_leaves_are_rebuilt_from_the_zip(snapshots, state_dir):
+    (old_path, old_manifest), (new_path, new_manifest) = snapshots
+    write_manifest(old_path, old_manifest)
+    # The next snapshot of the directory replaces the saved leaves of the previous one
+    write_manifest(new_path, new_manifest)
+    sidecar = read_manifest(old_path, old_manifest["archiveSha256"])
+    assert manifest_leaves(old_path, sidecar) == old_manifest
@@ -0,0 +1,74 @@
+import threading
+import time
+
+from pipeline import Pipeline, Stage
+
+
+def run_in_thread(pipeline, items, timeout=10.0):
+    """Run the pipeline in a thread and fail if it has not finished within timeout seconds."""
+    thread = threading.Thread(target=pipeline.run, args=(items,), daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), "the pipeline hung"
+
+
+def test_items_go_through_every_stage():
+    done = []
+    lock = threading.Lock()
+
+    def finish(item):
+        with lock:
+            done.append(item)
+
+    stages = [Stage("double", lambda item: item * 2, 2), Stage("increment", lambda item: item + 1, 3),
+              Stage("finish", finish, 1)]
+    run_in_thread(Pipeline(stages), range(20))
+    assert sorted(done) == [item * 2 + 1 for item in range(20)]
+    assert [stage.processed for stage in stages] == [20, 20, 20]
+
+
+def test_items_returning_none_leave_the_pipeline():
+    seen = []
+    stages = [Stage("filter", lambda item: item if item % 2 else None), Stage("collect", seen.append)]
+    run_in_thread(Pipeline(stages), range(10))
+    assert sorted(seen) == [1, 3, 5, 7, 9]
+
+
+def test_failing_stage_and_failing_error_handler_do_not_hang():
+    failed = []
+    done = []
+
+    def flaky(item):
+        if item % 3 == 0:
+            raise RuntimeError(f"stage failed on {item}")
+        return item
+
+    def on_error(item, error):
+        failed.append(item)
+        raise OSError("cleanup failed too")
+
+    # Queues of one item: a worker killed by on_error would leave the stage before it blocked on put()
+    stages = [Stage("flaky", flaky, 1, queue_size=1), Stage("collect", done.append, 1, queue_size=1)]
+    run_in_thread(Pipeline(stages, on_error=on_error), range(30))
+    assert sorted(failed) == list(range(0, 30, 3))
+    assert sorted(done) == [item for item in range(30) if item % 3]
+
+
+def test_slow_stage_applies_backpressure():
+    release = threading.Event()
+    produced = []
+
+    def produce(item):
+        produced.append(item)
+        return item
+
+    stages = [Stage("produce", produce, 1, queue_size=1), Stage("slow", lambda item: release.wait(), 1, queue_size=1)]
+    thread = threading.Thread(target=Pipeline(stages).run, args=(range(50),), daemon=True)
+    thread.start()
+    time.sleep(0.2)
+    # One item in the slow stage, one in its queue and one waiting in the producer's put()
+    assert len(produced) <= 3
+    release.set()
+    thread.join(10)
+    assert not thread.is_alive()
+    assert len(produced) == 50 and stages[1].processed == 50
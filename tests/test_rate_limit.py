@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+import requests
+
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient, RateLimitGovernor, TokenBucket
+
+
+def test_bucket_halves_its_rate_on_each_429():
+    bucket = TokenBucket(8.0)
+    now = time.monotonic()
+    for expected in (4.0, 2.0, 1.0, 0.5):
+        bucket.throttled(now, 0.0)
+        assert bucket.rate == expected
+    for _ in range(20):
+        bucket.throttled(now, 0.0)
+    assert bucket.rate == TokenBucket.MIN_RATE
+
+
+def test_bucket_recovers_additively_up_to_its_ceiling():
+    bucket = TokenBucket(10.0)
+    bucket.throttled(time.monotonic(), 0.0)
+    rates = []
+    while bucket.rate < bucket.max_rate:
+        bucket.succeeded()
+        rates.append(bucket.rate)
+    # One step of a tenth of the ceiling per success at this rate, never past the ceiling
+    assert rates[0] == pytest.approx(5.0 + 0.1 * 10.0 / 5.0)
+    assert all(later > earlier for earlier, later in zip(rates, rates[1:]))
+    assert len(rates) > 10 and rates[-1] == 10.0
+
+
+def test_pause_holds_every_request_sharing_the_key_or_organization():
+    governor = RateLimitGovernor(rate_per_key=100, rate_per_org=100)
+    governor.throttled("key", "org", 0.5)
+    assert governor.reserve("key", "other-org") == pytest.approx(0.5, abs=0.05)
+    assert governor.reserve("other-key", "org") == pytest.approx(0.5, abs=0.05)
+    assert governor.reserve("other-key", "other-org") == 0.0
+
+
+def test_retry_after_pauses_every_thread(fake_server, client_options):
+    server = fake_server(error_rate_429=1.0, retry_after=0.5)
+    options = client_options(server, max_retries=0)
+    with CoveoClient(**options) as first, CoveoClient(**options) as second:
+        with pytest.raises(requests.HTTPError):
+            first.list_snapshots(ORGANIZATION_ID)
+        server.error_rate_429 = 0.0
+
+        # Another thread and client sharing the governor waits out the Retry-After as well
+        elapsed = []
+
+        def list_from_another_thread():
+            started = time.monotonic()
+            second.list_snapshots("other-org")
+            elapsed.append(time.monotonic() - started)
+
+        thread = threading.Thread(target=list_from_another_thread)
+        thread.start()
+        thread.join()
+    assert elapsed and elapsed[0] >= 0.4
+    assert options["governor"].buckets[("org", ORGANIZATION_ID)].rate < 1000
+
+
+def test_throttled_requests_slow_down_and_recover(fake_server, client_options):
+    server = fake_server(error_rate_429=0.3, retry_after=0.01, seed=1)
+    options = client_options(server, max_retries=20)
+    governor = options["governor"]
+    with CoveoClient(**options) as client:
+        snapshot_id = client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+        threads = [threading.Thread(target=lambda: [client.get_snapshot(ORGANIZATION_ID, snapshot_id)
+                                                    for _ in range(10)]) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        throttled_rate = governor.buckets[("org", ORGANIZATION_ID)].rate
+        assert server.stats["throttled"] > 0 and throttled_rate < 1000
+
+        server.error_rate_429 = 0.0
+        for _ in range(30):
+            client.get_snapshot(ORGANIZATION_ID, snapshot_id)
+    assert governor.buckets[("org", ORGANIZATION_ID)].rate > throttled_rate
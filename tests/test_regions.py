@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+
+import regions
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+from coveo_api_async import AsyncCoveoClient
+
+
+@pytest.fixture
+def two_regions(fake_server, monkeypatch):
+    """A "us" server hosting the test organization and a default "eu" server hosting another one."""
+    us = fake_server(organizations=[ORGANIZATION_ID])
+    eu = fake_server(organizations=["elsewhere"])
+    monkeypatch.setattr(regions, "REGION_URLS", {"us": us.url, "eu": eu.url})
+    monkeypatch.setattr(regions, "DEFAULT_REGION", "eu")
+    return us, eu
+
+
+def test_probes_regions_through_the_client(two_regions, client_options):
+    us, eu = two_regions
+    with CoveoClient(**client_options(us, platform_url=None)) as client:
+        assert client.base_url(ORGANIZATION_ID) == us.url
+        assert client.list_snapshots(ORGANIZATION_ID) == []
+        probes = client.metrics.summary()[("region", ORGANIZATION_ID)]
+    assert probes["requests"] == 2
+    assert regions.load_state(regions.STATE_FILE)[ORGANIZATION_ID]["url"] == us.url
+
+
+def test_caches_failed_resolutions(two_regions, client_options):
+    us, eu = two_regions
+    with CoveoClient(**client_options(us, platform_url=None)) as client:
+        assert client.base_url("nowhere") == eu.url
+        requests_after_probe = us.stats["requests"] + eu.stats["requests"]
+        assert client.base_url("nowhere") == eu.url
+        assert us.stats["requests"] + eu.stats["requests"] == requests_after_probe
+    assert "nowhere" not in regions.load_state(regions.STATE_FILE)
+
+
+def test_forgets_the_region_of_a_refused_organization(two_regions, client_options):
+    us, eu = two_regions
+    # Resolved earlier to the wrong host, as if the organization had moved since
+    regions.save_state(regions.STATE_FILE, {ORGANIZATION_ID: {"url": eu.url, "resolved": time.time()}})
+
+    async def scenario():
+        async with AsyncCoveoClient(**client_options(us, platform_url=None)) as client:
+            with pytest.raises(aiohttp.ClientResponseError) as refused:
+                await client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+            assert refused.value.status == 403
+            return await client.base_url(ORGANIZATION_ID)
+
+    assert asyncio.run(scenario()) == us.url
+    assert regions.load_state(regions.STATE_FILE)[ORGANIZATION_ID]["url"] == us.url
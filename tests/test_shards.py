@@ -0,0 +1,77 @@
+import json
+import zipfile
+
+import pytest
+
+from canonical import zip_json_digest
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+from shards import export_sharded_snapshot, merge_snapshot_documents, parse_shards
+
+
+def test_sharded_export_reports_each_snapshot_as_it_is_created(fake_server, client_options, tmp_path):
+    # The organization drifts between exports, but every shard of one export sees the same state
+    server = fake_server(build_time=0.2)
+    created = []
+
+    def on_created(snapshot_id):
+        # Reported before the shard is built, while the platform still holds it
+        assert server.snapshots[(ORGANIZATION_ID, snapshot_id)]
+        created.append(snapshot_id)
+
+    shards = parse_shards("SOURCE;FIELD,EXTENSION")
+    output_path = str(tmp_path / "merged.zip")
+    with CoveoClient(**client_options(server)) as client:
+        _, _, snapshot_ids = export_sharded_snapshot(client, ORGANIZATION_ID, "snapshot_test", shards, output_path,
+                                                     on_created=on_created)
+    assert len(snapshot_ids) == len(shards) == 3
+    assert sorted(created) == sorted(snapshot_ids)
+    with zipfile.ZipFile(output_path) as z:
+        assert "resources" in json.loads(z.read(z.namelist()[0]))
+
+
+def resource(name, **model):
+    return {"resourceName": name, "model": model}
+
+
+def shard(resources, schema_version="v1", **extra):
+    return {"metadata": {"schemaVersion": schema_version}, **extra, "resources": resources}
+
+
+def test_merge_keeps_order_and_shares_children():
+    mappings = [resource("m2"), resource("m1")]
+    merged = merge_snapshot_documents([
+        shard({"SOURCE": [resource("web"), resource("docs")], "MAPPING": mappings}, origin="platform"),
+        shard({"FIELD": [resource("title")], "MAPPING": mappings[:1]}, origin="platform"),
+    ])
+    assert merged == {
+        "metadata": {"schemaVersion": "v1"},
+        "origin": "platform",
+        "resources": {"SOURCE": [resource("web"), resource("docs")], "MAPPING": mappings,
+                      "FIELD": [resource("title")]},
+    }
+
+
+@pytest.mark.parametrize("documents, error", [
+    ([shard({"MAPPING": [resource("m1", a=1)]}), shard({"MAPPING": [resource("m1", a=2)]})],
+     "Shards disagree on MAPPING resource m1"),
+    ([shard({}), shard({}, schema_version="v2")], "different schema versions"),
+    ([shard({}, origin="a"), shard({}, origin="b")], "Shards disagree on top-level 'origin'"),
+    ([shard({}, origin="a"), shard({})], "Shards disagree on top-level 'origin'"),
+])
+def test_merge_refuses_disagreeing_shards(documents, error):
+    with pytest.raises(ValueError, match=error):
+        merge_snapshot_documents(documents)
+
+
+def test_sharded_export_matches_unsharded_export(fake_server, client_options, tmp_path):
+    server = fake_server()
+    shards = parse_shards("SOURCE;QUERY_PIPELINE,EXTENSION;ML_MODEL")
+    sharded_path = str(tmp_path / "sharded.zip")
+    with CoveoClient(**client_options(server)) as client:
+        export_sharded_snapshot(client, ORGANIZATION_ID, "snapshot_test", shards, sharded_path)
+        # Same developerNotes, so the fake server serves the same organization state
+        snapshot_id = client.create_snapshot(ORGANIZATION_ID, "snapshot_test")
+        unsharded_path, _ = client.export_snapshot_content(ORGANIZATION_ID, snapshot_id, str(tmp_path / "full.zip"))
+    # Shared children (mappings, ML model associations) appear once, in the platform's order
+    assert zip_json_digest(sharded_path) == zip_json_digest(unsharded_path)
@@ -0,0 +1,42 @@
+from conftest import ORGANIZATION_ID
+from coveo_api import CoveoClient
+from delete_queue import DeleteQueue
+from snapshot_gc import collect_orphaned_snapshots
+
+OTHER_ORGANIZATION_ID = "otherorg"
+
+
+def test_only_old_orphans_outside_the_delete_queue_are_deleted(fake_server, client_options):
+    server = fake_server()
+    server.seed_orphans(ORGANIZATION_ID, 5, age=86400)
+    old = [snapshot["id"] for snapshot in server.list(ORGANIZATION_ID)]
+    server.seed_orphans(OTHER_ORGANIZATION_ID, 20, age=86400)
+    # Within the grace period: a backup may still be working on them
+    server.seed_orphans(ORGANIZATION_ID, 2, age=60)
+    # Old, but not created by this tool
+    manual = server.create(ORGANIZATION_ID, {"developerNotes": "Created by hand"})
+    manual["createdDate"] -= 86400 * 1000
+    queue = DeleteQueue()
+    # Leased by a run in progress, and committed with its delete still queued
+    queue.enqueue(ORGANIZATION_ID, old[0], delay=7200)
+    queue.enqueue(ORGANIZATION_ID, old[1])
+
+    with CoveoClient(**client_options(server)) as client:
+        summary = collect_orphaned_snapshots([ORGANIZATION_ID, OTHER_ORGANIZATION_ID], older_than=3600,
+                                             concurrency=4, client=client, queue=queue)
+    queue.close()
+
+    assert summary == {ORGANIZATION_ID: {"found": 3, "deleted": 3, "failed": 0},
+                       OTHER_ORGANIZATION_ID: {"found": 20, "deleted": 20, "failed": 0}}
+    remaining = {snapshot["id"] for snapshot in server.list(ORGANIZATION_ID)}
+    assert len(remaining) == 5 and {old[0], old[1], manual["id"]} <= remaining
+    assert server.list(OTHER_ORGANIZATION_ID) == []
+
+
+def test_dry_run_deletes_nothing(fake_server, client_options):
+    server = fake_server()
+    server.seed_orphans(ORGANIZATION_ID, 3, age=86400)
+    with CoveoClient(**client_options(server)) as client:
+        summary = collect_orphaned_snapshots([ORGANIZATION_ID], older_than=3600, client=client, dry_run=True)
+    assert summary == {ORGANIZATION_ID: {"found": 3, "deleted": 0, "failed": 0}}
+    assert len(server.list(ORGANIZATION_ID)) == 3 and server.stats["deleted"] == 0